@@ -0,0 +1,111 @@
+# Сравнивает кодирование ответов бэкенда: строки JSON и двоичные кадры (Hello с binary: true).
+# Вывод и листинг настоящие: Exec и SftpList к локальному sshd из bench/suite.py, а разбирает
+# их ResponseReader из интерфейса. Для каждого случая запускается свой процесс бэкенда, чтобы
+# CPU процесса считался отдельно; в него входит и подключение, одинаковое для обоих кодирований.
+#
+#   cargo build --release
+#   python bench/framing.py --output-mb 100 --entries 100000
+import argparse
+import getpass
+import json
+import os
+import resource
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from suite import LocalSshd, find_backend
+from main import ResponseReader
+
+# Строка с кавычками, обратной косой чертой, табуляцией и не-ASCII — всё, что JSON экранирует
+LINE = "2024-05-01T12:00:00Z INFO worker=\"sync\" path=C:\\temp\\data\tразмер=4096 ok"
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_listing(workdir, entries):
+    path = os.path.join(workdir, f"list_{entries}")
+    os.makedirs(path)
+    for index in range(entries):
+        open(os.path.join(path, f"file_{index:06}.log"), "w").close()
+    return path
+
+
+def run_case(binary, sshd, command):
+    process = subprocess.Popen([find_backend()], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    backend_cpu = children_cpu()
+    if binary:
+        process.stdin.write(b'{"cmd": "Hello", "binary": true}\n')
+    connect = {"cmd": "Connect", "host": "127.0.0.1", "port": sshd.port, "username": getpass.getuser(),
+               "private_key": sshd.private_key}
+    reader = ResponseReader()
+    started = client_cpu = None
+    received = 0
+    files = 0
+    done = False
+    process.stdin.write((json.dumps(dict(connect, id=1)) + "\n").encode())
+    process.stdin.flush()
+    while not done:
+        data = os.read(process.stdout.fileno(), 1 << 20)
+        if not data:
+            raise RuntimeError("backend exited")
+        if started is not None:
+            received += len(data)
+        for _, response in reader.feed(data):
+            if response is None or response.get("status") == "hello":
+                continue
+            if response.get("status") == "error":
+                raise RuntimeError(response.get("message"))
+            if response.get("id") == 1:
+                # Подключились: замер — с отправки самой команды
+                started = time.perf_counter()
+                client_cpu = time.process_time()
+                process.stdin.write((json.dumps(dict(command, id=2)) + "\n").encode())
+                process.stdin.flush()
+            elif response.get("id") == 2:
+                if response["status"] == "files_page":
+                    files += len(response["files"])
+                elif response["status"] in ("end", "files_end"):
+                    done = True
+    elapsed = time.perf_counter() - started
+    client_cpu = time.process_time() - client_cpu
+    process.stdin.close()
+    process.wait(10)
+    return {
+        "wall_s": round(elapsed, 3),
+        "pipe_mb": round(received / (1024 * 1024), 1),
+        "backend_cpu_s": round(children_cpu() - backend_cpu, 3),
+        "client_cpu_s": round(client_cpu, 3),
+        "files": files,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output-mb", type=int, default=100)
+    parser.add_argument("--entries", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="framing-bench-") as workdir:
+        sshd = LocalSshd(workdir)
+        try:
+            output = f"yes {shlex.quote(LINE)} | head -c {args.output_mb * 1024 * 1024}"
+            cases = {
+                "output": {"cmd": "Exec", "command": output, "stream": True},
+                "listing": {"cmd": "SftpList", "path": make_listing(workdir, args.entries)},
+            }
+            results = {"output_mb": args.output_mb, "entries": args.entries}
+            for name, command in cases.items():
+                for encoding in ("json", "binary"):
+                    result = run_case(encoding == "binary", sshd, command)
+                    if name == "output":
+                        result["mb_s"] = round(args.output_mb / result["wall_s"], 1)
+                    results[f"{name}_{encoding}"] = result
+        finally:
+            sshd.close()
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,111 @@
+# Сравнивает скорость SFTP-передачи: последовательный режим (один запрос 8 КиБ за раз,
+# как было раньше), конвейерное окно запросов по одному каналу и полосы по нескольким каналам.
+#
+#   cargo build --release
+#   python bench/sftp_throughput.py --host example.org --user me --password secret --size-mb 64
+#
+# Разница заметна на каналах с большой задержкой; локально задержку можно добавить через
+# `tc qdisc add dev lo root netem delay 50ms`.
+import argparse
+import filecmp
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODES = {
+    "sequential": {"chunk_size": 8192, "window": 1, "max_window": 1, "stripes": 1},
+    "pipelined": {"stripes": 1},
+    "striped": {"stripes": 4, "stripe_threshold": 0},
+}
+
+
+class Backend:
+    def __init__(self, path):
+        self.process = subprocess.Popen([path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.next_id = 1
+
+    def call(self, command):
+        request_id = self.next_id
+        self.next_id += 1
+        self.process.stdin.write(json.dumps(dict(command, id=request_id)) + "\n")
+        self.process.stdin.flush()
+        for line in self.process.stdout:
+            response = json.loads(line)
+            if response.get("id") != request_id:
+                continue
+            if response["status"] == "error":
+                raise RuntimeError(response["message"])
+            return response
+        raise RuntimeError("backend exited")
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait(5)
+
+
+def find_backend():
+    for profile in ("release", "debug"):
+        path = os.path.join(ROOT, "target", profile, "ssh_backend")
+        if os.path.exists(path):
+            return path
+    sys.exit("ssh_backend not built, run cargo build --release")
+
+
+def run_mode(args, mode, local_file, workdir):
+    backend = Backend(find_backend())
+    connect = {"cmd": "Connect", "host": args.host, "port": args.port, "username": args.user}
+    if args.password:
+        connect["password"] = args.password
+    if args.key:
+        with open(args.key) as f:
+            connect["private_key"] = f.read()
+    connect.update(MODES[mode])
+    remote = f"{args.remote_dir.rstrip('/')}/sftp_throughput_{os.getpid()}_{mode}"
+    downloaded = os.path.join(workdir, f"download_{mode}")
+    try:
+        backend.call(connect)
+        started = time.perf_counter()
+        backend.call({"cmd": "SftpUpload", "local": local_file, "remote": remote})
+        upload_s = time.perf_counter() - started
+        started = time.perf_counter()
+        backend.call({"cmd": "SftpDownload", "remote": remote, "local": downloaded})
+        download_s = time.perf_counter() - started
+        backend.call({"cmd": "SftpRemove", "path": remote})
+    finally:
+        backend.close()
+    size_mb = os.path.getsize(local_file) / (1024 * 1024)
+    return {
+        "upload_s": upload_s,
+        "upload_mb_s": size_mb / upload_s,
+        "download_s": download_s,
+        "download_mb_s": size_mb / download_s,
+        "identical": filecmp.cmp(local_file, downloaded, shallow=False),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", required=True)
+    parser.add_argument("--port", type=int, default=22)
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password")
+    parser.add_argument("--key", help="path to an OpenSSH private key")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--remote-dir", default="/tmp")
+    parser.add_argument("--mode", choices=sorted(MODES), action="append", help="default: all modes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        local_file = os.path.join(workdir, "payload")
+        with open(local_file, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        results = {"size_mb": args.size_mb}
+        for mode in args.mode or MODES:
+            results[mode] = run_mode(args, mode, local_file, workdir)
+    print(json.dumps(results, indent=2))
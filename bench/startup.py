@@ -0,0 +1,101 @@
+# Время запуска интерфейса: от старта процесса Python до первой отрисовки главного окна
+# и до первой отрисовки вкладки подключения. Каждый прогон — новый процесс, так что в замер
+# входят запуск интерпретатора и импорт PyQt5. Цель — первая отрисовка окна быстрее 300 мс.
+#
+#   python bench/startup.py --runs 10
+#
+# Без дисплея запускать с QT_QPA_PLATFORM=offscreen. Подключение идёт к закрытому порту:
+# меряется только то, что происходит до ответа сервера.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+TARGET_MS = 300
+
+# Код дочернего процесса: те же шаги, что в `python main.py`, но вместо диалога подключения
+# вкладка создаётся сразу, а после её отрисовки процесс печатает отметки и выходит
+CHILD = """
+import json, os, sys, time
+started = float(os.environ["STARTUP_BENCH_STARTED"])
+marks = {"python_ms": (time.time() - started) * 1000}
+import main
+from PyQt5.QtCore import QEvent, QObject, QTimer
+from PyQt5.QtWidgets import QApplication
+marks["import_ms"] = (time.time() - started) * 1000
+
+
+class FirstPaint(QObject):
+    def __init__(self, name, then=None):
+        super().__init__()
+        self.name = name
+        self.then = then
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and self.name not in marks:
+            marks[self.name] = (time.time() - started) * 1000
+            if self.then is not None:
+                QTimer.singleShot(0, self.then)
+        return False
+
+
+def open_tab():
+    tab = main.BrowserTab({"host": "127.0.0.1", "port": "1", "username": "bench"})
+    tab.installEventFilter(tab_painted)
+    window.tab_widget.addTab(tab, "bench")
+
+
+def finish():
+    # Отложенный старт вкладки (локальный листинг, бэкенд, Connect) уже выполнен
+    marks["tab_started_ms"] = (time.time() - started) * 1000
+    print(json.dumps(marks))
+    sys.stdout.flush()
+    os._exit(0)
+
+
+app = QApplication(sys.argv)
+app.setStyle("Fusion")
+window = main.MainWindow()
+window_painted = FirstPaint("window_paint_ms", open_tab)
+tab_painted = FirstPaint("tab_paint_ms", lambda: QTimer.singleShot(0, finish))
+window.installEventFilter(window_painted)
+window.show()
+app.exec_()
+"""
+
+
+def run_once():
+    env = dict(os.environ, STARTUP_BENCH_STARTED=repr(time.time()))
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=os.path.join(ROOT, "ui"), env=env,
+                            capture_output=True, text=True, timeout=60).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compile_ms():
+    # `python main.py` не кэширует байткод запускаемого файла и компилирует его при каждом старте
+    with open(os.path.join(ROOT, "ui", "main.py")) as f:
+        source = f.read()
+    started = time.perf_counter()
+    compile(source, "main.py", "exec")
+    return (time.perf_counter() - started) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    # Первый прогон прогревает кэш байткода и файловый кэш и в статистику не входит
+    run_once()
+    runs = [run_once() for _ in range(args.runs)]
+    results = {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+    results["max_window_paint_ms"] = round(max(run["window_paint_ms"] for run in runs), 1)
+    results["script_compile_ms"] = round(compile_ms(), 1)
+    results["target_ms"] = TARGET_MS
+    results["within_target"] = results["window_paint_ms"] < TARGET_MS
+    print(json.dumps(results, indent=2))
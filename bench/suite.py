@@ -0,0 +1,413 @@
+# Воспроизводимый прогон производительности: поднимает sshd во временном каталоге (ключи,
+# конфиг и файлы — там же, internal-sftp), при --rtt/--bandwidth ставит перед ним прокси
+# с задержкой и ограничением полосы и гоняет ssh_backend через его протокол на stdin.
+# Меряет подключение, SftpList по размеру каталога, загрузку и выгрузку по размеру файла
+# и задержке, время Exec и стоимость разбора и отрисовки ответов в интерфейсе без дисплея.
+# Результат пишется в JSON; --compare показывает разницу двух прогонов.
+#
+#   cargo build --release
+#   python bench/suite.py --rtt 0 --rtt 50 --out bench-$(git rev-parse --short HEAD).json
+#   python bench/suite.py --compare bench-old.json bench-new.json
+#
+# Нужен OpenSSH sshd (ищется в PATH и /usr/sbin).
+import argparse
+import asyncio
+import filecmp
+import getpass
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# Страница files_page, как LIST_PAGE_SIZE в src/main.rs
+LIST_PAGE_SIZE = 1000
+sys.path.insert(0, os.path.join(ROOT, "ui"))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication, QWidget  # noqa: E402
+
+import main  # noqa: E402
+
+SSHD_CONFIG = """\
+Port {port}
+ListenAddress 127.0.0.1
+HostKey {dir}/host_ed25519
+PidFile {dir}/sshd.pid
+AuthorizedKeysFile {dir}/authorized_keys
+StrictModes no
+PasswordAuthentication no
+KbdInteractiveAuthentication no
+UsePAM no
+Subsystem sftp internal-sftp
+LogLevel ERROR
+"""
+
+
+def find_backend():
+    for profile in ("release", "debug"):
+        path = os.path.join(ROOT, "target", profile, "ssh_backend")
+        if os.path.exists(path):
+            return path
+    sys.exit("ssh_backend not built, run cargo build --release")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listens on port {port}")
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {
+        "median_ms": round(statistics.median(samples) * 1000, 2),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+        "min_ms": round(samples[0] * 1000, 2),
+    }
+
+
+class LocalSshd:
+    def __init__(self, workdir):
+        self.dir = os.path.join(workdir, "sshd")
+        os.makedirs(self.dir)
+        sshd = shutil.which("sshd") or next((path for path in ("/usr/sbin/sshd", "/usr/local/sbin/sshd")
+                                             if os.path.exists(path)), None)
+        if sshd is None:
+            sys.exit("OpenSSH sshd not found")
+        for name in ("host_ed25519", "client_ed25519"):
+            subprocess.run(["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-f", os.path.join(self.dir, name)],
+                           check=True)
+        shutil.copy(os.path.join(self.dir, "client_ed25519.pub"), os.path.join(self.dir, "authorized_keys"))
+        with open(os.path.join(self.dir, "client_ed25519")) as f:
+            self.private_key = f.read()
+        self.port = free_port()
+        config = os.path.join(self.dir, "sshd_config")
+        with open(config, "w") as f:
+            f.write(SSHD_CONFIG.format(port=self.port, dir=self.dir))
+        # sshd требует абсолютный путь к себе
+        self.process = subprocess.Popen([os.path.abspath(sshd), "-D", "-e", "-f", config])
+        wait_for_port(self.port)
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait(5)
+
+
+class LatencyProxy:
+    # TCP-прокси в своём потоке: каждый кусок данных доставляется через rtt/2 в каждую сторону,
+    # а при заданной полосе — не быстрее неё. Порядок данных сохраняется
+    def __init__(self, target_port, rtt_ms, bandwidth_kbps):
+        self.target_port = target_port
+        self.delay = rtt_ms / 2000
+        self.rate = bandwidth_kbps * 1024 / 8 if bandwidth_kbps else None
+        self.port = free_port()
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self.handle, "127.0.0.1", self.port))
+        self.ready.set()
+        self.loop.run_forever()
+        server.close()
+
+    async def handle(self, client_reader, client_writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+        await asyncio.gather(self.pipe(client_reader, upstream_writer), self.pipe(upstream_reader, client_writer),
+                             return_exceptions=True)
+
+    async def pipe(self, reader, writer):
+        queue = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                due, data = await queue.get()
+                if data is None:
+                    break
+                await asyncio.sleep(max(0.0, due - self.loop.time()))
+                writer.write(data)
+                await writer.drain()
+                if self.rate:
+                    await asyncio.sleep(len(data) / self.rate)
+            writer.close()
+
+        sender = self.loop.create_task(deliver())
+        while True:
+            data = await reader.read(65536)
+            await queue.put((self.loop.time() + self.delay, data or None))
+            if not data:
+                break
+        await sender
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+class Backend:
+    # Клиент протокола, как в интерфейсе: двоичные кадры и ResponseReader
+    def __init__(self):
+        self.process = subprocess.Popen([find_backend()], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.reader = main.ResponseReader()
+        self.next_id = 1
+        self.send({"cmd": "Hello", "binary": True})
+
+    def send(self, command):
+        self.process.stdin.write((json.dumps(command) + "\n").encode())
+        self.process.stdin.flush()
+
+    def call(self, command, capture=None):
+        # Возвращает ответ, время до первого промежуточного кадра и полное время (в секундах)
+        request_id = self.next_id
+        self.next_id += 1
+        started = time.perf_counter()
+        first = None
+        self.send(dict(command, id=request_id))
+        while True:
+            data = os.read(self.process.stdout.fileno(), 1 << 20)
+            if not data:
+                raise RuntimeError("backend exited")
+            if capture is not None:
+                capture.append(data)
+            for _, response in self.reader.feed(data):
+                if response is None or response.get("id") != request_id:
+                    continue
+                if response["status"] in main.PARTIAL_STATUSES:
+                    if first is None:
+                        first = time.perf_counter() - started
+                    continue
+                if response["status"] == "error":
+                    raise RuntimeError(f"{command['cmd']}: {response.get('message')}")
+                return response, first, time.perf_counter() - started
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait(10)
+
+
+def connect(backend, port, private_key):
+    response, _, elapsed = backend.call({"cmd": "Connect", "host": "127.0.0.1", "port": port,
+                                         "username": getpass.getuser(), "private_key": private_key,
+                                         "list_home": True})
+    return {"wall_ms": round(elapsed * 1000, 2), "timings": response.get("timings")}
+
+
+def bench_listing(backend, workdir, sizes, repeat):
+    results = {}
+    for size in sizes:
+        path = os.path.join(workdir, f"list_{size}")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            for index in range(size):
+                open(os.path.join(path, f"file_{index:06}.txt"), "w").close()
+        first, total = [], []
+        for _ in range(repeat):
+            _, first_page, elapsed = backend.call({"cmd": "SftpList", "path": path})
+            first.append(first_page or elapsed)
+            total.append(elapsed)
+        results[str(size)] = {"first_page": summary(first), "total": summary(total)}
+    return results
+
+
+def bench_transfers(backend, workdir, sizes_mb):
+    results = {}
+    for size_mb in sizes_mb:
+        local = os.path.join(workdir, f"payload_{size_mb}")
+        if not os.path.exists(local):
+            with open(local, "wb") as f:
+                for _ in range(size_mb):
+                    f.write(os.urandom(1024 * 1024))
+        remote = os.path.join(workdir, f"remote_{size_mb}")
+        downloaded = os.path.join(workdir, f"download_{size_mb}")
+        for path in (remote, downloaded):
+            if os.path.exists(path):
+                os.remove(path)
+        _, _, upload = backend.call({"cmd": "SftpUpload", "local": local, "remote": remote})
+        _, _, download = backend.call({"cmd": "SftpDownload", "remote": remote, "local": downloaded})
+        results[str(size_mb)] = {
+            "upload_mb_s": round(size_mb / upload, 2),
+            "download_mb_s": round(size_mb / download, 2),
+            "identical": filecmp.cmp(local, downloaded, shallow=False),
+        }
+    return results
+
+
+def bench_exec(backend, repeat):
+    samples = [backend.call({"cmd": "Exec", "command": "true"})[2] for _ in range(repeat)]
+    return summary(samples)
+
+
+def run_link(sshd, workdir, rtt_ms, bandwidth_kbps, args):
+    proxy = LatencyProxy(sshd.port, rtt_ms, bandwidth_kbps) if rtt_ms or bandwidth_kbps else None
+    backend = Backend()
+    try:
+        port = proxy.port if proxy else sshd.port
+        result = {"connect": connect(backend, port, sshd.private_key)}
+        result["list"] = bench_listing(backend, workdir, args.list_sizes, args.repeat)
+        result["transfer"] = bench_transfers(backend, workdir, args.file_sizes)
+        result["exec"] = bench_exec(backend, args.repeat * 4)
+        return result
+    finally:
+        backend.close()
+        if proxy:
+            proxy.close()
+
+
+def files_frame(files):
+    # Страница листинга так, как её кодирует src/framing.rs после Hello с binary: true
+    header = json.dumps({"id": 1, "status": "files_page", "count": len(files)}).encode()
+    payload = bytes((main.FRAME_DIR if file["is_dir"] else 0) | (main.FRAME_MTIME if file["mtime"] is not None else 0)
+                    for file in files)
+    payload += struct.pack(f"<{len(files)}Q", *(file["size"] for file in files))
+    payload += struct.pack(f"<{len(files)}I", *(file["mtime"] or 0 for file in files))
+    payload += "\0".join(file["name"] for file in files).encode()
+    return bytes([main.FRAME_MARKER]) + main.FRAME_LENGTHS.pack(len(header), len(payload)) + header + payload
+
+
+def parse_ms(data, entries):
+    started = time.perf_counter()
+    parsed = main.ResponseReader().feed(data)
+    elapsed = time.perf_counter() - started
+    assert sum(len(response["files"]) for _, response in parsed) == entries
+    return round(elapsed * 1000, 2)
+
+
+def bench_client(entries, output_mb):
+    # Разбор ответов и отрисовка без бэкенда: те же классы, что в интерфейсе. Листинг разбирается
+    # в обоих кодированиях; интерфейс договаривается о двоичных кадрах, строки JSON — для сравнения
+    app = QApplication.instance() or QApplication(sys.argv)
+    files = [{"name": f"file_{i:06}.txt", "is_dir": i % 10 == 0, "size": i * 4096, "mtime": 1700000000 + i}
+             for i in range(entries)]
+    pages = [files[i:i + LIST_PAGE_SIZE] for i in range(0, entries, LIST_PAGE_SIZE)]
+    binary = b"".join(files_frame(page) for page in pages)
+    lines = "".join(json.dumps({"id": 1, "status": "files_page", "files": page}) + "\n" for page in pages).encode()
+    parse_binary_ms = parse_ms(binary, entries)
+    parse_json_ms = parse_ms(lines, entries)
+
+    host = QWidget()
+    host.current_path = "/bench"
+    view = main.UnifiedFileSystemView(host, is_remote=True)
+    view.resize(800, 600)
+    view.show()
+    started = time.perf_counter()
+    view.update_remote_files(files)
+    app.processEvents()
+    render_list_s = time.perf_counter() - started
+
+    tab = SimpleNamespace(connection_data={"username": "bench", "host": "localhost"},
+                          current_path="/", home_dir="/")
+    terminal = main.TerminalWidget(browser_tab=tab)
+    terminal.resize(800, 600)
+    terminal.show()
+    line = "x" * 99 + "\n"
+    chunk = line * (32 * 1024 // len(line))
+    started = time.perf_counter()
+    for _ in range(output_mb * 1024 * 1024 // len(chunk)):
+        terminal.append_stream(chunk)
+    while terminal.pending_output:
+        terminal._process_output()
+    app.processEvents()
+    render_output_s = time.perf_counter() - started
+    return {
+        "parse_listing_ms": parse_binary_ms,
+        "parse_listing_json_ms": parse_json_ms,
+        "render_listing_ms": round(render_list_s * 1000, 2),
+        "render_output_mb_s": round(output_mb / render_output_s, 2),
+        "entries": entries,
+        "output_mb": output_mb,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(base_path, new_path):
+    with open(base_path) as f:
+        base = dict(flatten(json.load(f)["results"]))
+    with open(new_path) as f:
+        new = dict(flatten(json.load(f)["results"]))
+    for key in sorted(base.keys() & new.keys()):
+        if base[key]:
+            change = (new[key] - base[key]) / base[key] * 100
+            print(f"{key:70} {base[key]:>12} {new[key]:>12} {change:+8.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rtt", type=int, action="append", help="added round trip, ms (default: 0)")
+    parser.add_argument("--bandwidth", type=int, default=0, help="link limit, kbit/s (0: unlimited)")
+    parser.add_argument("--list-sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--file-sizes", type=int, nargs="+", default=[1, 16, 128], help="MB")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--client-entries", type=int, default=100000)
+    parser.add_argument("--client-output-mb", type=int, default=20)
+    parser.add_argument("--skip-server", action="store_true", help="only the client-side parse/render part")
+    parser.add_argument("--out", help="write results here (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    results = {"client": bench_client(args.client_entries, args.client_output_mb)}
+    if not args.skip_server:
+        with tempfile.TemporaryDirectory(prefix="ssh-gui-bench-") as workdir:
+            sshd = LocalSshd(workdir)
+            try:
+                for rtt in args.rtt or [0]:
+                    results[f"rtt_{rtt}ms"] = run_link(sshd, workdir, rtt, args.bandwidth, args)
+            finally:
+                sshd.close()
+    report = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "params": {"bandwidth_kbps": args.bandwidth, "list_sizes": args.list_sizes, "file_sizes_mb": args.file_sizes,
+                   "repeat": args.repeat},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
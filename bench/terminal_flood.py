@@ -0,0 +1,79 @@
+# Заливает TerminalWidget синтетическим выводом и меряет, насколько отстаёт цикл событий GUI.
+#
+#   python bench/terminal_flood.py --rate 50 --seconds 5
+#
+# Без дисплея запускать с QT_QPA_PLATFORM=offscreen.
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ui"))
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+
+import main
+
+
+def run(rate_mb, seconds, chunk_kb):
+    app = QApplication.instance() or QApplication(sys.argv)
+    tab = SimpleNamespace(connection_data={"username": "bench", "host": "localhost"},
+                          current_path="/", home_dir="/")
+    terminal = main.TerminalWidget(browser_tab=tab)
+    terminal.resize(800, 600)
+    terminal.show()
+
+    line = "x" * 99 + "\n"
+    chunk = line * max(1, chunk_kb * 1024 // len(line))
+    budget = rate_mb * 1024 * 1024
+    sent = 0
+    lags = []
+    started = time.perf_counter()
+    last_beat = started
+
+    def produce():
+        nonlocal sent
+        elapsed = time.perf_counter() - started
+        while sent < budget * elapsed:
+            terminal.append_stream(chunk)
+            sent += len(chunk)
+
+    def heartbeat():
+        nonlocal last_beat
+        now = time.perf_counter()
+        lags.append((now - last_beat) * 1000 - 5)
+        last_beat = now
+        if now - started >= seconds:
+            app.quit()
+
+    producer = QTimer()
+    producer.timeout.connect(produce)
+    producer.start(1)
+    beat = QTimer()
+    beat.timeout.connect(heartbeat)
+    beat.start(5)
+    app.exec_()
+
+    lags.sort()
+    return {
+        "rate_mb_s": rate_mb,
+        "seconds": seconds,
+        "sent_bytes": sent,
+        "achieved_mb_s": sent / (time.perf_counter() - started) / (1024 * 1024),
+        "event_loop_lag_p50_ms": lags[len(lags) // 2] if lags else 0,
+        "event_loop_lag_max_ms": lags[-1] if lags else 0,
+        "terminal": terminal.output_stats,
+        "document_blocks": terminal.document().blockCount(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=50, help="MB/s of synthetic output")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--chunk-kb", type=int, default=32, help="size of one backend chunk")
+    args = parser.parse_args()
+    print(json.dumps(run(args.rate, args.seconds, args.chunk_kb), indent=2))
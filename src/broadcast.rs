@@ -0,0 +1,191 @@
+// Выполнение одной команды сразу на группе серверов: хосты обрабатывает ограниченный пул,
+// у каждого свой тайм-аут, и результат уходит клиенту, как только хост ответил
+
+use crate::{ConnectParams, ConnectTimings, Connections};
+use anyhow::Result;
+use futures::stream::{self, StreamExt};
+use russh::client::Handle;
+use russh::ChannelMsg;
+use serde::{Deserialize, Serialize};
+use std::time::{Duration, Instant};
+
+pub const DEFAULT_CONCURRENCY: usize = 32;
+pub const DEFAULT_TIMEOUT: f64 = 30.0;
+// Больше этого вывода с одного хоста не храним: на сотнях хостов он занял бы всю память
+const OUTPUT_LIMIT: usize = 64 * 1024;
+
+#[derive(Deserialize, Clone)]
+pub struct Target {
+    pub host: String,
+    #[serde(default = "default_port")]
+    pub port: u16,
+    pub username: String,
+}
+
+fn default_port() -> u16 {
+    22
+}
+
+impl Target {
+    fn label(&self) -> String {
+        if self.port == 22 {
+            format!("{}@{}", self.username, self.host)
+        } else {
+            format!("{}@{}:{}", self.username, self.host, self.port)
+        }
+    }
+}
+
+#[derive(Serialize)]
+pub struct HostResult {
+    pub host: String,
+    // ok, failed (ненулевой код или ошибка) или timeout
+    pub state: &'static str,
+    pub code: Option<u32>,
+    pub signal: Option<String>,
+    pub output: String,
+    pub truncated: bool,
+    pub error: Option<String>,
+    pub elapsed_ms: f64,
+}
+
+#[derive(Serialize, Default)]
+pub struct Summary {
+    pub hosts: usize,
+    pub ok: usize,
+    pub failed: usize,
+    pub timed_out: usize,
+    pub elapsed_ms: f64,
+}
+
+pub enum Event {
+    Started(String),
+    Finished(HostResult),
+}
+
+pub struct Auth {
+    pub password: Option<String>,
+    pub private_key: Option<String>,
+}
+
+pub async fn run(
+    connections: &Connections,
+    targets: Vec<Target>,
+    command: &str,
+    auth: &Auth,
+    concurrency: usize,
+    timeout: Duration,
+    report: &(dyn Fn(Event) + Sync),
+) -> Summary {
+    let started = Instant::now();
+    let mut summary = Summary { hosts: targets.len(), ..Summary::default() };
+    let mut results = stream::iter(targets)
+        .map(|target| run_host(connections, target, command, auth, timeout, report))
+        .buffer_unordered(concurrency.max(1));
+    while let Some(result) = results.next().await {
+        match result.state {
+            "ok" => summary.ok += 1,
+            "timeout" => summary.timed_out += 1,
+            _ => summary.failed += 1,
+        }
+        report(Event::Finished(result));
+    }
+    summary.elapsed_ms = crate::elapsed_ms(started);
+    summary
+}
+
+async fn run_host(
+    connections: &Connections,
+    target: Target,
+    command: &str,
+    auth: &Auth,
+    timeout: Duration,
+    report: &(dyn Fn(Event) + Sync),
+) -> HostResult {
+    let host = target.label();
+    report(Event::Started(host.clone()));
+    let started = Instant::now();
+    // Соединение берётся из общего пула: если к хосту уже открыта вкладка с теми же данными входа,
+    // рукопожатия не будет. С другим паролем или ключом открывается своё соединение
+    let work = async {
+        let params = ConnectParams::new(target.host, target.port, target.username, auth.password.clone(), auth.private_key.clone());
+        let (handle, _) = connections.get_or_connect(&params, &mut ConnectTimings::default()).await?;
+        exec(&handle, command).await
+    };
+    let mut result = HostResult {
+        host,
+        state: "failed",
+        code: None,
+        signal: None,
+        output: String::new(),
+        truncated: false,
+        error: None,
+        elapsed_ms: 0.0,
+    };
+    match tokio::time::timeout(timeout, work).await {
+        Ok(Ok(output)) => {
+            result.state = if output.code == Some(0) { "ok" } else { "failed" };
+            result.code = output.code;
+            result.signal = output.signal;
+            result.output = String::from_utf8_lossy(&output.data).into_owned();
+            result.truncated = output.truncated;
+        }
+        Ok(Err(e)) => result.error = Some(e.to_string()),
+        Err(_) => {
+            result.state = "timeout";
+            result.error = Some(format!("No answer in {:.0} s", timeout.as_secs_f64()));
+        }
+    }
+    result.elapsed_ms = crate::elapsed_ms(started);
+    result
+}
+
+struct Output {
+    data: Vec<u8>,
+    truncated: bool,
+    code: Option<u32>,
+    signal: Option<String>,
+}
+
+// stdout и stderr идут одним потоком, как в терминале
+async fn exec(handle: &Handle<crate::Client>, command: &str) -> Result<Output> {
+    let mut channel = handle.channel_open_session().await?;
+    channel.exec(true, command).await?;
+    let mut output = Output { data: Vec::new(), truncated: false, code: None, signal: None };
+    while let Some(msg) = channel.wait().await {
+        match msg {
+            ChannelMsg::Data { data } | ChannelMsg::ExtendedData { data, .. } => {
+                let room = OUTPUT_LIMIT - output.data.len();
+                output.truncated |= data.len() > room;
+                output.data.extend_from_slice(&data[..data.len().min(room)]);
+            }
+            ChannelMsg::ExitStatus { exit_status } => output.code = Some(exit_status),
+            ChannelMsg::ExitSignal { signal_name, .. } => output.signal = Some(format!("{:?}", signal_name)),
+            ChannelMsg::Close => break,
+            _ => {}
+        }
+    }
+    Ok(output)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::sync::Mutex;
+
+    #[tokio::test]
+    async fn hosts_without_credentials_fail() {
+        let targets = vec![Target { host: "example.org".into(), port: 22, username: "user".into() }];
+        let auth = Auth { password: None, private_key: None };
+        let results = Mutex::new(Vec::new());
+        let report = |event| {
+            if let Event::Finished(result) = event {
+                results.lock().unwrap().push(result);
+            }
+        };
+        let summary = run(&Connections::default(), targets, "id", &auth, 4, Duration::from_secs(5), &report).await;
+        assert_eq!((summary.hosts, summary.failed), (1, 1));
+        let results = results.into_inner().unwrap();
+        assert_eq!(results[0].error.as_deref(), Some("Missing auth method"));
+    }
+}
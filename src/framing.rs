@@ -0,0 +1,177 @@
+// Кодирование ответов в stdout. По умолчанию каждый ответ — строка JSON. После Hello с
+// binary: true объёмные ответы (вывод команд и страницы листинга) идут двоичными кадрами:
+//
+//   0x00 | u32 LE длина заголовка | u32 LE длина данных | заголовок JSON | данные
+//
+// Строка JSON с нулевого байта начаться не может, поэтому клиент различает их по первому байту.
+// Данные не экранируются и не проходят через UTF-8: вывод уходит байтами как есть, а листинг —
+// колонками: флаги (u8 на файл: 1 — каталог, 2 — есть mtime), размеры (u64 LE), mtime (u32 LE)
+// и имена через \0
+
+use crate::{FileEntry, Reply, Response};
+use anyhow::Result;
+use serde::{Serialize, Serializer};
+
+pub const FRAME_MARKER: u8 = 0;
+const FLAG_DIR: u8 = 1;
+const FLAG_MTIME: u8 = 2;
+
+// Данные кадра chunk: в двоичном режиме — байты как есть, иначе — уже склеенная строка UTF-8
+pub enum Payload {
+    Text(String),
+    Bytes(Vec<u8>),
+}
+
+impl Serialize for Payload {
+    fn serialize<S: Serializer>(&self, serializer: S) -> Result<S::Ok, S::Error> {
+        match self {
+            Payload::Text(text) => serializer.serialize_str(text),
+            Payload::Bytes(data) => serializer.serialize_str(&String::from_utf8_lossy(data)),
+        }
+    }
+}
+
+#[derive(Serialize)]
+struct Header<'a> {
+    #[serde(skip_serializing_if = "Option::is_none")]
+    id: Option<u64>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    session: Option<&'a str>,
+    status: &'static str,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    stream: Option<&'static str>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    count: Option<usize>,
+}
+
+pub fn encode(buffer: &mut Vec<u8>, reply: &Reply, binary: bool) -> Result<()> {
+    if binary {
+        let header = |status, stream, count| Header {
+            id: reply.id,
+            session: reply.session.as_deref(),
+            status,
+            stream,
+            count,
+        };
+        match &reply.response {
+            Response::Chunk { stream, data: Payload::Bytes(data) } => {
+                return write_frame(buffer, &header("chunk", Some(*stream), None), |out| out.extend_from_slice(data));
+            }
+            Response::FilesPage { files } => {
+                return write_frame(buffer, &header("files_page", None, Some(files.len())), |out| encode_files(out, files));
+            }
+            _ => {}
+        }
+    }
+    serde_json::to_writer(&mut *buffer, reply)?;
+    buffer.push(b'\n');
+    Ok(())
+}
+
+fn write_frame(buffer: &mut Vec<u8>, header: &Header, payload: impl FnOnce(&mut Vec<u8>)) -> Result<()> {
+    let start = buffer.len();
+    buffer.push(FRAME_MARKER);
+    buffer.extend_from_slice(&[0; 8]);
+    serde_json::to_writer(&mut *buffer, header)?;
+    let header_end = buffer.len();
+    payload(buffer);
+    let header_len = (header_end - start - 9) as u32;
+    let payload_len = (buffer.len() - header_end) as u32;
+    buffer[start + 1..start + 5].copy_from_slice(&header_len.to_le_bytes());
+    buffer[start + 5..start + 9].copy_from_slice(&payload_len.to_le_bytes());
+    Ok(())
+}
+
+fn encode_files(out: &mut Vec<u8>, files: &[FileEntry]) {
+    out.extend(files.iter().map(|file| {
+        (if file.is_dir { FLAG_DIR } else { 0 }) | (if file.mtime.is_some() { FLAG_MTIME } else { 0 })
+    }));
+    for file in files {
+        out.extend_from_slice(&file.size.to_le_bytes());
+    }
+    for file in files {
+        out.extend_from_slice(&file.mtime.unwrap_or(0).to_le_bytes());
+    }
+    for (index, file) in files.iter().enumerate() {
+        if index > 0 {
+            out.push(0);
+        }
+        out.extend_from_slice(file.name.as_bytes());
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn reply(response: Response) -> Reply {
+        Reply { id: Some(7), session: Some("tab".into()), trace: None, response }
+    }
+
+    // Разбирает один кадр: (заголовок, данные, остаток буфера)
+    fn split_frame(buffer: &[u8]) -> (serde_json::Value, &[u8], &[u8]) {
+        assert_eq!(buffer[0], FRAME_MARKER);
+        let header_len = u32::from_le_bytes(buffer[1..5].try_into().unwrap()) as usize;
+        let payload_len = u32::from_le_bytes(buffer[5..9].try_into().unwrap()) as usize;
+        let header = serde_json::from_slice(&buffer[9..9 + header_len]).unwrap();
+        let payload = &buffer[9 + header_len..9 + header_len + payload_len];
+        (header, payload, &buffer[9 + header_len + payload_len..])
+    }
+
+    #[test]
+    fn chunk_frame_keeps_raw_bytes() {
+        let data = vec![0, 0xff, b'\n', 0xc3];
+        let mut buffer = Vec::new();
+        let chunk = Response::Chunk { stream: "stdout", data: Payload::Bytes(data.clone()) };
+        encode(&mut buffer, &reply(chunk), true).unwrap();
+        let (header, payload, rest) = split_frame(&buffer);
+        assert_eq!(header, serde_json::json!({"id": 7, "session": "tab", "status": "chunk", "stream": "stdout"}));
+        assert_eq!(payload, &data[..]);
+        assert!(rest.is_empty());
+    }
+
+    #[test]
+    fn files_page_is_columns() {
+        let files = vec![
+            FileEntry { name: "dir".into(), is_dir: true, size: 4096, mtime: Some(1_700_000_000) },
+            FileEntry { name: "файл".into(), is_dir: false, size: 1 << 40, mtime: None },
+        ];
+        let mut buffer = Vec::new();
+        encode(&mut buffer, &reply(Response::FilesPage { files }), true).unwrap();
+        let (header, payload, _) = split_frame(&buffer);
+        assert_eq!(header["count"], 2);
+        let mut expected = vec![FLAG_DIR | FLAG_MTIME, 0];
+        expected.extend_from_slice(&4096u64.to_le_bytes());
+        expected.extend_from_slice(&(1u64 << 40).to_le_bytes());
+        expected.extend_from_slice(&1_700_000_000u32.to_le_bytes());
+        expected.extend_from_slice(&0u32.to_le_bytes());
+        expected.extend_from_slice("dir\0файл".as_bytes());
+        assert_eq!(payload, &expected[..]);
+    }
+
+    #[test]
+    fn other_replies_stay_json_lines() {
+        let mut buffer = Vec::new();
+        encode(&mut buffer, &reply(Response::Ok), true).unwrap();
+        encode(&mut buffer, &reply(Response::Chunk { stream: "stderr", data: Payload::Text("é\n".into()) }), false).unwrap();
+        let lines: Vec<serde_json::Value> = buffer
+            .split(|&byte| byte == b'\n')
+            .filter(|line| !line.is_empty())
+            .map(|line| serde_json::from_slice(line).unwrap())
+            .collect();
+        assert_eq!(lines[0], serde_json::json!({"id": 7, "session": "tab", "status": "ok"}));
+        assert_eq!(lines[1]["data"], "é\n");
+        assert_ne!(buffer[0], FRAME_MARKER);
+    }
+
+    #[test]
+    fn frames_follow_each_other() {
+        let mut buffer = Vec::new();
+        for data in [b"one".to_vec(), Vec::new()] {
+            encode(&mut buffer, &reply(Response::Chunk { stream: "stdout", data: Payload::Bytes(data) }), true).unwrap();
+        }
+        let (_, first, rest) = split_frame(&buffer);
+        let (_, second, rest) = split_frame(rest);
+        assert_eq!((first, second, rest), (&b"one"[..], &b""[..], &b""[..]));
+    }
+}
@@ -1,15 +1,45 @@
+mod broadcast;
+mod framing;
+mod sync;
+mod transfer;
+
 use anyhow::{anyhow, Result};
-use russh::{client, Disconnect};
+use russh::{client, ChannelMsg, Disconnect, Sig};
 use russh::client::{Config, Handle};
 use russh::keys::{HashAlg, PrivateKey, PrivateKeyWithHashAlg};
-use russh_sftp::client::SftpSession;
-use russh_sftp::protocol::OpenFlags;
+use russh_sftp::client::error::Error as SftpError;
+use russh_sftp::client::{RawSftpSession, SftpSession};
+use russh_sftp::protocol::{OpenFlags, StatusCode};
 use serde::{Deserialize, Serialize};
-use std::sync::Arc;
+use sha2::{Digest, Sha256};
+use std::collections::HashMap;
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex, Weak};
+use std::time::{Duration, Instant, SystemTime, UNIX_EPOCH};
 use tokio::io::{AsyncBufReadExt, BufReader};
-use tokio::fs::File;
-use tokio::io::{AsyncReadExt, AsyncWriteExt};
-use std::path::Path;
+use tokio::io::AsyncWriteExt;
+use tokio::sync::{mpsc, watch, Notify, Semaphore};
+use framing::Payload;
+use transfer::{Control, Copied, Direction, FileOptions, Meter, TransferOptions};
+
+const DEFAULT_MAX_INFLIGHT: usize = 8;
+const LIST_PAGE_SIZE: usize = 1000;
+// Фоновые команды (предзагрузка каталогов) занимают не больше стольких слотов сессии
+const BACKGROUND_SLOTS: usize = 1;
+// Сколько передач файлов идёт одновременно, остальные ждут в очереди
+const DEFAULT_MAX_TRANSFERS: usize = 4;
+// Файлы от этого размера передаются полосами по нескольким SFTP-каналам
+const DEFAULT_STRIPES: usize = 4;
+const DEFAULT_STRIPE_THRESHOLD: u64 = 256 * 1024 * 1024;
+// Keepalive: мёртвое соединение обнаруживается примерно за interval * (max + 1) секунд
+const DEFAULT_KEEPALIVE_INTERVAL: u64 = 5;
+const DEFAULT_KEEPALIVE_MAX: usize = 2;
+const DEFAULT_RECONNECT_ATTEMPTS: usize = 10;
+const RECONNECT_MIN_DELAY: Duration = Duration::from_millis(500);
+const RECONNECT_MAX_DELAY: Duration = Duration::from_secs(30);
+const CONNECT_TIMEOUT: Duration = Duration::from_secs(15);
+// Помимо сигнала russh о разрыве сторож сессии раз в столько проверяет её сам
+const LINK_CHECK_INTERVAL: Duration = Duration::from_secs(1);
 
 #[tokio::main]
 async fn main() -> Result<()> {
@@ -21,20 +51,616 @@ async fn process_input() -> Result<()> {
     let stdin = tokio::io::stdin();
     let reader = BufReader::new(stdin);
     let mut lines = reader.lines();
-    let mut session: Option<Session> = None;
+    // Один процесс обслуживает все вкладки: у каждой своя сессия, id сессии приходит в запросе
+    let mut sessions: HashMap<String, Arc<SessionSlot>> = HashMap::new();
+    let connections: Arc<Connections> = Arc::default();
+
+    let (tx, rx) = mpsc::unbounded_channel();
+    let responder = Responder { tx, binary: Arc::default() };
+    let writer = tokio::spawn(write_replies(rx, responder.binary.clone()));
+    let running: Running = Arc::default();
 
     while let Some(line) = lines.next_line().await? {
-        let cmd: Result<Command, _> = serde_json::from_str(&line);
-        let response = match cmd {
-            Ok(command) => handle_command(&mut session, command).await,
-            Err(e) => Response::Error { message: e.to_string() },
+        let request: Request = match serde_json::from_str(&line) {
+            Ok(request) => request,
+            Err(e) => {
+                responder.send(request_id(&line), Response::Error { message: e.to_string() });
+                continue;
+            }
         };
-        println!("{}", serde_json::to_string(&response)?);
+
+        // Connect/Disconnect меняют набор сессий, поэтому разбираются здесь по порядку,
+        // остальные команды уходят в отдельные задачи и отвечают по мере готовности
+        // Отметки времени только по запросу клиента: без "trace" запрос ничего не замеряет
+        let received = request.trace.then(now_us);
+
+        match request.command {
+            Command::Connect {
+                host, port, username, password, private_key, max_inflight, max_transfers, chunk_size, window, max_window,
+                stripes, stripe_threshold, keepalive_interval, keepalive_max, reconnect_attempts, list_home,
+            } => {
+                let defaults = ConnectParams::new(host, port, username, password, private_key);
+                let params = ConnectParams {
+                    max_inflight: max_inflight.unwrap_or(DEFAULT_MAX_INFLIGHT).max(1),
+                    max_transfers: max_transfers.unwrap_or(DEFAULT_MAX_TRANSFERS).max(1),
+                    transfer: TransferOptions::new(chunk_size, window, max_window),
+                    striping: Striping {
+                        stripes: stripes.unwrap_or(DEFAULT_STRIPES).max(1),
+                        threshold: stripe_threshold.unwrap_or(DEFAULT_STRIPE_THRESHOLD),
+                    },
+                    keepalive_interval: Duration::from_secs(keepalive_interval.unwrap_or(DEFAULT_KEEPALIVE_INTERVAL).max(1)),
+                    keepalive_max: keepalive_max.unwrap_or(DEFAULT_KEEPALIVE_MAX),
+                    reconnect_attempts: reconnect_attempts.unwrap_or(DEFAULT_RECONNECT_ATTEMPTS),
+                    ..defaults
+                };
+                // Подключение идёт в своей задаче и не задерживает другие сессии; команды этой
+                // сессии, пришедшие следом, ждут его на слоте
+                let (stop, stopped) = watch::channel(false);
+                let slot = Arc::new(SessionSlot {
+                    id: request.session.clone(),
+                    session: Arc::default(),
+                    connections: connections.clone(),
+                    responder: responder.clone(),
+                    stop,
+                });
+                let mut connecting = slot.session.clone().try_write_owned().expect("new slot is not locked");
+                // Задача держит слот только по слабой ссылке, а ответчик — только до ответа на Connect:
+                // иначе слот пережил бы Disconnect, а процесс — конец stdin
+                let watched = Arc::downgrade(&slot);
+                sessions.insert(request.session, slot);
+                let connections = connections.clone();
+                let responder = responder.clone();
+                tokio::spawn(async move {
+                    match Session::connect(&connections, params, list_home).await {
+                        Ok((sess, welcome)) => {
+                            *connecting = Some(Arc::new(sess));
+                            drop(connecting);
+                            responder.finish(request.id, Response::Connected(welcome), received);
+                        }
+                        Err(e) => {
+                            responder.finish(request.id, Response::Error { message: e.to_string() }, received);
+                            return;
+                        }
+                    }
+                    drop(responder);
+                    watch_link(watched, stopped).await;
+                });
+            }
+            Command::Disconnect => {
+                // Сторож слота и все команды сессии заканчиваются вместе с ней
+                if let Some(slot) = sessions.remove(&request.session) {
+                    slot.stop.send_replace(true);
+                }
+                for handle in running.lock().unwrap().values().filter(|handle| handle.session == request.session) {
+                    handle.cancel.notify_one();
+                }
+                responder.send(request.id, Response::Disconnected);
+            }
+            // Клиент сообщает, что понимает двоичные кадры; старый бэкенд ответит ошибкой
+            // разбора, и клиент останется на JSON
+            Command::Hello { binary } => {
+                responder.binary.store(binary, Ordering::Relaxed);
+                responder.send(request.id, Response::Hello { binary });
+            }
+            Command::Cancel { target } => {
+                let response = match running.lock().unwrap().get(&target) {
+                    Some(handle) => {
+                        handle.cancel.notify_one();
+                        Response::Ok
+                    }
+                    None => Response::Error { message: format!("No running request {}", target) },
+                };
+                responder.send(request.id, response);
+            }
+            Command::Pause { target } | Command::Resume { target } => {
+                let pause = matches!(request.command, Command::Pause { .. });
+                let response = match running.lock().unwrap().get(&target) {
+                    Some(JobHandle { paused: Some(paused), .. }) => {
+                        paused.send_replace(pause);
+                        Response::Ok
+                    }
+                    Some(_) => Response::Error { message: format!("Request {} cannot be paused", target) },
+                    None => Response::Error { message: format!("No running request {}", target) },
+                };
+                responder.send(request.id, response);
+            }
+            // Ввод в shell идёт без подтверждений: ответ на каждое нажатие клавиши — лишний трафик
+            Command::ShellInput { target, data } => {
+                forward_to_shell(&running, &responder, request.id, target, ShellControl::Data(data));
+            }
+            Command::ShellResize { target, cols, rows } => {
+                forward_to_shell(&running, &responder, request.id, target, ShellControl::Resize { cols, rows });
+            }
+            command => {
+                let (pause, paused) = watch::channel(false);
+                let (shell, input) = match command {
+                    Command::Shell { .. } => {
+                        let (shell, input) = mpsc::unbounded_channel();
+                        (Some(shell), Some(input))
+                    }
+                    _ => (None, None),
+                };
+                let job = Job {
+                    id: request.id,
+                    responder: responder.clone(),
+                    cancel: Arc::new(Notify::new()),
+                    paused,
+                    input: Mutex::new(input),
+                    received,
+                };
+                if let Some(id) = job.id {
+                    let pause = command.is_transfer().then_some(pause);
+                    let handle = JobHandle { session: request.session.clone(), cancel: job.cancel.clone(), paused: pause, shell };
+                    running.lock().unwrap().insert(id, handle);
+                }
+                let slot = sessions.get(&request.session).cloned();
+                let connections = connections.clone();
+                let running = running.clone();
+                let priority = request.priority;
+                tokio::spawn(async move {
+                    let response = match command {
+                        Command::Broadcast { targets, command, password, private_key, concurrency, timeout } => {
+                            let auth = broadcast::Auth { password, private_key };
+                            run_broadcast(&connections, targets, &command, &auth, concurrency, timeout, &job).await
+                        }
+                        command => run_job(slot, command, priority, &job).await,
+                    };
+                    if let Some(id) = job.id {
+                        running.lock().unwrap().remove(&id);
+                    }
+                    job.finish(response);
+                });
+            }
+        }
+    }
+
+    // Дожидаемся ответов на команды, которые ещё выполняются
+    drop(responder);
+    writer.await?
+}
+
+type Running = Arc<Mutex<HashMap<u64, JobHandle>>>;
+
+fn forward_to_shell(running: &Running, responder: &Responder, id: Option<u64>, target: u64, control: ShellControl) {
+    let sent = match running.lock().unwrap().get(&target) {
+        Some(JobHandle { shell: Some(shell), .. }) => shell.send(control).is_ok(),
+        _ => false,
+    };
+    if !sent && id.is_some() {
+        responder.send(id, Response::Error { message: format!("No running shell {}", target) });
+    }
+}
+
+async fn resolve_home(sftp: &RawSftpSession) -> Result<String> {
+    let name = sftp.realpath(".").await?;
+    name.files.into_iter().next().map(|file| file.filename).ok_or_else(|| anyhow!("Empty realpath reply"))
+}
+
+// Сессия вкладки. Пока идёт подключение или переподключение, слот заблокирован на запись
+// и команды сессии ждут; после разрыва в слот встаёт новая сессия с теми же параметрами
+struct SessionSlot {
+    id: String,
+    session: Arc<tokio::sync::RwLock<Option<Arc<Session>>>>,
+    connections: Arc<Connections>,
+    responder: Responder,
+    // true после Disconnect; сторож выходит и по нему, и когда слот удалён
+    stop: watch::Sender<bool>,
+}
+
+impl SessionSlot {
+    async fn current(&self) -> Option<Arc<Session>> {
+        self.session.read().await.clone()
+    }
+
+    // Переподключение с нарастающей паузой. Его просят и сторож, и команды, упавшие на разрыве:
+    // переподключается первый, остальные получают уже новую сессию
+    async fn reconnect(&self, dead: &Arc<Session>) -> Option<Arc<Session>> {
+        let mut current = self.session.write().await;
+        match current.as_ref() {
+            Some(sess) if Arc::ptr_eq(sess, dead) => {}
+            other => return other.cloned(),
+        }
+        self.responder.event(&self.id, Response::Link { state: "reconnecting", message: None });
+        let mut delay = RECONNECT_MIN_DELAY;
+        let mut error = None;
+        for attempt in 0..dead.params.reconnect_attempts {
+            if attempt > 0 {
+                tokio::time::sleep(delay).await;
+                delay = (delay * 2).min(RECONNECT_MAX_DELAY);
+            }
+            match Session::connect(&self.connections, dead.params.clone(), false).await {
+                Ok((sess, _)) => {
+                    let sess = Arc::new(sess);
+                    *current = Some(sess.clone());
+                    self.responder.event(&self.id, Response::Link { state: "connected", message: None });
+                    return Some(sess);
+                }
+                Err(e) => {
+                    log::warn!("reconnect of session {} failed: {}", self.id, e);
+                    error = Some(e.to_string());
+                }
+            }
+        }
+        *current = None;
+        self.responder.event(&self.id, Response::Link { state: "lost", message: error });
+        None
+    }
+}
+
+// Сторож сессии: russh сообщает о разрыве (в том числе по keepalive), и сессия переподключается
+// сразу, не дожидаясь, пока на разрыв наткнётся команда. Заканчивается вместе со слотом
+async fn watch_link(slot: Weak<SessionSlot>, mut stopped: watch::Receiver<bool>) {
+    loop {
+        let current = match slot.upgrade() {
+            Some(slot) => slot.current().await,
+            None => return,
+        };
+        let Some(sess) = current else {
+            return;
+        };
+        let mut closed = sess.closed.clone();
+        tokio::select! {
+            Ok(_) = closed.wait_for(|closed| *closed) => {}
+            _ = tokio::time::sleep(LINK_CHECK_INTERVAL) => {}
+            _ = stopped.wait_for(|stop| *stop) => return,
+        }
+        let Some(slot) = slot.upgrade() else {
+            return;
+        };
+        if sess.is_dead() {
+            // Переподключение держит слот, так что Disconnect прерывает его сигналом, а не удалением
+            let reconnected = tokio::select! {
+                reconnected = slot.reconnect(&sess) => reconnected,
+                _ = stopped.wait_for(|stop| *stop) => return,
+            };
+            if reconnected.is_none() {
+                return;
+            }
+        }
+    }
+}
+
+// Всё, что нужно, чтобы открыть сессию заново после разрыва
+#[derive(Clone)]
+struct ConnectParams {
+    host: String,
+    port: u16,
+    username: String,
+    password: Option<String>,
+    private_key: Option<String>,
+    max_inflight: usize,
+    max_transfers: usize,
+    transfer: TransferOptions,
+    striping: Striping,
+    keepalive_interval: Duration,
+    keepalive_max: usize,
+    reconnect_attempts: usize,
+}
+
+impl ConnectParams {
+    fn new(host: String, port: u16, username: String, password: Option<String>, private_key: Option<String>) -> Self {
+        ConnectParams {
+            host,
+            port,
+            username,
+            password,
+            private_key,
+            max_inflight: DEFAULT_MAX_INFLIGHT,
+            max_transfers: DEFAULT_MAX_TRANSFERS,
+            transfer: TransferOptions::new(None, None, None),
+            striping: Striping { stripes: DEFAULT_STRIPES, threshold: DEFAULT_STRIPE_THRESHOLD },
+            keepalive_interval: Duration::from_secs(DEFAULT_KEEPALIVE_INTERVAL),
+            keepalive_max: DEFAULT_KEEPALIVE_MAX,
+            reconnect_attempts: DEFAULT_RECONNECT_ATTEMPTS,
+        }
+    }
+
+    // Ключ общего соединения: кроме адреса, отпечаток пароля или ключа. Соединение,
+    // аутентифицированное одними данными, не достаётся тому, кто пришёл с другими или без них
+    fn pool_key(&self) -> Option<String> {
+        let mut hasher = Sha256::new();
+        match (&self.private_key, &self.password) {
+            (Some(key), _) => hasher.update([b"key\0".as_slice(), key.as_bytes()].concat()),
+            (None, Some(pass)) => hasher.update([b"password\0".as_slice(), pass.as_bytes()].concat()),
+            (None, None) => return None,
+        }
+        Some(format!("{}@{}:{}#{:x}", self.username, self.host, self.port, hasher.finalize()))
+    }
+}
+
+// Установленные SSH-соединения по user@host:port и данным входа. Новая сессия к тому же адресу
+// с теми же данными открывает каналы на готовом соединении (как ControlMaster в OpenSSH)
+// и не проходит рукопожатие и аутентификацию заново. Соединение закрывается вместе с последней сессией
+#[derive(Default)]
+struct Connections {
+    entries: Mutex<HashMap<String, Arc<tokio::sync::Mutex<Option<SharedLink>>>>>,
+}
+
+struct SharedLink {
+    handle: Weak<Handle<Client>>,
+    // становится true, когда russh сообщает о разрыве соединения
+    closed: watch::Receiver<bool>,
+}
+
+impl Connections {
+    async fn get_or_connect(
+        &self,
+        params: &ConnectParams,
+        timings: &mut ConnectTimings,
+    ) -> Result<(Arc<Handle<Client>>, watch::Receiver<bool>)> {
+        let key = params.pool_key().ok_or_else(|| anyhow!("Missing auth method"))?;
+        let entry = self.entries.lock().unwrap().entry(key).or_default().clone();
+        // Одновременные подключения к одному адресу дожидаются первого, а не открывают своё
+        let mut shared = entry.lock().await;
+        if let Some(link) = shared.as_ref().filter(|link| !*link.closed.borrow()) {
+            if let Some(handle) = link.handle.upgrade().filter(|handle| !handle.is_closed()) {
+                timings.reused = true;
+                return Ok((handle, link.closed.clone()));
+            }
+        }
+
+        let config = Arc::new(Config {
+            keepalive_interval: Some(params.keepalive_interval),
+            keepalive_max: params.keepalive_max,
+            ..Config::default()
+        });
+        let (closed_tx, closed) = watch::channel(false);
+        let client = Client { closed: closed_tx };
+        let connect = client::connect(config, (params.host.as_str(), params.port), client);
+        let started = Instant::now();
+        let mut handle = tokio::time::timeout(CONNECT_TIMEOUT, connect)
+            .await
+            .map_err(|_| anyhow!("Connection to {} timed out", params.host))??;
+        timings.handshake_ms = elapsed_ms(started);
+        let started = Instant::now();
+        let auth = if let Some(key_str) = &params.private_key {
+            let key = PrivateKey::from_openssh(key_str)?;
+            let wrapped = PrivateKeyWithHashAlg::new(Arc::new(key), Some(HashAlg::Sha256));
+            handle.authenticate_publickey(params.username.as_str(), wrapped).await?
+        } else if let Some(pass) = &params.password {
+            handle.authenticate_password(params.username.as_str(), pass.as_str()).await?
+        } else {
+            return Err(anyhow!("Missing auth method"));
+        };
+        if !auth.success() {
+            return Err(anyhow!("Authentication failed"));
+        }
+        timings.auth_ms = elapsed_ms(started);
+
+        let handle = Arc::new(handle);
+        *shared = Some(SharedLink { handle: Arc::downgrade(&handle), closed: closed.clone() });
+        Ok((handle, closed))
+    }
+}
+
+// То, чем диспетчер управляет выполняющейся командой; пауза есть только у передач файлов,
+// ввод — только у shell
+struct JobHandle {
+    session: String,
+    cancel: Arc<Notify>,
+    paused: Option<watch::Sender<bool>>,
+    shell: Option<mpsc::UnboundedSender<ShellControl>>,
+}
+
+enum ShellControl {
+    Data(String),
+    Resize { cols: u32, rows: u32 },
+}
+
+// Выполняющаяся команда: промежуточные кадры уходят с её id, Cancel будит `cancel`
+struct Job {
+    id: Option<u64>,
+    responder: Responder,
+    cancel: Arc<Notify>,
+    paused: watch::Receiver<bool>,
+    input: Mutex<Option<mpsc::UnboundedReceiver<ShellControl>>>,
+    // когда пришёл запрос, если клиент просил трассировку
+    received: Option<u64>,
+}
+
+impl Job {
+    fn send(&self, response: Response) {
+        self.responder.send(self.id, response);
+    }
+
+    // Итоговый ответ: с трассировкой в нём отметки времени запроса
+    fn finish(&self, response: Response) {
+        self.responder.finish(self.id, response, self.received);
+    }
+}
+
+async fn run_job(slot: Option<Arc<SessionSlot>>, command: Command, priority: Priority, job: &Job) -> Response {
+    let session = match &slot {
+        Some(slot) => tokio::select! {
+            session = slot.current() => session,
+            _ = job.cancel.notified() => return Response::Error { message: "Cancelled".into() },
+        },
+        None => None,
+    };
+    let Some(mut sess) = session else {
+        return Response::Error { message: "Not connected".into() };
+    };
+    loop {
+        let response = run_command(sess.clone(), command.clone(), priority, job).await;
+        // Команду, которую безопасно повторить, после разрыва повторяем на новом соединении
+        let failed = matches!(&response, Response::Error { message } if message != "Cancelled");
+        let Some(slot) = slot.as_ref().filter(|_| failed && command.is_replayable() && sess.is_dead()) else {
+            return response;
+        };
+        let reconnected = tokio::select! {
+            reconnected = slot.reconnect(&sess) => reconnected,
+            _ = job.cancel.notified() => return Response::Error { message: "Cancelled".into() },
+        };
+        let Some(reconnected) = reconnected else {
+            return response;
+        };
+        // Клиент начинает собирать промежуточные кадры заново
+        job.send(Response::Replay);
+        sess = reconnected;
+    }
+}
+
+// Рассылка не привязана к сессии вкладки: соединения с хостами берутся из общего пула
+async fn run_broadcast(
+    connections: &Connections,
+    targets: Vec<broadcast::Target>,
+    command: &str,
+    auth: &broadcast::Auth,
+    concurrency: Option<usize>,
+    timeout: Option<f64>,
+    job: &Job,
+) -> Response {
+    let timeout = Duration::from_secs_f64(timeout.unwrap_or(broadcast::DEFAULT_TIMEOUT).max(0.1));
+    let concurrency = concurrency.unwrap_or(broadcast::DEFAULT_CONCURRENCY);
+    let report = |event| match event {
+        broadcast::Event::Started(host) => job.send(Response::HostStarted { host }),
+        broadcast::Event::Finished(result) => job.send(Response::HostResult(result)),
+    };
+    tokio::select! {
+        summary = broadcast::run(connections, targets, command, auth, concurrency, timeout, &report) => {
+            Response::BroadcastEnd(summary)
+        }
+        _ = job.cancel.notified() => Response::Error { message: "Cancelled".into() },
+    }
+}
+
+async fn run_command(sess: Arc<Session>, command: Command, priority: Priority, job: &Job) -> Response {
+    let _background = match priority {
+        Priority::Low => tokio::select! {
+            permit = sess.background.clone().acquire_owned() => Some(permit),
+            _ = job.cancel.notified() => return Response::Error { message: "Cancelled".into() },
+        },
+        Priority::Normal => None,
+    };
+    // Передачи ждут своей очереди сами (и отдают слот на паузе), а shell живёт, пока открыта
+    // вкладка; общий лимит они не занимают
+    if command.is_transfer() || matches!(command, Command::Shell { .. }) {
+        return handle_command(&sess, command, job).await;
+    }
+    let _permit = tokio::select! {
+        permit = sess.permits.clone().acquire_owned() => permit,
+        _ = job.cancel.notified() => return Response::Error { message: "Cancelled".into() },
+    };
+    if command.cancels_gracefully() {
+        return handle_command(&sess, command, job).await;
+    }
+    tokio::select! {
+        response = handle_command(&sess, command, job) => response,
+        _ = job.cancel.notified() => Response::Error { message: "Cancelled".into() },
+    }
+}
+
+#[derive(Clone)]
+struct Responder {
+    tx: mpsc::UnboundedSender<Reply>,
+    // после Hello { binary: true } вывод и листинги идут двоичными кадрами
+    binary: Arc<AtomicBool>,
+}
+
+impl Responder {
+    fn is_binary(&self) -> bool {
+        self.binary.load(Ordering::Relaxed)
+    }
+
+    fn send(&self, id: Option<u64>, response: Response) {
+        let _ = self.tx.send(Reply { id, session: None, trace: None, response });
+    }
+
+    fn finish(&self, id: Option<u64>, response: Response, received: Option<u64>) {
+        let trace = received.map(|received_us| Trace { received_us, done_us: now_us(), written_us: 0 });
+        let _ = self.tx.send(Reply { id, session: None, trace, response });
+    }
+
+    // Событие сессии, не относящееся ни к одному запросу
+    fn event(&self, session: &str, response: Response) {
+        let _ = self.tx.send(Reply { id: None, session: Some(session.to_string()), trace: None, response });
+    }
+}
+
+// Единственный писатель в stdout: ответы из разных задач не перемешиваются внутри строки
+async fn write_replies(mut rx: mpsc::UnboundedReceiver<Reply>, binary: Arc<AtomicBool>) -> Result<()> {
+    let mut stdout = tokio::io::stdout();
+    let mut buffer = Vec::new();
+    while let Some(mut reply) = rx.recv().await {
+        let binary = binary.load(Ordering::Relaxed);
+        stamp_written(&mut reply);
+        framing::encode(&mut buffer, &reply, binary)?;
+        while let Ok(mut reply) = rx.try_recv() {
+            stamp_written(&mut reply);
+            framing::encode(&mut buffer, &reply, binary)?;
+        }
+        stdout.write_all(&buffer).await?;
+        stdout.flush().await?;
+        buffer.clear();
     }
     Ok(())
 }
 
+fn stamp_written(reply: &mut Reply) {
+    if let Some(trace) = &mut reply.trace {
+        trace.written_us = now_us();
+    }
+}
+
+// Достаём id даже из команды, которую не удалось разобрать, чтобы UI мог сопоставить ошибку
+fn request_id(line: &str) -> Option<u64> {
+    serde_json::from_str::<serde_json::Value>(line)
+        .ok()?
+        .get("id")?
+        .as_u64()
+}
+
 #[derive(Deserialize)]
+struct Request {
+    #[serde(default)]
+    id: Option<u64>,
+    // id сессии (вкладки); клиент с одной сессией может его не указывать
+    #[serde(default)]
+    session: String,
+    #[serde(default)]
+    priority: Priority,
+    // вернуть в итоговом ответе отметки времени бэкенда
+    #[serde(default)]
+    trace: bool,
+    #[serde(flatten)]
+    command: Command,
+}
+
+#[derive(Deserialize, Default, Clone, Copy)]
+#[serde(rename_all = "lowercase")]
+enum Priority {
+    #[default]
+    Normal,
+    Low,
+}
+
+#[derive(Serialize)]
+struct Reply {
+    #[serde(skip_serializing_if = "Option::is_none")]
+    id: Option<u64>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    session: Option<String>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    trace: Option<Trace>,
+    #[serde(flatten)]
+    response: Response,
+}
+
+// Путь запроса через бэкенд, мкс от эпохи Unix: часы общие с клиентом на той же машине, и его
+// отметки ложатся на одну шкалу с этими. done — команда выполнена (включая ожидание очереди
+// и сервера), written — ответ ушёл в запись в stdout
+#[derive(Serialize)]
+struct Trace {
+    received_us: u64,
+    done_us: u64,
+    written_us: u64,
+}
+
+fn now_us() -> u64 {
+    SystemTime::now().duration_since(UNIX_EPOCH).map_or(0, |since| since.as_micros() as u64)
+}
+
+#[derive(Deserialize, Clone)]
 #[serde(tag = "cmd")]
 enum Command {
     Connect {
@@ -43,29 +669,141 @@ enum Command {
         username: String,
         password: Option<String>,
         private_key: Option<String>,
+        max_inflight: Option<usize>,
+        max_transfers: Option<usize>,
+        chunk_size: Option<u32>,
+        window: Option<usize>,
+        max_window: Option<usize>,
+        stripes: Option<usize>,
+        stripe_threshold: Option<u64>,
+        // секунды
+        keepalive_interval: Option<u64>,
+        keepalive_max: Option<usize>,
+        reconnect_attempts: Option<usize>,
+        // вернуть в ответе домашний каталог и его листинг
+        #[serde(default)]
+        list_home: bool,
+    },
+    Exec {
+        command: String,
+        #[serde(default)]
+        stream: bool,
+    },
+    // Интерактивный shell с PTY на всё время вкладки; вывод идёт кадрами chunk
+    Shell {
+        #[serde(default = "default_term")]
+        term: String,
+        cols: u32,
+        rows: u32,
+    },
+    ShellInput { target: u64, data: String },
+    Hello {
+        #[serde(default)]
+        binary: bool,
+    },
+    // Одна команда на группе хостов; сессия вкладки не нужна. timeout — секунды на хост
+    Broadcast {
+        targets: Vec<broadcast::Target>,
+        command: String,
+        password: Option<String>,
+        private_key: Option<String>,
+        concurrency: Option<usize>,
+        timeout: Option<f64>,
     },
-    Exec { command: String },
+    ShellResize { target: u64, cols: u32, rows: u32 },
     SftpList { path: String },
     SftpRemove { path: String },
     SftpMkdir { path: String },
     SftpRmdir { path: String },
     GetHomeDir,
-    SftpDownload { remote: String, local: String },
-    SftpUpload { local: String, remote: String },
+    SftpDownload {
+        remote: String,
+        local: String,
+        #[serde(default)]
+        verify: bool,
+        // число полос вместо заданного при подключении
+        stripes: Option<usize>,
+    },
+    SftpUpload {
+        local: String,
+        remote: String,
+        #[serde(default)]
+        verify: bool,
+        stripes: Option<usize>,
+    },
+    SftpDownloadDir { remote: String, local: String },
+    SftpUploadDir { local: String, remote: String },
+    SftpSync { local: String, remote: String },
     Disconnect,
+    Cancel { target: u64 },
+    Pause { target: u64 },
+    Resume { target: u64 },
+}
+
+fn default_term() -> String {
+    "xterm".into()
+}
+
+impl Command {
+    // Такие команды сами реагируют на Cancel (например, шлют Ctrl-C), а не просто прерываются
+    fn cancels_gracefully(&self) -> bool {
+        matches!(self, Command::Exec { stream: true, .. } | Command::Shell { .. } | Command::SftpList { .. })
+            || self.is_transfer()
+    }
+
+    // Повтор после переподключения ничего не портит: чтение, докачка файла в обе стороны
+    // (через .part), повторная передача каталога и синхронизация
+    fn is_replayable(&self) -> bool {
+        matches!(self, Command::SftpList { .. } | Command::GetHomeDir | Command::SftpSync { .. }) || self.is_transfer()
+    }
+
+    fn is_transfer(&self) -> bool {
+        matches!(
+            self,
+            Command::SftpDownload { .. }
+                | Command::SftpUpload { .. }
+                | Command::SftpDownloadDir { .. }
+                | Command::SftpUploadDir { .. }
+                | Command::SftpSync { .. }
+        )
+    }
 }
 
 #[derive(Serialize)]
 #[serde(tag = "status")]
 enum Response {
     #[serde(rename = "connected")]
-    Connected,
+    Connected(Welcome),
     #[serde(rename = "disconnected")]
     Disconnected,
+    #[serde(rename = "hello")]
+    Hello { binary: bool },
     #[serde(rename = "output")]
     Output { output: String },
-    #[serde(rename = "files")]
-    Files { files: Vec<FileEntry> },
+    #[serde(rename = "chunk")]
+    Chunk { stream: &'static str, data: Payload },
+    #[serde(rename = "exit_status")]
+    ExitStatus { code: Option<u32>, signal: Option<String> },
+    #[serde(rename = "end")]
+    End,
+    #[serde(rename = "files_page")]
+    FilesPage { files: Vec<FileEntry> },
+    #[serde(rename = "files_end")]
+    FilesEnd { total: usize },
+    #[serde(rename = "progress")]
+    Progress(transfer::Progress),
+    #[serde(rename = "synced")]
+    Synced(sync::SyncReport),
+    #[serde(rename = "replay")]
+    Replay,
+    #[serde(rename = "host_started")]
+    HostStarted { host: String },
+    #[serde(rename = "host_result")]
+    HostResult(broadcast::HostResult),
+    #[serde(rename = "broadcast_end")]
+    BroadcastEnd(broadcast::Summary),
+    #[serde(rename = "link")]
+    Link { state: &'static str, message: Option<String> },
     #[serde(rename = "home_dir")]
     HomeDir { path: String },
     #[serde(rename = "ok")]
@@ -79,116 +817,217 @@ struct FileEntry {
     name: String,
     is_dir: bool,
     size: u64,
+    mtime: Option<u32>,
 }
 
-async fn handle_command(session: &mut Option<Session>, cmd: Command) -> Response {
-    match cmd {
-        Command::Connect { host, port, username, password, private_key } => {
-            match Session::connect(host, port, username, password, private_key).await {
-                Ok(sess) => {
-                    *session = Some(sess);
-                    Response::Connected
-                }
-                Err(e) => Response::Error { message: e.to_string() },
-            }
-        }
-        Command::Exec { command } => match session {
-            Some(sess) => match sess.exec(&command).await {
-                Ok(output) => Response::Output { output },
-                Err(e) => Response::Error { message: e.to_string() },
-            },
-            None => Response::Error { message: "Not connected".into() },
-        },
-        Command::SftpList { path } => match session {
-            Some(sess) => match sess.sftp_list(&path).await {
-                Ok(files) => Response::Files { files },
-                Err(e) => Response::Error { message: e.to_string() },
-            },
-            None => Response::Error { message: "Not connected".into() },
-        },
-        Command::SftpRemove { path } => match session {
-            Some(sess) => match sess.sftp_remove(&path).await {
-                Ok(_) => Response::Ok,
-                Err(e) => Response::Error { message: e.to_string() },
-            },
-            None => Response::Error { message: "Not connected".into() },
-        },
-        Command::SftpMkdir { path } => match session {
-            Some(sess) => match sess.sftp_mkdir(&path).await {
-                Ok(_) => Response::Ok,
-                Err(e) => Response::Error { message: e.to_string() },
-            },
-            None => Response::Error { message: "Not connected".into() },
-        },
-        Command::SftpRmdir { path } => match session {
-            Some(sess) => match sess.sftp_rmdir(&path).await {
-                Ok(_) => Response::Ok,
-                Err(e) => Response::Error { message: e.to_string() },
-            },
-            None => Response::Error { message: "Not connected".into() },
-        },
-        Command::GetHomeDir => match session {
-            Some(sess) => match sess.get_home_dir().await {
-                Ok(path) => Response::HomeDir { path },
-                Err(e) => Response::Error { message: e.to_string() },
-            },
-            None => Response::Error { message: "Not connected".into() },
-        },
-        Command::SftpDownload { remote, local } => match session {
-            Some(sess) => match sess.sftp_download(&remote, &local).await {
-                Ok(_) => Response::Ok,
-                Err(e) => Response::Error { message: e.to_string() },
-            },
-            None => Response::Error { message: "Not connected".into() },
-        },
-        Command::SftpUpload { local, remote } => match session {
-            Some(sess) => match sess.sftp_upload(&local, &remote).await {
-                Ok(_) => Response::Ok,
-                Err(e) => Response::Error { message: e.to_string() },
-            },
-            None => Response::Error { message: "Not connected".into() },
-        },
-        Command::Disconnect => {
-            *session = None;
-            Response::Disconnected
+impl From<russh_sftp::protocol::File> for FileEntry {
+    fn from(file: russh_sftp::protocol::File) -> Self {
+        FileEntry {
+            is_dir: file.attrs.is_dir(),
+            size: file.attrs.size.unwrap_or(0),
+            mtime: file.attrs.mtime,
+            name: file.filename,
         }
     }
 }
 
+// Ответ на Connect: с list_home в нём сразу домашний каталог и его содержимое,
+// чтобы вкладке не нужны были отдельные GetHomeDir и SftpList
+#[derive(Serialize, Default)]
+struct Welcome {
+    #[serde(skip_serializing_if = "Option::is_none")]
+    home: Option<String>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    files: Option<Vec<FileEntry>>,
+    timings: ConnectTimings,
+}
+
+// Длительность этапов подключения, мс. Каналы открываются одновременно, а домашний каталог
+// читается, пока договариваются остальные каналы, поэтому сумма этапов больше total_ms
+#[derive(Serialize, Default)]
+struct ConnectTimings {
+    // соединение взято у другой вкладки: рукопожатия и аутентификации не было
+    reused: bool,
+    handshake_ms: f64,
+    auth_ms: f64,
+    channels_ms: f64,
+    home_ms: f64,
+    listing_ms: f64,
+    total_ms: f64,
+}
+
+fn elapsed_ms(started: Instant) -> f64 {
+    started.elapsed().as_secs_f64() * 1000.0
+}
+
+async fn handle_command(sess: &Session, cmd: Command, job: &Job) -> Response {
+    let result = match cmd {
+        Command::Exec { command, stream: true } => sess.exec_stream(&command, job).await.map(|_| Response::End),
+        Command::Exec { command, stream: false } => sess.exec(&command).await.map(|output| Response::Output { output }),
+        Command::Shell { term, cols, rows } => sess.shell(&term, cols, rows, job).await.map(|_| Response::End),
+        Command::SftpList { path } => sess.sftp_list(&path, job).await.map(|total| Response::FilesEnd { total }),
+        Command::SftpRemove { path } => sess.sftp_remove(&path).await.map(|_| Response::Ok),
+        Command::SftpMkdir { path } => sess.sftp_mkdir(&path).await.map(|_| Response::Ok),
+        Command::SftpRmdir { path } => sess.sftp_rmdir(&path).await.map(|_| Response::Ok),
+        Command::GetHomeDir => sess.get_home_dir().await.map(|path| Response::HomeDir { path }),
+        Command::SftpDownload { remote, local, verify, stripes } => {
+            sess.sftp_download(&remote, &local, verify, stripes, job).await.map(|_| Response::Ok)
+        }
+        Command::SftpUpload { local, remote, verify, stripes } => {
+            sess.sftp_upload(&local, &remote, verify, stripes, job).await.map(|_| Response::Ok)
+        }
+        Command::SftpDownloadDir { remote, local } => {
+            sess.sftp_transfer_dir(Direction::Download, &remote, &local, job).await.map(|_| Response::Ok)
+        }
+        Command::SftpUploadDir { local, remote } => {
+            sess.sftp_transfer_dir(Direction::Upload, &local, &remote, job).await.map(|_| Response::Ok)
+        }
+        Command::SftpSync { local, remote } => sess.sftp_sync(&local, &remote, job).await.map(Response::Synced),
+        Command::Connect { .. }
+        | Command::Disconnect
+        | Command::Cancel { .. }
+        | Command::Pause { .. }
+        | Command::Resume { .. }
+        | Command::ShellInput { .. }
+        | Command::ShellResize { .. }
+        | Command::Broadcast { .. }
+        | Command::Hello { .. } => Err(anyhow!("Command must be handled by the dispatcher")),
+    };
+    result.unwrap_or_else(|e| Response::Error { message: e.to_string() })
+}
+
 struct Session {
-    handle: Handle<Client>,
+    params: ConnectParams,
+    handle: Arc<Handle<Client>>,
+    closed: watch::Receiver<bool>,
     sftp: SftpSession,
+    // Отдельный SFTP-канал для постраничного чтения каталогов
+    raw: RawSftpSession,
+    // Канал для передачи файлов, чтобы большие закачки не задерживали листинги
+    xfer: RawSftpSession,
+    transfer: TransferOptions,
+    permits: Arc<Semaphore>,
+    background: Arc<Semaphore>,
+    transfers: Arc<Semaphore>,
+    max_transfers: usize,
+    striping: Striping,
+    // Дополнительные SFTP-каналы для полос, открываются при первой полосатой передаче
+    stripe_channels: tokio::sync::Mutex<Vec<Arc<RawSftpSession>>>,
+}
+
+#[derive(Clone, Copy)]
+struct Striping {
+    stripes: usize,
+    threshold: u64,
 }
 
 impl Session {
-    async fn connect(
-        host: String,
-        port: u16,
-        username: String,
-        password: Option<String>,
-        private_key: Option<String>,
-    ) -> Result<Self> {
-        let config = Arc::new(Config::default());
-        let mut handle = client::connect(config, (host.as_str(), port), Client {}).await?;
+    async fn connect(connections: &Connections, params: ConnectParams, list_home: bool) -> Result<(Self, Welcome)> {
+        let started = Instant::now();
+        let mut welcome = Welcome::default();
+        let (handle, closed) = connections.get_or_connect(&params, &mut welcome.timings).await?;
 
-        if let Some(key_str) = private_key {
-            let key = PrivateKey::from_openssh(&key_str)?;
-            let wrapped = PrivateKeyWithHashAlg::new(Arc::new(key), Some(HashAlg::Sha256));
-            handle.authenticate_publickey(username, wrapped).await?;
-        } else if let Some(pass) = password {
-            handle.authenticate_password(username, pass).await?;
-        } else {
-            return Err(anyhow!("Missing auth method"));
-        }
+        // Три канала открываются одновременно, а не по очереди: каждое открытие — это
+        // несколько обменов с сервером, и на медленной связи они складываются
+        let channels_started = Instant::now();
+        let open_sftp = async {
+            let channel = handle.channel_open_session().await?;
+            channel.request_subsystem(true, "sftp").await?;
+            Ok::<_, anyhow::Error>(SftpSession::new(channel.into_stream()).await?)
+        };
+        let open_raw = async {
+            let channel = handle.channel_open_session().await?;
+            channel.request_subsystem(true, "sftp").await?;
+            let raw = RawSftpSession::new(channel.into_stream());
+            raw.init().await?;
+            let ready = elapsed_ms(channels_started);
+            // Домашний каталог и его листинг читаются, пока остальные каналы ещё открываются
+            let mut home = None;
+            let mut files = None;
+            let (mut home_ms, mut listing_ms) = (0.0, 0.0);
+            if list_home {
+                let resolving = Instant::now();
+                let path = resolve_home(&raw).await?;
+                home_ms = elapsed_ms(resolving);
+                let listing = Instant::now();
+                // Ошибка листинга не мешает подключению: вкладка запросит каталог сама
+                files = transfer::read_remote_dir(&raw, &path)
+                    .await
+                    .map(|files| files.into_iter().map(FileEntry::from).collect())
+                    .ok();
+                listing_ms = elapsed_ms(listing);
+                home = Some(path);
+            }
+            Ok::<_, anyhow::Error>((raw, ready, home, files, home_ms, listing_ms))
+        };
+        let open_xfer = async {
+            let channel = handle.channel_open_session().await?;
+            channel.request_subsystem(true, "sftp").await?;
+            let xfer = RawSftpSession::new(channel.into_stream());
+            let version = xfer.init().await?;
+            let transfer = params.transfer.clone().negotiate(&xfer, &version.extensions).await;
+            Ok::<_, anyhow::Error>((xfer, transfer, elapsed_ms(channels_started)))
+        };
+        let (sftp, (raw, raw_ready, home, files, home_ms, listing_ms), (xfer, transfer, xfer_ready)) =
+            tokio::try_join!(open_sftp, open_raw, open_xfer)?;
+
+        let timings = &mut welcome.timings;
+        timings.channels_ms = raw_ready.max(xfer_ready);
+        timings.home_ms = home_ms;
+        timings.listing_ms = listing_ms;
+        timings.total_ms = elapsed_ms(started);
+        welcome.home = home;
+        welcome.files = files;
+        log::info!(
+            "connected to {}@{}: {}",
+            params.username,
+            params.host,
+            serde_json::to_string(&welcome.timings).unwrap_or_default()
+        );
+
+        let sess = Self {
+            permits: Arc::new(Semaphore::new(params.max_inflight)),
+            background: Arc::new(Semaphore::new(BACKGROUND_SLOTS)),
+            transfers: Arc::new(Semaphore::new(params.max_transfers)),
+            max_transfers: params.max_transfers,
+            striping: params.striping,
+            params,
+            handle,
+            closed,
+            sftp,
+            raw,
+            xfer,
+            transfer,
+            stripe_channels: tokio::sync::Mutex::default(),
+        };
+        Ok((sess, welcome))
+    }
 
-        let channel = handle.channel_open_session().await?;
+    fn is_dead(&self) -> bool {
+        *self.closed.borrow() || self.handle.is_closed()
+    }
+
+    async fn open_sftp_channel(&self) -> Result<RawSftpSession> {
+        let channel = self.handle.channel_open_session().await?;
         channel.request_subsystem(true, "sftp").await?;
-        let sftp = SftpSession::new(channel.into_stream()).await?;
+        let sftp = RawSftpSession::new(channel.into_stream());
+        sftp.init().await?;
+        Ok(sftp)
+    }
 
-        Ok(Self { handle, sftp })
+    // Каналы для полосатой передачи файла размера `size`; пусто, если хватит одного потока
+    async fn stripe_channels(&self, size: u64, stripes: usize) -> Result<Vec<Arc<RawSftpSession>>> {
+        if stripes <= 1 || size < self.striping.threshold {
+            return Ok(Vec::new());
+        }
+        let mut channels = self.stripe_channels.lock().await;
+        while channels.len() < stripes - 1 {
+            channels.push(Arc::new(self.open_sftp_channel().await?));
+        }
+        Ok(channels[..stripes - 1].to_vec())
     }
 
-    async fn exec(&mut self, cmd: &str) -> Result<String> {
+    async fn exec(&self, cmd: &str) -> Result<String> {
         let channel = self.handle.channel_open_session().await?;
         channel.exec(true, cmd).await?;
 
@@ -199,104 +1038,461 @@ impl Session {
         Ok(String::from_utf8_lossy(&output).to_string())
     }
 
-    async fn sftp_list(&mut self, path: &str) -> Result<Vec<FileEntry>> {
-        let entries = self.sftp.read_dir(path).await?;
-        let mut files = Vec::new();
-    
-        for entry in entries {
-            let name = entry.file_name();
-            let meta = entry.metadata(); 
-    
-            files.push(FileEntry {
-                name,
-                is_dir: meta.is_dir(),
-                size: meta.size.unwrap_or(0),
-            });
+    // Потоковый вариант exec: кадры stdout/stderr уходят по мере поступления, в конце — код выхода
+    async fn exec_stream(&self, cmd: &str, job: &Job) -> Result<()> {
+        let mut channel = self.handle.channel_open_session().await?;
+        channel.exec(true, cmd).await?;
+
+        let mut stdout = OutputStream::new("stdout");
+        let mut stderr = OutputStream::new("stderr");
+        let mut code = None;
+        let mut signal = None;
+        let mut cancelled = false;
+        loop {
+            tokio::select! {
+                msg = channel.wait() => match msg {
+                    Some(ChannelMsg::Data { data }) => stdout.push(job, &data),
+                    Some(ChannelMsg::ExtendedData { data, ext: 1 }) => stderr.push(job, &data),
+                    Some(ChannelMsg::ExitStatus { exit_status }) => code = Some(exit_status),
+                    Some(ChannelMsg::ExitSignal { signal_name, .. }) => signal = Some(format!("{:?}", signal_name)),
+                    Some(ChannelMsg::Close) | None => break,
+                    _ => {}
+                },
+                _ = job.cancel.notified(), if !cancelled => {
+                    // Без PTY сервер может проигнорировать сигнал, поэтому канал всё равно закрываем
+                    cancelled = true;
+                    let _ = channel.signal(Sig::INT).await;
+                    let _ = channel.close().await;
+                }
+            }
+        }
+
+        stdout.finish(job);
+        stderr.finish(job);
+        job.send(Response::ExitStatus { code, signal });
+        Ok(())
+    }
+
+    // Shell с PTY: запрос PTY уходит без ожидания ответа, вместе с запросом shell, так что
+    // канал готов за один обмен после открытия. Нажатия клавиш передаются как есть
+    async fn shell(&self, term: &str, cols: u32, rows: u32, job: &Job) -> Result<()> {
+        let mut input = job.input.lock().unwrap().take().ok_or_else(|| anyhow!("Shell input is not set up"))?;
+        let mut channel = self.handle.channel_open_session().await?;
+        channel.request_pty(false, term, cols, rows, 0, 0, &[]).await?;
+        channel.request_shell(true).await?;
+
+        let mut output = OutputStream::new("stdout");
+        let mut code = None;
+        let mut signal = None;
+        let mut closing = false;
+        loop {
+            tokio::select! {
+                msg = channel.wait() => match msg {
+                    // С PTY stderr приходит вместе с stdout, но сервер может прислать и отдельно
+                    Some(ChannelMsg::Data { data }) | Some(ChannelMsg::ExtendedData { data, ext: 1 }) => {
+                        output.push(job, &data);
+                    }
+                    Some(ChannelMsg::ExitStatus { exit_status }) => code = Some(exit_status),
+                    Some(ChannelMsg::ExitSignal { signal_name, .. }) => signal = Some(format!("{:?}", signal_name)),
+                    Some(ChannelMsg::Close) | None => break,
+                    _ => {}
+                },
+                Some(control) = input.recv(), if !closing => match control {
+                    ShellControl::Data(data) => channel.data(data.as_bytes()).await?,
+                    ShellControl::Resize { cols, rows } => channel.window_change(cols, rows, 0, 0).await?,
+                },
+                _ = job.cancel.notified(), if !closing => {
+                    closing = true;
+                    let _ = channel.eof().await;
+                    let _ = channel.close().await;
+                }
+            }
+        }
+
+        output.finish(job);
+        job.send(Response::ExitStatus { code, signal });
+        Ok(())
+    }
+
+    // Отдаёт каталог страницами по мере прихода пакетов READDIR; первая пачка уходит сразу
+    async fn sftp_list(&self, path: &str, job: &Job) -> Result<usize> {
+        let handle = self.raw.opendir(path).await?.handle;
+        let mut page = Vec::new();
+        let mut total = 0;
+        let mut first = true;
+
+        let result = loop {
+            let batch = tokio::select! {
+                batch = self.raw.readdir(handle.as_str()) => batch,
+                _ = job.cancel.notified() => break Err(anyhow!("Cancelled")),
+            };
+            match batch {
+                Ok(name) => {
+                    for file in name.files {
+                        if file.filename == "." || file.filename == ".." {
+                            continue;
+                        }
+                        page.push(file.into());
+                    }
+                    if first || page.len() >= LIST_PAGE_SIZE {
+                        first = false;
+                        total += page.len();
+                        job.send(Response::FilesPage { files: std::mem::take(&mut page) });
+                    }
+                }
+                Err(SftpError::Status(status)) if status.status_code == StatusCode::Eof => break Ok(()),
+                Err(e) => break Err(anyhow!(e)),
+            }
+        };
+        let _ = self.raw.close(handle).await;
+        result?;
+
+        if !page.is_empty() {
+            total += page.len();
+            job.send(Response::FilesPage { files: page });
         }
-    
-        Ok(files)
+        Ok(total)
     }
 
-    async fn sftp_remove(&mut self, path: &str) -> Result<()> {
+    async fn sftp_remove(&self, path: &str) -> Result<()> {
         self.sftp.remove_file(path).await.map_err(|e| anyhow!(e))
     }
 
-    async fn sftp_mkdir(&mut self, path: &str) -> Result<()> {
+    async fn sftp_mkdir(&self, path: &str) -> Result<()> {
         self.sftp.create_dir(path).await.map_err(|e| anyhow!(e))
     }
 
-    async fn sftp_rmdir(&mut self, path: &str) -> Result<()> {
+    async fn sftp_rmdir(&self, path: &str) -> Result<()> {
         self.sftp.remove_dir(path).await.map_err(|e| anyhow!(e))
     }
 
-    pub async fn get_home_dir(&mut self) -> Result<String> {
-        let output = self.exec("echo $HOME").await?;
-        Ok(output.trim().to_string())
+    // Каталог, в котором SFTP-сервер открывает сессию; без отдельного канала для `echo $HOME`
+    pub async fn get_home_dir(&self) -> Result<String> {
+        resolve_home(&self.raw).await
     }
 
-    // Загрузка файла с сервера
-    pub async fn sftp_download(&mut self, remote: &str, local: &str) -> Result<()> {
-        let mut remote_file = self.sftp.open(remote).await?; // Открытие удаленного файла
-        let mut local_file = File::create(local).await?; // Создание локального файла
-        let mut buffer = vec![0u8; 8192];
+    // Очередь передач, отмена и пауза для одной команды передачи
+    fn transfer_control<'a>(&self, job: &Job, meter: &'a Meter<'a>) -> (watch::Sender<bool>, Control<'a>) {
+        let (stop, stopped) = watch::channel(false);
+        (stop, Control::new(self.transfers.clone(), stopped, job.paused.clone(), meter))
+    }
 
-        loop {
-            let n = remote_file.read(&mut buffer).await?;
-            if n == 0 {
-                break;
+    // Загрузка файла с сервера; после обрыва повторная команда докачивает с места остановки
+    pub async fn sftp_download(&self, remote: &str, local: &str, verify: bool, stripes: Option<usize>, job: &Job) -> Result<()> {
+        let report = |progress| job.send(Response::Progress(progress));
+        let meter = Meter::file(&report);
+        let (stop, mut control) = self.transfer_control(job, &meter);
+        let file_options = FileOptions { resume: true, checksum: verify, ..FileOptions::default() };
+        let download = self.download_file(remote, local, stripes, &mut control, file_options);
+        let work = async {
+            if !verify {
+                return download.await.map(|_| ());
             }
-            local_file.write_all(&buffer[..n]).await?;
-        }
-
-        Ok(())
+            // Сервер считает свой хэш, пока файл ещё качается
+            let (copied, expected) = tokio::try_join!(download, self.remote_sha256(remote))?;
+            let verified = check_sha256(&copied, &expected);
+            if verified.is_err() {
+                let _ = tokio::fs::remove_file(local).await;
+            }
+            verified
+        };
+        transfer::cancellable(&job.cancel, stop, work).await
     }
 
-    // Выгрузка файла на сервер
-    pub async fn sftp_upload(&mut self, local: &str, remote: &str) -> Result<()> {
-        // 1. Открываем локальный файл
-        let mut local_file = match File::open(local).await {
-            Ok(file) => file,
-            Err(e) => return Err(anyhow!("Failed to open local file {}: {}", local, e)),
+    // Выгрузка файла на сервер через <файл>.part; после обрыва повторная команда продолжает
+    // с подтверждённого сервером смещения
+    pub async fn sftp_upload(&self, local: &str, remote: &str, verify: bool, stripes: Option<usize>, job: &Job) -> Result<()> {
+        let report = |progress| job.send(Response::Progress(progress));
+        let meter = Meter::file(&report);
+        let (stop, mut control) = self.transfer_control(job, &meter);
+        let file_options = FileOptions { resume: true, checksum: verify, ..FileOptions::default() };
+        let upload = async {
+            // Родительские каталоги на сервере создаются, только если их действительно нет
+            let copied = match self.upload_file(local, remote, stripes, &mut control, file_options).await {
+                Err(e) if self.xfer.stat(parent_path(remote)).await.is_err() => {
+                    transfer::create_remote_dir_all(&self.xfer, parent_path(remote)).await.map_err(|_| e)?;
+                    self.upload_file(local, remote, stripes, &mut control, file_options).await?
+                }
+                result => result?,
+            };
+            // Локальный хэш считался по ходу чтения, серверу остаётся прочитать файл с диска
+            if verify {
+                check_sha256(&copied, &self.remote_sha256(remote).await?)?;
+            }
+            Ok(())
         };
-        
-        // 2. Создаём все родительские директории
-        if let Some(parent) = Path::new(remote).parent() {
-            if !parent.exists() {
-                tokio::fs::create_dir_all(parent).await.map_err(|e| {
-                    anyhow!("Failed to create directories for {}: {}", remote, e)
-                })?;
+        transfer::cancellable(&job.cancel, stop, upload).await
+    }
+
+    // Большой файл качается полосами, остальные — одним потоком
+    async fn download_file(
+        &self,
+        remote: &str,
+        local: &str,
+        stripes: Option<usize>,
+        control: &mut Control<'_>,
+        file_options: FileOptions,
+    ) -> Result<Copied> {
+        let stripes = stripes.unwrap_or(self.striping.stripes);
+        if stripes > 1 {
+            if let Ok(attrs) = self.xfer.stat(remote).await.map(|attrs| attrs.attrs) {
+                let extra = self.stripe_channels(attrs.size.unwrap_or(0), stripes).await?;
+                if !extra.is_empty() {
+                    let channels: Vec<_> = std::iter::once(&self.xfer).chain(extra.iter().map(|sftp| sftp.as_ref())).collect();
+                    return transfer::download_striped(&channels, remote, local, &attrs, &self.transfer, control, file_options).await;
+                }
             }
         }
-        
-        // 3. Создаём новый файл на сервере (режим 0o644 - владелец RW, остальные R)
-        let mut remote_file = match self.sftp.create(remote).await {
-            Ok(file) => file,
-            Err(e) => return Err(anyhow!("Failed to create remote file {}: {}", remote, e)),
+        transfer::download(&self.xfer, remote, local, &self.transfer, control, file_options).await
+    }
+
+    async fn upload_file(
+        &self,
+        local: &str,
+        remote: &str,
+        stripes: Option<usize>,
+        control: &mut Control<'_>,
+        file_options: FileOptions,
+    ) -> Result<Copied> {
+        let stripes = stripes.unwrap_or(self.striping.stripes);
+        if stripes > 1 {
+            if let Ok(metadata) = tokio::fs::metadata(local).await {
+                let extra = self.stripe_channels(metadata.len(), stripes).await?;
+                if !extra.is_empty() {
+                    let channels: Vec<_> = std::iter::once(&self.xfer).chain(extra.iter().map(|sftp| sftp.as_ref())).collect();
+                    return transfer::upload_striped(&channels, local, remote, &self.transfer, control, file_options).await;
+                }
+            }
+        }
+        transfer::upload(&self.xfer, local, remote, &self.transfer, control, file_options).await
+    }
+
+    async fn remote_sha256(&self, path: &str) -> Result<String> {
+        let path = shell_quote(path);
+        let output = self.exec(&format!("sha256sum -- {0} 2>/dev/null || shasum -a 256 -- {0}", path)).await?;
+        match output.split_whitespace().next() {
+            Some(hash) if hash.len() == 64 && hash.bytes().all(|b| b.is_ascii_hexdigit()) => Ok(hash.to_ascii_lowercase()),
+            _ => Err(anyhow!("Remote checksum unavailable (no sha256sum or shasum on the server)")),
+        }
+    }
+
+    // Рекурсивная передача каталога с сохранением прав и символических ссылок
+    pub async fn sftp_transfer_dir(&self, direction: Direction, from: &str, to: &str, job: &Job) -> Result<()> {
+        let report = |progress| job.send(Response::Progress(progress));
+        let meter = Meter::tree(&report);
+        let (stop, mut control) = self.transfer_control(job, &meter);
+        let tree = transfer::transfer_tree(&self.xfer, direction, from, to, &self.transfer, self.max_transfers, &mut control);
+        transfer::cancellable(&job.cancel, stop, tree).await
+    }
+
+    // Обновляет каталог на сервере по локальному, передавая только изменившиеся части файлов
+    pub async fn sftp_sync(&self, local: &str, remote: &str, job: &Job) -> Result<sync::SyncReport> {
+        let report = |progress| job.send(Response::Progress(progress));
+        let meter = Meter::tree(&report);
+        let (stop, mut control) = self.transfer_control(job, &meter);
+        transfer::cancellable(&job.cancel, stop, sync::sync_tree(self, local, remote, &mut control)).await
+    }
+}
+
+fn check_sha256(copied: &Copied, expected: &str) -> Result<()> {
+    match copied.sha256.as_deref() {
+        Some(actual) if actual == expected => Ok(()),
+        Some(actual) => Err(anyhow!("Checksum mismatch: local {}, remote {}", actual, expected)),
+        None => Err(anyhow!("Local checksum was not computed")),
+    }
+}
+
+fn shell_quote(value: &str) -> String {
+    format!("'{}'", value.replace('\'', "'\\''"))
+}
+
+fn parent_path(path: &str) -> &str {
+    match path.trim_end_matches('/').rfind('/') {
+        Some(0) => "/",
+        Some(index) => &path[..index],
+        None => ".",
+    }
+}
+
+// Поток вывода команды: в двоичном режиме байты уходят как есть,
+// в JSON — строкой, для которой нужно склеивать разрезанные символы
+struct OutputStream {
+    name: &'static str,
+    text: Utf8Chunks,
+}
+
+impl OutputStream {
+    fn new(name: &'static str) -> Self {
+        OutputStream { name, text: Utf8Chunks::default() }
+    }
+
+    fn push(&mut self, job: &Job, data: &[u8]) {
+        let data = if job.responder.is_binary() {
+            Payload::Bytes(data.to_vec())
+        } else {
+            Payload::Text(self.text.push(data))
         };
-        
-        // 4. Копируем данные
-        let mut buffer = vec![0u8; 8192];
-        loop {
-            let n = match local_file.read(&mut buffer).await {
-                Ok(n) if n == 0 => break,
-                Ok(n) => n,
-                Err(e) => return Err(anyhow!("Error reading local file: {}", e)),
-            };
-            
-            remote_file.write_all(&buffer[..n]).await.map_err(|e| {
-                anyhow!("Error writing to remote file: {}", e)
-            })?;
+        job.send(Response::Chunk { stream: self.name, data });
+    }
+
+    fn finish(&mut self, job: &Job) {
+        let rest = self.text.finish();
+        if !rest.is_empty() {
+            job.send(Response::Chunk { stream: self.name, data: Payload::Text(rest) });
         }
-        
-        Ok(())
     }
 }
 
-struct Client;
+// Склеивает UTF-8 символы, разрезанные границей SSH-пакета
+#[derive(Default)]
+struct Utf8Chunks {
+    pending: Vec<u8>,
+}
+
+impl Utf8Chunks {
+    fn push(&mut self, data: &[u8]) -> String {
+        self.pending.extend_from_slice(data);
+        let valid = match std::str::from_utf8(&self.pending) {
+            Ok(_) => self.pending.len(),
+            Err(e) if e.error_len().is_none() => e.valid_up_to(),
+            Err(_) => self.pending.len(),
+        };
+        let text = String::from_utf8_lossy(&self.pending[..valid]).into_owned();
+        self.pending.drain(..valid);
+        text
+    }
+
+    fn finish(&mut self) -> String {
+        let text = String::from_utf8_lossy(&self.pending).into_owned();
+        self.pending.clear();
+        text
+    }
+}
+
+struct Client {
+    closed: watch::Sender<bool>,
+}
 
 impl client::Handler for Client {
     type Error = russh::Error;
     async fn check_server_key(&mut self, _key: &russh::keys::PublicKey) -> Result<bool, Self::Error> {
         Ok(true)
     }
+
+    async fn disconnected(&mut self, reason: client::DisconnectReason<Self::Error>) -> Result<(), Self::Error> {
+        self.closed.send_replace(true);
+        match reason {
+            client::DisconnectReason::ReceivedDisconnect(_) => Ok(()),
+            client::DisconnectReason::Error(e) => Err(e),
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn params(password: Option<&str>, private_key: Option<&str>) -> ConnectParams {
+        ConnectParams::new("example.org".into(), 22, "user".into(), password.map(Into::into), private_key.map(Into::into))
+    }
+
+    #[test]
+    fn pool_key_depends_on_credentials() {
+        let key = params(Some("secret"), None).pool_key().unwrap();
+        assert_eq!(params(Some("secret"), None).pool_key().unwrap(), key);
+        assert_ne!(params(Some("wrong"), None).pool_key().unwrap(), key);
+        assert_ne!(params(None, Some("secret")).pool_key().unwrap(), key);
+        assert!(!key.contains("secret"));
+        assert!(params(None, None).pool_key().is_none());
+    }
+
+    #[tokio::test]
+    async fn connect_without_credentials_fails() {
+        let error = Connections::default().get_or_connect(&params(None, None), &mut ConnectTimings::default()).await;
+        assert_eq!(error.err().unwrap().to_string(), "Missing auth method");
+    }
+
+    // Нужен настоящий sshd: SSH_TEST_HOST, SSH_TEST_PORT, SSH_TEST_USER, SSH_TEST_PASSWORD
+    //   cargo test -- --ignored
+    #[tokio::test]
+    #[ignore]
+    async fn shared_connection_needs_same_credentials() {
+        let env = |name| std::env::var(name).expect(name);
+        let connect = |password: Option<String>| {
+            let port = env("SSH_TEST_PORT").parse().unwrap();
+            ConnectParams::new(env("SSH_TEST_HOST"), port, env("SSH_TEST_USER"), password, None)
+        };
+        let connections = Connections::default();
+        let mut timings = ConnectTimings::default();
+        let (first, _) = connections.get_or_connect(&connect(Some(env("SSH_TEST_PASSWORD"))), &mut timings).await.unwrap();
+
+        let mut timings = ConnectTimings::default();
+        let wrong = connections.get_or_connect(&connect(Some("wrong".into())), &mut timings).await;
+        assert!(wrong.is_err());
+        assert!(!timings.reused);
+        assert!(connections.get_or_connect(&connect(None), &mut ConnectTimings::default()).await.is_err());
+
+        let mut timings = ConnectTimings::default();
+        let (second, _) = connections.get_or_connect(&connect(Some(env("SSH_TEST_PASSWORD"))), &mut timings).await.unwrap();
+        assert!(timings.reused && Arc::ptr_eq(&first, &second));
+    }
+
+    fn command(request: &str) -> Command {
+        serde_json::from_str::<Request>(request).unwrap().command
+    }
+
+    #[test]
+    fn replayable_commands() {
+        // Повтор после переподключения безопасен: чтение и передачи через .part
+        for request in [
+            r#"{"cmd": "SftpList", "path": "/"}"#,
+            r#"{"cmd": "GetHomeDir"}"#,
+            r#"{"cmd": "SftpDownload", "remote": "/a", "local": "/b"}"#,
+            r#"{"cmd": "SftpUpload", "local": "/b", "remote": "/a"}"#,
+            r#"{"cmd": "SftpDownloadDir", "remote": "/a", "local": "/b"}"#,
+            r#"{"cmd": "SftpUploadDir", "local": "/b", "remote": "/a"}"#,
+            r#"{"cmd": "SftpSync", "local": "/b", "remote": "/a"}"#,
+        ] {
+            assert!(command(request).is_replayable(), "{}", request);
+        }
+        // Второй раз выполнить команду, удалить или создать — уже не то же самое
+        for request in [
+            r#"{"cmd": "Exec", "command": "rm -rf build"}"#,
+            r#"{"cmd": "Exec", "command": "make", "stream": true}"#,
+            r#"{"cmd": "Shell", "cols": 80, "rows": 24}"#,
+            r#"{"cmd": "SftpRemove", "path": "/a"}"#,
+            r#"{"cmd": "SftpMkdir", "path": "/a"}"#,
+            r#"{"cmd": "SftpRmdir", "path": "/a"}"#,
+            r#"{"cmd": "Broadcast", "targets": [], "command": "id"}"#,
+        ] {
+            assert!(!command(request).is_replayable(), "{}", request);
+        }
+    }
+
+    #[test]
+    fn graceful_cancel_commands() {
+        for request in [
+            r#"{"cmd": "Exec", "command": "make", "stream": true}"#,
+            r#"{"cmd": "Shell", "cols": 80, "rows": 24}"#,
+            r#"{"cmd": "SftpList", "path": "/"}"#,
+            r#"{"cmd": "SftpUpload", "local": "/b", "remote": "/a"}"#,
+            r#"{"cmd": "SftpSync", "local": "/b", "remote": "/a"}"#,
+        ] {
+            assert!(command(request).cancels_gracefully(), "{}", request);
+        }
+        for request in [
+            r#"{"cmd": "Exec", "command": "make"}"#,
+            r#"{"cmd": "GetHomeDir"}"#,
+            r#"{"cmd": "SftpRemove", "path": "/a"}"#,
+        ] {
+            assert!(!command(request).cancels_gracefully(), "{}", request);
+        }
+    }
+
+    #[test]
+    fn only_transfers_can_pause() {
+        assert!(command(r#"{"cmd": "SftpDownloadDir", "remote": "/a", "local": "/b"}"#).is_transfer());
+        assert!(!command(r#"{"cmd": "SftpList", "path": "/"}"#).is_transfer());
+        assert!(!command(r#"{"cmd": "Shell", "cols": 80, "rows": 24}"#).is_transfer());
+    }
 }
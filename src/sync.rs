@@ -0,0 +1,665 @@
+// Синхронизация локального каталога с сервером в духе rsync: файлы сравниваются по размеру
+// и времени изменения, а от изменившихся на сервер уходят только отличающиеся куски
+
+use crate::transfer::{self, Control, FileOptions};
+use crate::{shell_quote, Session};
+use anyhow::{anyhow, Result};
+use russh::ChannelMsg;
+use russh_sftp::protocol::{FileAttributes, StatusCode};
+use serde::Serialize;
+use sha2::{Digest, Sha256};
+use std::collections::HashMap;
+use std::io::Read;
+use std::os::unix::fs::PermissionsExt;
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::Mutex;
+use tokio::io::{AsyncReadExt, AsyncWriteExt};
+use tokio::sync::mpsc;
+
+// Модуль скользящей суммы — простое число меньше 2^30: остаток от деления длинного числа
+// на такое Python считает быстрее всего
+const MODULUS: u64 = 1_073_741_789;
+const MIN_BLOCK: usize = 4 * 1024;
+const MAX_BLOCK: usize = 128 * 1024;
+// Файлы меньше этого дешевле отправить целиком, чем считать подписи
+const MIN_DELTA_SIZE: u64 = 64 * 1024;
+const MAX_LITERAL: usize = 64 * 1024;
+const READ_CHUNK: usize = 256 * 1024;
+// Прочитанное и уже отправленное выбрасывается из буфера кусками не меньше этого
+const COMPACT_AT: usize = 1024 * 1024;
+const SYNC_QUEUE: usize = 1024;
+
+// Помощник на сервере. `sig` печатает слабую и сильную сумму каждого блока файла, `patch`
+// собирает новый файл из блоков старого и присланных байт (команды приходят на stdin)
+// во временном файле рядом и подменяет им старый, так что оборванная передача ничего не портит
+const HELPER: &str = r#"
+import hashlib, os, struct, sys, tempfile
+mode, path, block = sys.argv[1], sys.argv[2], int(sys.argv[3])
+if mode == "sig":
+    out = sys.stdout.buffer
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            out.write(b"%d %s\n" % (int.from_bytes(data, "big") % 1073741789, hashlib.sha256(data).hexdigest()[:32].encode()))
+    out.write(b"end\n")
+    sys.exit(0)
+inp = sys.stdin.buffer
+fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".sync-")
+digest = hashlib.sha256()
+try:
+    with open(path, "rb") as old, os.fdopen(fd, "wb") as new:
+        while True:
+            op = inp.read(1)
+            if op == b"C":
+                old.seek(struct.unpack(">Q", inp.read(8))[0] * block)
+                data = old.read(block)
+            elif op == b"L":
+                size = struct.unpack(">I", inp.read(4))[0]
+                data = inp.read(size)
+                if len(data) != size:
+                    raise SystemExit("truncated delta")
+            elif op == b"E":
+                break
+            else:
+                raise SystemExit("truncated delta")
+            new.write(data)
+            digest.update(data)
+        new.flush()
+        os.fsync(new.fileno())
+    os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+    os.replace(tmp, path)
+except BaseException:
+    os.unlink(tmp)
+    raise
+print("ok", digest.hexdigest())
+"#;
+
+// Итог синхронизации; `sent` — всё, что реально ушло по сети за данные файлов, включая подписи блоков.
+// skipped — локальные символические ссылки и особые файлы, их синхронизация не переносит;
+// conflicts — пути на сервере, где на месте файла или каталога лежит ссылка или особый файл
+#[derive(Serialize, Default)]
+pub struct SyncReport {
+    pub files: u64,
+    pub updated: u64,
+    pub bytes: u64,
+    pub sent: u64,
+    pub saved: u64,
+    pub skipped: u64,
+    pub conflicts: Vec<String>,
+}
+
+struct SyncItem {
+    local: String,
+    remote: String,
+    size: u64,
+    // размер старой версии на сервере, если она есть
+    existing: Option<u64>,
+}
+
+struct SyncState<'a> {
+    sess: &'a Session,
+    queue: tokio::sync::Mutex<mpsc::Receiver<SyncItem>>,
+    // Нет python3 на сервере — дальше все изменившиеся файлы идут целиком
+    helper: AtomicBool,
+    report: Mutex<SyncReport>,
+    failures: Mutex<Vec<String>>,
+}
+
+impl SyncState<'_> {
+    fn fail(&self, path: &str, error: impl std::fmt::Display) {
+        self.failures.lock().unwrap().push(format!("{}: {}", path, error));
+    }
+
+    // Ссылку на сервере не заменяем и через неё не пишем: она может вести за пределы каталога
+    fn conflict(&self, remote: &str) {
+        self.report.lock().unwrap().conflicts.push(remote.to_string());
+    }
+
+    fn updated(&self, bytes: u64, sent: u64) {
+        let mut report = self.report.lock().unwrap();
+        report.updated += 1;
+        report.bytes += bytes;
+        report.sent += sent;
+    }
+}
+
+// Обход по уровням сравнивает каталоги с листингом сервера и кладёт изменившиеся файлы
+// в очередь; их разбирает пул рабочих, как при передаче каталога
+pub async fn sync_tree(sess: &Session, local: &str, remote: &str, control: &mut Control<'_>) -> Result<SyncReport> {
+    let (tx, rx) = mpsc::channel(SYNC_QUEUE);
+    let state = SyncState {
+        sess,
+        queue: tokio::sync::Mutex::new(rx),
+        helper: AtomicBool::new(true),
+        report: Mutex::default(),
+        failures: Mutex::default(),
+    };
+
+    let mut walker = control.fork();
+    let walk = async {
+        let result = walk(&state, local, remote, &tx, &mut walker).await;
+        drop(tx);
+        result
+    };
+    let pool = futures::future::join_all((0..sess.max_transfers).map(|_| sync_worker(&state, control.fork())));
+    let (walked, _) = tokio::join!(walk, pool);
+    walked?;
+    if control.is_cancelled() {
+        return Err(anyhow!("Cancelled"));
+    }
+    control.meter.finish();
+
+    let failures = state.failures.into_inner().unwrap();
+    if let Some(first) = failures.first() {
+        return Err(anyhow!("{} items failed, first: {}", failures.len(), first));
+    }
+    let mut report = state.report.into_inner().unwrap();
+    report.saved = report.bytes.saturating_sub(report.sent);
+    Ok(report)
+}
+
+async fn walk(
+    state: &SyncState<'_>,
+    local_root: &str,
+    remote_root: &str,
+    tx: &mpsc::Sender<SyncItem>,
+    control: &mut Control<'_>,
+) -> Result<()> {
+    let sftp = &state.sess.xfer;
+    transfer::create_remote_dir_all(sftp, remote_root).await?;
+
+    let mut level = vec![(local_root.to_string(), remote_root.to_string())];
+    while !level.is_empty() {
+        let mut next = Vec::new();
+        for (local_dir, remote_dir) in level {
+            let remote: HashMap<String, FileAttributes> = match transfer::read_remote_dir(sftp, &remote_dir).await {
+                Ok(files) => files.into_iter().map(|file| (file.filename, file.attrs)).collect(),
+                Err(e) => {
+                    state.fail(&remote_dir, e);
+                    continue;
+                }
+            };
+            let mut entries = match tokio::fs::read_dir(&local_dir).await {
+                Ok(entries) => entries,
+                Err(e) => {
+                    state.fail(&local_dir, e);
+                    continue;
+                }
+            };
+            loop {
+                let entry = match entries.next_entry().await {
+                    Ok(Some(entry)) => entry,
+                    Ok(None) => break,
+                    Err(e) => {
+                        state.fail(&local_dir, e);
+                        break;
+                    }
+                };
+                let name = entry.file_name().to_string_lossy().into_owned();
+                let from = entry.path().to_string_lossy().into_owned();
+                let to = format!("{}/{}", remote_dir.trim_end_matches('/'), name);
+                let metadata = match tokio::fs::symlink_metadata(&from).await {
+                    Ok(metadata) => metadata,
+                    Err(e) => {
+                        state.fail(&from, e);
+                        continue;
+                    }
+                };
+                let existing = remote.get(&name);
+                if existing.is_some_and(is_special) {
+                    if metadata.is_dir() || metadata.is_file() {
+                        state.conflict(&to);
+                    } else {
+                        state.report.lock().unwrap().skipped += 1;
+                    }
+                    continue;
+                }
+                if metadata.is_dir() {
+                    match existing {
+                        Some(attrs) if !attrs.is_dir() => {
+                            state.fail(&to, "is a file on the server");
+                            continue;
+                        }
+                        Some(_) => {}
+                        None => {
+                            let attrs = FileAttributes {
+                                permissions: Some(metadata.permissions().mode() & 0o7777),
+                                ..FileAttributes::empty()
+                            };
+                            if let Err(e) = sftp.mkdir(to.as_str(), attrs).await {
+                                state.fail(&to, e);
+                                continue;
+                            }
+                        }
+                    }
+                    next.push((from, to));
+                    continue;
+                }
+                // Символические ссылки и особые файлы синхронизация не переносит, только считает
+                if !metadata.is_file() {
+                    state.report.lock().unwrap().skipped += 1;
+                    continue;
+                }
+                state.report.lock().unwrap().files += 1;
+                let size = metadata.len();
+                let existing = match existing {
+                    Some(attrs) if attrs.is_dir() => {
+                        state.fail(&to, "is a directory on the server");
+                        continue;
+                    }
+                    Some(attrs) => {
+                        if attrs.size == Some(size) && attrs.mtime == transfer::local_attributes(&metadata).mtime {
+                            continue;
+                        }
+                        attrs.size
+                    }
+                    None => None,
+                };
+                control.meter.expect(size);
+                let item = SyncItem { local: from, remote: to, size, existing };
+                let sent = tokio::select! {
+                    sent = tx.send(item) => sent.is_ok(),
+                    _ = control.cancelled() => false,
+                };
+                if !sent {
+                    return Ok(());
+                }
+            }
+        }
+        level = next;
+    }
+    Ok(())
+}
+
+// Листинг сервера — по lstat: ссылка на каталог не is_dir, ссылка на файл не is_regular.
+// Без прав в листинге тип неизвестен, такую запись считаем обычной
+fn is_special(attrs: &FileAttributes) -> bool {
+    attrs.permissions.is_some() && !attrs.is_dir() && !attrs.is_regular()
+}
+
+async fn sync_worker(state: &SyncState<'_>, mut control: Control<'_>) {
+    loop {
+        let item = {
+            let mut queue = state.queue.lock().await;
+            tokio::select! {
+                item = queue.recv() => item,
+                _ = control.cancelled() => return,
+            }
+        };
+        let Some(item) = item else {
+            return;
+        };
+        if let Err(e) = sync_file(state, &item, &mut control).await {
+            if control.is_cancelled() {
+                return;
+            }
+            state.fail(&item.local, e);
+        }
+    }
+}
+
+async fn sync_file(state: &SyncState<'_>, item: &SyncItem, control: &mut Control<'_>) -> Result<()> {
+    control.ready().await?;
+    let sess = state.sess;
+    if let Some(existing) = item.existing.filter(|size| *size >= MIN_DELTA_SIZE) {
+        if state.helper.load(Ordering::Relaxed) {
+            let mut covered = 0;
+            match delta_upload(state, item, existing, control, &mut covered).await {
+                Ok(Some(sent)) => {
+                    // Время изменения как у локального файла — иначе следующая синхронизация снова его сравнит
+                    let metadata = tokio::fs::metadata(&item.local).await?;
+                    let status = sess.xfer.setstat(item.remote.as_str(), transfer::local_attributes(&metadata)).await?;
+                    if status.status_code != StatusCode::Ok {
+                        return Err(anyhow!(status.error_message));
+                    }
+                    control.meter.file_done();
+                    state.updated(item.size, sent);
+                    return Ok(());
+                }
+                Ok(None) => {}
+                Err(e) if control.is_cancelled() => return Err(e),
+                // Сервер остался со старой версией или с неверной сборкой — перезапишем целиком
+                Err(e) => log::warn!("delta sync of {} failed, sending the whole file: {}", item.local, e),
+            }
+            control.meter.retract(covered);
+        }
+    }
+    let file_options = FileOptions { preserve: true, ..FileOptions::default() };
+    transfer::upload(&sess.xfer, &item.local, &item.remote, &sess.transfer, control, file_options).await?;
+    state.updated(item.size, item.size);
+    Ok(())
+}
+
+// Возвращает None, если на сервере нет python3
+async fn delta_upload(
+    state: &SyncState<'_>,
+    item: &SyncItem,
+    existing: u64,
+    control: &mut Control<'_>,
+    covered: &mut u64,
+) -> Result<Option<u64>> {
+    let sess = state.sess;
+    let block = block_size(existing);
+    let (output, code) = run_helper(sess, &helper_command("sig", &item.remote, block)).await?;
+    let Some(signature) = Signature::parse(&output, block, existing) else {
+        // Код 127 — оболочка не нашла python3, и дальше помощник не нужен ни одному файлу.
+        // Прочие сбои (нет прав на чтение, файл исчез) касаются только этого файла
+        if code == Some(127) {
+            state.helper.store(false, Ordering::Relaxed);
+            return Ok(None);
+        }
+        return Err(anyhow!("Delta helper could not read {} (exit code {:?})", item.remote, code));
+    };
+    let mut sent = output.len() as u64;
+
+    let channel = sess.handle.channel_open_session().await?;
+    channel.exec(true, helper_command("patch", &item.remote, block)).await?;
+    let mut stream = channel.into_stream();
+
+    // Поиск совпадений — счёт по каждому байту файла, ему место в отдельном потоке
+    let (tx, mut rx) = mpsc::channel(16);
+    let local = item.local.clone();
+    let delta = tokio::task::spawn_blocking(move || compute_delta(&local, &signature, &tx));
+    let mut frame = Vec::new();
+    loop {
+        let op = tokio::select! {
+            op = rx.recv() => op,
+            _ = control.cancelled() => return Err(anyhow!("Cancelled")),
+        };
+        let Some(op) = op else {
+            break;
+        };
+        frame.clear();
+        let bytes = op.encode(&mut frame, block);
+        stream.write_all(&frame).await?;
+        sent += frame.len() as u64;
+        *covered += bytes;
+        control.meter.advance(bytes);
+    }
+    let sha256 = delta.await??;
+    stream.write_all(b"E").await?;
+    stream.shutdown().await?;
+
+    let mut output = Vec::new();
+    stream.read_to_end(&mut output).await?;
+    match String::from_utf8_lossy(&output).trim().strip_prefix("ok ") {
+        Some(remote) if remote == sha256 => Ok(Some(sent + 1)),
+        Some(remote) => Err(anyhow!("Checksum mismatch after delta: local {}, remote {}", sha256, remote)),
+        None => Err(anyhow!("Delta helper failed on the server")),
+    }
+}
+
+// stdout помощника и код выхода
+async fn run_helper(sess: &Session, command: &str) -> Result<(String, Option<u32>)> {
+    let mut channel = sess.handle.channel_open_session().await?;
+    channel.exec(true, command).await?;
+    let mut output = Vec::new();
+    let mut code = None;
+    while let Some(msg) = channel.wait().await {
+        match msg {
+            ChannelMsg::Data { data } => output.extend_from_slice(&data),
+            ChannelMsg::ExitStatus { exit_status } => code = Some(exit_status),
+            ChannelMsg::Close => break,
+            _ => {}
+        }
+    }
+    Ok((String::from_utf8_lossy(&output).into_owned(), code))
+}
+
+fn helper_command(mode: &str, path: &str, block: usize) -> String {
+    format!("python3 -c {} {} {} {}", shell_quote(HELPER), mode, shell_quote(path), block)
+}
+
+// Как у rsync: блок порядка корня из размера файла, чтобы и подписи, и промахи были недорогими
+fn block_size(size: u64) -> usize {
+    ((size as f64).sqrt() as usize).clamp(MIN_BLOCK, MAX_BLOCK) & !1023
+}
+
+struct Signature {
+    block: usize,
+    // слабая сумма → (номер блока, сильная сумма)
+    blocks: HashMap<u64, Vec<(u64, String)>>,
+}
+
+impl Signature {
+    // Короткий последний блок в поиск не попадает: совпасть он может только в самом конце файла
+    fn parse(output: &str, block: usize, size: u64) -> Option<Self> {
+        let full = size / block as u64;
+        let mut blocks: HashMap<u64, Vec<(u64, String)>> = HashMap::new();
+        for (index, line) in output.lines().enumerate() {
+            if line == "end" {
+                return Some(Self { block, blocks });
+            }
+            let (weak, strong) = line.split_once(' ')?;
+            if (index as u64) < full {
+                blocks.entry(weak.parse().ok()?).or_default().push((index as u64, strong.to_string()));
+            }
+        }
+        None
+    }
+
+    fn find(&self, weak: u64, window: &[u8]) -> Option<u64> {
+        let candidates = self.blocks.get(&weak)?;
+        let strong = format!("{:x}", Sha256::digest(window));
+        candidates.iter().find(|(_, hash)| hash[..] == strong[..32]).map(|(index, _)| *index)
+    }
+}
+
+enum Op {
+    Copy(u64),
+    Literal(Vec<u8>),
+}
+
+impl Op {
+    // Кодирует команду для `patch`; возвращает, сколько байт нового файла она даёт
+    fn encode(&self, frame: &mut Vec<u8>, block: usize) -> u64 {
+        match self {
+            Op::Copy(index) => {
+                frame.push(b'C');
+                frame.extend_from_slice(&index.to_be_bytes());
+                block as u64
+            }
+            Op::Literal(data) => {
+                frame.push(b'L');
+                frame.extend_from_slice(&(data.len() as u32).to_be_bytes());
+                frame.extend_from_slice(data);
+                data.len() as u64
+            }
+        }
+    }
+}
+
+// Окно длиной в блок скользит по локальному файлу по байту; где слабая и сильная суммы
+// совпали с блоком сервера, уходит ссылка на блок, остальное — как есть.
+// Возвращает SHA-256 локального файла для сверки с тем, что соберёт сервер
+fn compute_delta(path: &str, signature: &Signature, tx: &mpsc::Sender<Op>) -> Result<String> {
+    let send = |op| tx.blocking_send(op).map_err(|_| anyhow!("Cancelled"));
+    let mut file = std::fs::File::open(path).map_err(|e| anyhow!("Failed to open local file {}: {}", path, e))?;
+    let block = signature.block;
+    let top = (1..block).fold(1, |power, _| power * 256 % MODULUS);
+    let mut hasher = Sha256::new();
+    let mut buffer = Vec::new();
+    let mut eof = false;
+    // start — начало ещё не отправленных байт, pos — начало окна
+    let mut start = 0;
+    let mut pos = 0;
+    let mut weak = None;
+    loop {
+        // Нужен ещё и байт за окном, чтобы сдвинуть сумму
+        while !eof && buffer.len() <= pos + block {
+            let filled = buffer.len();
+            buffer.resize(filled + READ_CHUNK, 0);
+            let n = file.read(&mut buffer[filled..])?;
+            buffer.truncate(filled + n);
+            hasher.update(&buffer[filled..]);
+            eof = n == 0;
+        }
+        if buffer.len() < pos + block {
+            break;
+        }
+        let window = &buffer[pos..pos + block];
+        let hash = weak.unwrap_or_else(|| window.iter().fold(0, |sum, &byte| (sum * 256 + byte as u64) % MODULUS));
+        if let Some(index) = signature.find(hash, window) {
+            if start < pos {
+                send(Op::Literal(buffer[start..pos].to_vec()))?;
+            }
+            send(Op::Copy(index))?;
+            pos += block;
+            start = pos;
+            weak = None;
+        } else {
+            if buffer.len() == pos + block {
+                break;
+            }
+            let (out, next) = (buffer[pos] as u64, buffer[pos + block] as u64);
+            weak = Some(((hash + MODULUS - out * top % MODULUS) * 256 + next) % MODULUS);
+            pos += 1;
+            if pos - start >= MAX_LITERAL {
+                send(Op::Literal(buffer[start..pos].to_vec()))?;
+                start = pos;
+            }
+        }
+        if start >= COMPACT_AT {
+            buffer.drain(..start);
+            pos -= start;
+            start = 0;
+        }
+    }
+    for chunk in buffer[start..].chunks(MAX_LITERAL) {
+        send(Op::Literal(chunk.to_vec()))?;
+    }
+    Ok(format!("{:x}", hasher.finalize()))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::io::Write;
+    use std::process::{Command, Stdio};
+
+    // Тот же помощник, что на сервере, только запущенный локально
+    fn helper(args: &[&str], stdin: &[u8]) -> Option<Vec<u8>> {
+        let mut child = Command::new("python3")
+            .arg("-c")
+            .arg(HELPER)
+            .args(args)
+            .stdin(Stdio::piped())
+            .stdout(Stdio::piped())
+            .spawn()
+            .ok()?;
+        child.stdin.take().unwrap().write_all(stdin).unwrap();
+        let output = child.wait_with_output().unwrap();
+        assert!(output.status.success(), "helper {:?} failed", args);
+        Some(output.stdout)
+    }
+
+    fn temp_path(name: &str) -> String {
+        let dir = std::env::temp_dir().join(format!("ssh-backend-sync-{}", std::process::id()));
+        std::fs::create_dir_all(&dir).unwrap();
+        dir.join(name).to_string_lossy().into_owned()
+    }
+
+    // Псевдослучайные байты: сжимаемые данные дали бы одинаковые блоки и ложные совпадения
+    fn noise(len: usize, mut seed: u64) -> Vec<u8> {
+        (0..len)
+            .map(|_| {
+                seed = seed.wrapping_mul(6364136223846793005).wrapping_add(1442695040888963407);
+                (seed >> 33) as u8
+            })
+            .collect()
+    }
+
+    // Строит дельту old → new по подписи помощника, собирает файл его же `patch`
+    // и возвращает (сколько байт ушло ссылками на блоки, сколько литералами)
+    fn round_trip(name: &str, old: &[u8], new: &[u8]) -> Option<(u64, u64)> {
+        let (old_path, new_path) = (temp_path(&format!("{}.old", name)), temp_path(&format!("{}.new", name)));
+        std::fs::write(&old_path, old).unwrap();
+        std::fs::write(&new_path, new).unwrap();
+        let block = block_size(old.len() as u64);
+        let output = helper(&["sig", &old_path, &block.to_string()], b"")?;
+        let signature = Signature::parse(&String::from_utf8(output).unwrap(), block, old.len() as u64).unwrap();
+
+        let (tx, mut rx) = mpsc::channel(1 << 16);
+        let sha256 = compute_delta(&new_path, &signature, &tx).unwrap();
+        drop(tx);
+        let (mut copied, mut literal) = (0, 0);
+        let mut frame = Vec::new();
+        while let Ok(op) = rx.try_recv() {
+            let bytes = op.encode(&mut frame, block);
+            match op {
+                Op::Copy(_) => copied += bytes,
+                Op::Literal(_) => literal += bytes,
+            }
+        }
+        frame.push(b'E');
+
+        let reply = helper(&["patch", &old_path, &block.to_string()], &frame)?;
+        assert_eq!(String::from_utf8(reply).unwrap().trim(), format!("ok {}", sha256));
+        assert_eq!(std::fs::read(&old_path).unwrap(), new);
+        assert_eq!(sha256, format!("{:x}", Sha256::digest(new)));
+        let _ = std::fs::remove_file(&old_path);
+        let _ = std::fs::remove_file(&new_path);
+        Some((copied, literal))
+    }
+
+    #[test]
+    fn weak_sums_match_helper() {
+        let data = noise(300 * 1024, 1);
+        let path = temp_path("weak");
+        std::fs::write(&path, &data).unwrap();
+        let block = block_size(data.len() as u64);
+        let Some(output) = helper(&["sig", &path, &block.to_string()], b"") else {
+            return eprintln!("python3 not found, skipping");
+        };
+        let _ = std::fs::remove_file(&path);
+        let signature = Signature::parse(&String::from_utf8(output).unwrap(), block, data.len() as u64).unwrap();
+        for (index, chunk) in data.chunks_exact(block).enumerate() {
+            let weak = chunk.iter().fold(0, |sum, &byte| (sum * 256 + byte as u64) % MODULUS);
+            assert_eq!(signature.find(weak, chunk), Some(index as u64));
+        }
+    }
+
+    #[test]
+    fn unchanged_file_is_all_copies() {
+        let data = noise(256 * 1024, 2);
+        let Some((copied, literal)) = round_trip("same", &data, &data) else {
+            return eprintln!("python3 not found, skipping");
+        };
+        assert_eq!((copied, literal), (data.len() as u64, 0));
+    }
+
+    #[test]
+    fn shifted_blocks_are_found_by_rolling_sum() {
+        // Вставка в начало сдвигает все блоки на нечётное число байт: найти их можно
+        // только скользящей суммой
+        let old = noise(1024 * 1024 + 777, 3);
+        let mut new = b"inserted".to_vec();
+        new.extend_from_slice(&old[..500 * 1024]);
+        new.extend_from_slice(&noise(3000, 4));
+        new.extend_from_slice(&old[600 * 1024..]);
+        let Some((copied, literal)) = round_trip("shifted", &old, &new) else {
+            return eprintln!("python3 not found, skipping");
+        };
+        assert_eq!(copied + literal, new.len() as u64);
+        assert!(literal < 64 * 1024, "{} literal bytes", literal);
+    }
+
+    #[test]
+    fn long_literal_runs_are_split() {
+        let old = noise(128 * 1024, 5);
+        let new = noise(300 * 1024, 6);
+        let Some((copied, literal)) = round_trip("literal", &old, &new) else {
+            return eprintln!("python3 not found, skipping");
+        };
+        assert_eq!((copied, literal), (0, new.len() as u64));
+    }
+
+    #[test]
+    fn truncated_signature_is_rejected() {
+        assert!(Signature::parse("1 abc\n2 def\n", 4096, 8192).is_none());
+        assert!(Signature::parse("", 4096, 0).is_none());
+        assert!(Signature::parse("end\n", 4096, 0).is_some());
+    }
+}
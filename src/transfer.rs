@@ -0,0 +1,1653 @@
+// Конвейерная передача файлов по SFTP: в полёте держится окно запросов READ/WRITE
+// по явным смещениям (как очередь запросов `-R` у OpenSSH), а не один запрос за раз
+use anyhow::{anyhow, Result};
+use futures::stream::{FuturesUnordered, StreamExt};
+use russh_sftp::client::error::Error as SftpError;
+use russh_sftp::client::RawSftpSession;
+use russh_sftp::protocol::{Data, FileAttributes, OpenFlags, Status, StatusCode};
+use serde::{Deserialize, Serialize};
+use sha2::{Digest, Sha256};
+use std::collections::{BTreeMap, HashMap};
+use std::future::Future;
+use std::os::unix::fs::PermissionsExt;
+use std::path::Path;
+use std::sync::{Arc, Mutex};
+use std::time::{Duration, Instant, UNIX_EPOCH};
+use tokio::fs::File;
+use tokio::io::{AsyncRead, AsyncReadExt, AsyncSeekExt, AsyncWriteExt};
+use tokio::sync::{mpsc, watch, Notify, OwnedSemaphorePermit, Semaphore};
+
+pub const DEFAULT_CHUNK_SIZE: u32 = 256 * 1024;
+pub const DEFAULT_WINDOW: usize = 16;
+pub const DEFAULT_MAX_WINDOW: usize = 256;
+// Кадры прогресса уходят не чаще, чем раз в столько
+const PROGRESS_INTERVAL: Duration = Duration::from_millis(250);
+// Без расширения limits@openssh.com сервер обязан принимать только небольшие запросы
+const FALLBACK_CHUNK_SIZE: u32 = 32 * 1024;
+// Как часто докачиваемый файл сбрасывается на диск и отмечается в .part.json
+const CHECKPOINT_INTERVAL: Duration = Duration::from_secs(1);
+// Сколько найденных при обходе файлов может ждать свободного рабочего
+const TREE_QUEUE: usize = 1024;
+
+#[derive(Clone, Copy)]
+pub struct TransferOptions {
+    pub read_chunk: u32,
+    pub write_chunk: u32,
+    pub window: usize,
+    pub max_window: usize,
+    // OpenSSH принимает аргументы SSH_FXP_SYMLINK в обратном порядке
+    pub symlink_swapped: bool,
+}
+
+impl TransferOptions {
+    pub fn new(chunk_size: Option<u32>, window: Option<usize>, max_window: Option<usize>) -> Self {
+        let chunk = chunk_size.unwrap_or(DEFAULT_CHUNK_SIZE).max(1);
+        let max_window = max_window.unwrap_or(DEFAULT_MAX_WINDOW).max(1);
+        Self {
+            read_chunk: chunk,
+            write_chunk: chunk,
+            window: window.unwrap_or(DEFAULT_WINDOW).clamp(1, max_window),
+            max_window,
+            symlink_swapped: false,
+        }
+    }
+
+    // Урезает размер запросов до того, что объявил сервер
+    pub async fn negotiate(mut self, sftp: &RawSftpSession, extensions: &HashMap<String, String>) -> Self {
+        self.symlink_swapped = extensions.keys().any(|name| name.ends_with("@openssh.com"));
+        let limits = if extensions.contains_key("limits@openssh.com") { sftp.limits().await.ok() } else { None };
+        let (max_read, max_write) = match limits {
+            Some(limits) => (limits.max_read_len, limits.max_write_len),
+            None => (FALLBACK_CHUNK_SIZE as u64, FALLBACK_CHUNK_SIZE as u64),
+        };
+        // Ноль в limits означает «без ограничения»
+        if max_read > 0 {
+            self.read_chunk = self.read_chunk.min(max_read.min(u32::MAX as u64) as u32);
+        }
+        if max_write > 0 {
+            self.write_chunk = self.write_chunk.min(max_write.min(u32::MAX as u64) as u32);
+        }
+        self
+    }
+}
+
+// Окно подстраивается под задержку, как в TCP Vegas: пока ответы приходят почти за минимальный RTT,
+// очередь не копится и окно растёт; заметный рост задержки значит, что запросы ждут в очереди
+struct Window {
+    size: usize,
+    max: usize,
+    min_rtt: Option<Duration>,
+}
+
+impl Window {
+    fn new(options: &TransferOptions) -> Self {
+        Self { size: options.window, max: options.max_window, min_rtt: None }
+    }
+
+    fn update(&mut self, rtt: Duration) {
+        let min_rtt = self.min_rtt.map_or(rtt, |min_rtt| min_rtt.min(rtt));
+        self.min_rtt = Some(min_rtt);
+        if rtt > min_rtt * 2 {
+            self.size = (self.size - 1).max(1);
+        } else {
+            self.size = (self.size + 1).min(self.max);
+        }
+    }
+}
+
+#[derive(Serialize)]
+pub struct Progress {
+    pub bytes: u64,
+    pub total: Option<u64>,
+    // байт в секунду
+    pub rate: f64,
+    // секунд до конца
+    pub eta: Option<f64>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub files: Option<u64>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub files_total: Option<u64>,
+}
+
+// Что делать с отдельным файлом помимо копирования
+#[derive(Clone, Copy, Default)]
+pub struct FileOptions {
+    // перенести права и время изменения
+    pub preserve: bool,
+    // писать в <файл>.part с состоянием рядом (.part.json) и продолжать с места обрыва;
+    // у загрузки они лежат локально, у выгрузки — на сервере
+    pub resume: bool,
+    // посчитать SHA-256 переданных данных
+    pub checksum: bool,
+}
+
+pub struct Copied {
+    pub sha256: Option<String>,
+}
+
+// Состояние недокачанного файла в <файл>.part.json: докачка возможна, только если источник
+// тот же самый (размер и время изменения), и только с сохранённого смещения
+#[derive(Serialize, Deserialize, Clone)]
+struct PartState {
+    // источник: файл на сервере при загрузке, локальный файл при выгрузке
+    #[serde(alias = "remote")]
+    source: String,
+    size: u64,
+    mtime: u32,
+    offset: u64,
+    // у полосатой загрузки: [докуда записано, конец] каждой полосы
+    #[serde(default, skip_serializing_if = "Vec::is_empty")]
+    stripes: Vec<[u64; 2]>,
+}
+
+impl PartState {
+    fn same_file(&self, other: &PartState) -> bool {
+        self.source == other.source && self.size == other.size && self.mtime == other.mtime
+    }
+
+    // Источник выгрузки: локальный файл, время изменения в секундах
+    fn of_local(local: &str, metadata: &std::fs::Metadata) -> Self {
+        let mtime = metadata.modified().ok().and_then(|time| time.duration_since(UNIX_EPOCH).ok());
+        PartState {
+            source: local.to_string(),
+            size: metadata.len(),
+            mtime: mtime.map_or(0, |mtime| mtime.as_secs() as u32),
+            offset: 0,
+            stripes: Vec::new(),
+        }
+    }
+
+    fn paths(local: &str) -> (String, String) {
+        (format!("{}.part", local), format!("{}.part.json", local))
+    }
+
+    async fn load(path: &str) -> Option<Self> {
+        serde_json::from_slice(&tokio::fs::read(path).await.ok()?).ok()
+    }
+
+    // Докуда можно докачать локальный .part: состояние описывает тот же файл на сервере,
+    // и смещение не дальше того, что действительно лежит на диске
+    async fn resume_local(&self, part: &str, sidecar: &str) -> u64 {
+        match PartState::load(sidecar).await.filter(|saved| saved.same_file(self)) {
+            Some(saved) => saved.offset.min(tokio::fs::metadata(part).await.map_or(0, |metadata| metadata.len())),
+            None => 0,
+        }
+    }
+
+    // Через временный файл, чтобы обрыв посреди записи не оставил битое состояние
+    async fn save(&self, path: &str) -> Result<()> {
+        let temp = format!("{}.tmp", path);
+        tokio::fs::write(&temp, serde_json::to_vec(self)?).await?;
+        tokio::fs::rename(&temp, path).await?;
+        Ok(())
+    }
+
+    async fn load_remote(sftp: &RawSftpSession, path: &str) -> Option<Self> {
+        let handle = sftp.open(path, OpenFlags::READ, FileAttributes::empty()).await.ok()?.handle;
+        let data = sftp.read(handle.as_str(), 0, 64 * 1024).await;
+        let _ = sftp.close(handle).await;
+        serde_json::from_slice(&data.ok()?.data).ok()
+    }
+
+    // Недописанное состояние на сервере просто не разберётся, и выгрузка начнётся заново
+    async fn save_remote(&self, sftp: &RawSftpSession, path: &str) -> Result<()> {
+        let flags = OpenFlags::CREATE | OpenFlags::TRUNCATE | OpenFlags::WRITE;
+        let handle = sftp.open(path, flags, FileAttributes::empty()).await?.handle;
+        let written = sftp.write(handle.as_str(), 0, serde_json::to_vec(self)?).await;
+        let closed = sftp.close(handle).await;
+        written?;
+        closed?;
+        Ok(())
+    }
+}
+
+// Сохраняет ход передачи в .part.json; полосы обновляют каждая своё смещение,
+// а запись файла состояния идёт по одной. У загрузки файл состояния локальный, у выгрузки —
+// на сервере, и смещение в нём — докуда сервер подтвердил все записи
+struct Checkpoint<'a> {
+    sidecar: String,
+    state: Mutex<PartState>,
+    saving: tokio::sync::Mutex<()>,
+    remote: Option<&'a RawSftpSession>,
+}
+
+impl<'a> Checkpoint<'a> {
+    fn new(sidecar: &str, state: PartState) -> Self {
+        Self { sidecar: sidecar.to_string(), state: Mutex::new(state), saving: tokio::sync::Mutex::new(()), remote: None }
+    }
+
+    fn remote(sftp: &'a RawSftpSession, sidecar: &str, state: PartState) -> Self {
+        Self { remote: Some(sftp), ..Self::new(sidecar, state) }
+    }
+
+    async fn save(&self, stripe: Option<usize>, written: u64) -> Result<()> {
+        let _saving = self.saving.lock().await;
+        let state = {
+            let mut state = self.state.lock().unwrap();
+            match stripe {
+                Some(index) => {
+                    state.stripes[index][0] = written;
+                    // Целиком готово только начало файла до первой полосы
+                    state.offset = state.stripes[0][0];
+                }
+                None => state.offset = written,
+            }
+            state.clone()
+        };
+        match self.remote {
+            Some(sftp) => state.save_remote(sftp, &self.sidecar).await,
+            None => state.save(&self.sidecar).await,
+        }
+    }
+}
+
+// Прогресс одной команды. У передачи каталога его делят все рабочие, а объём
+// растёт по мере обхода; у одного файла объём известен только после открытия
+pub struct Meter<'a> {
+    report: &'a (dyn Fn(Progress) + Sync),
+    tree: bool,
+    state: Mutex<MeterState>,
+}
+
+struct MeterState {
+    bytes: u64,
+    total: Option<u64>,
+    files: u64,
+    files_total: u64,
+    started: Instant,
+    last: Option<(Instant, u64)>,
+    rate: f64,
+}
+
+impl<'a> Meter<'a> {
+    pub fn file(report: &'a (dyn Fn(Progress) + Sync)) -> Self {
+        Self::new(report, false)
+    }
+
+    pub fn tree(report: &'a (dyn Fn(Progress) + Sync)) -> Self {
+        Self::new(report, true)
+    }
+
+    fn new(report: &'a (dyn Fn(Progress) + Sync), tree: bool) -> Self {
+        let state = MeterState {
+            bytes: 0,
+            total: tree.then_some(0),
+            files: 0,
+            files_total: 0,
+            started: Instant::now(),
+            last: None,
+            rate: 0.0,
+        };
+        Self { report, tree, state: Mutex::new(state) }
+    }
+
+    // Обход каталога нашёл ещё один файл
+    pub fn expect(&self, size: u64) {
+        let mut state = self.state.lock().unwrap();
+        state.total = Some(state.total.unwrap_or(0) + size);
+        state.files_total += 1;
+    }
+
+    fn begin(&self, size: Option<u64>) {
+        let mut state = self.state.lock().unwrap();
+        if !self.tree {
+            state.total = size;
+        }
+        self.tick(&mut state);
+    }
+
+    // Байты, которые уже были на месте (докачка): в объёме считаются, в скорость — нет
+    fn skip(&self, bytes: u64) {
+        let mut state = self.state.lock().unwrap();
+        state.bytes += bytes;
+        if let Some((_, last_bytes)) = state.last.as_mut() {
+            *last_bytes += bytes;
+        }
+    }
+
+    pub fn advance(&self, bytes: u64) {
+        let mut state = self.state.lock().unwrap();
+        state.bytes += bytes;
+        self.tick(&mut state);
+    }
+
+    // Байты неудавшейся попытки, которые придётся передать заново
+    pub fn retract(&self, bytes: u64) {
+        let mut state = self.state.lock().unwrap();
+        state.bytes = state.bytes.saturating_sub(bytes);
+    }
+
+    pub fn file_done(&self) {
+        let mut state = self.state.lock().unwrap();
+        state.files += 1;
+        if !self.tree {
+            self.finish_locked(&mut state);
+        }
+    }
+
+    pub fn finish(&self) {
+        self.finish_locked(&mut self.state.lock().unwrap());
+    }
+
+    // Кадры уходят не чаще PROGRESS_INTERVAL, первый — сразу, чтобы было видно начало передачи
+    fn tick(&self, state: &mut MeterState) {
+        let now = Instant::now();
+        if let Some((at, last_bytes)) = state.last {
+            let elapsed = now - at;
+            if elapsed < PROGRESS_INTERVAL {
+                return;
+            }
+            // Скорость сглаживается, чтобы ETA не прыгало от кадра к кадру
+            let sample = state.bytes.saturating_sub(last_bytes) as f64 / elapsed.as_secs_f64();
+            state.rate = if state.rate == 0.0 { sample } else { state.rate * 0.7 + sample * 0.3 };
+        } else {
+            state.started = now;
+        }
+        state.last = Some((now, state.bytes));
+        self.report(state, state.rate);
+    }
+
+    fn finish_locked(&self, state: &mut MeterState) {
+        let elapsed = state.started.elapsed().as_secs_f64();
+        let rate = if elapsed > 0.0 { state.bytes as f64 / elapsed } else { 0.0 };
+        if !self.tree {
+            state.total = Some(state.bytes);
+        }
+        self.report(state, rate);
+    }
+
+    fn report(&self, state: &MeterState, rate: f64) {
+        let eta = state.total.filter(|_| rate > 0.0).map(|total| total.saturating_sub(state.bytes) as f64 / rate);
+        (self.report)(Progress {
+            bytes: state.bytes,
+            total: state.total,
+            rate,
+            eta,
+            files: self.tree.then_some(state.files),
+            files_total: self.tree.then_some(state.files_total),
+        });
+    }
+}
+
+// Связь передачи с очередью сессии: слот в очереди, отмена, пауза и прогресс.
+// Отмена — watch-канал, а не Notify: её должны увидеть сразу все рабочие передачи каталога
+pub struct Control<'a> {
+    lane: Arc<Semaphore>,
+    slot: Option<OwnedSemaphorePermit>,
+    cancel: watch::Receiver<bool>,
+    paused: watch::Receiver<bool>,
+    pub meter: &'a Meter<'a>,
+}
+
+impl<'a> Control<'a> {
+    pub fn new(
+        lane: Arc<Semaphore>,
+        cancel: watch::Receiver<bool>,
+        paused: watch::Receiver<bool>,
+        meter: &'a Meter<'a>,
+    ) -> Self {
+        Self { lane, slot: None, cancel, paused, meter }
+    }
+
+    // Ещё один рабочий той же команды: со своим слотом в очереди
+    pub fn fork(&self) -> Self {
+        Self::new(self.lane.clone(), self.cancel.clone(), self.paused.clone(), self.meter)
+    }
+
+    fn is_paused(&self) -> bool {
+        *self.paused.borrow()
+    }
+
+    pub fn is_cancelled(&self) -> bool {
+        *self.cancel.borrow()
+    }
+
+    pub async fn cancelled(&mut self) {
+        if self.cancel.wait_for(|cancelled| *cancelled).await.is_err() {
+            std::future::pending::<()>().await;
+        }
+    }
+
+    // Ждёт свой слот в очереди; на паузе слот отдаётся другим передачам
+    pub async fn ready(&mut self) -> Result<()> {
+        loop {
+            if self.is_cancelled() {
+                return Err(anyhow!("Cancelled"));
+            }
+            if self.is_paused() {
+                self.slot = None;
+                tokio::select! {
+                    Ok(()) = self.paused.changed() => {}
+                    _ = self.cancel.changed() => {}
+                }
+                continue;
+            }
+            if self.slot.is_some() {
+                return Ok(());
+            }
+            tokio::select! {
+                permit = self.lane.clone().acquire_owned() => self.slot = Some(permit?),
+                Ok(()) = self.paused.changed() => {}
+                _ = self.cancel.changed() => {}
+            }
+        }
+    }
+}
+
+// Переводит Cancel команды в сигнал `stop`, но дожидается, пока передача сама остановится
+// и закроет свои дескрипторы на сервере
+pub async fn cancellable<T>(cancel: &Notify, stop: watch::Sender<bool>, work: impl Future<Output = T>) -> T {
+    let forward = async {
+        cancel.notified().await;
+        stop.send_replace(true);
+        std::future::pending::<T>().await
+    };
+    tokio::select! {
+        result = work => result,
+        never = forward => never,
+    }
+}
+
+pub async fn download(
+    sftp: &RawSftpSession,
+    remote: &str,
+    local: &str,
+    options: &TransferOptions,
+    control: &mut Control<'_>,
+    file_options: FileOptions,
+) -> Result<Copied> {
+    control.ready().await?;
+    let handle = sftp.open(remote, OpenFlags::READ, FileAttributes::empty()).await?.handle;
+    let result = download_handle(sftp, &handle, remote, local, options, control, file_options).await;
+    let _ = sftp.close(handle).await;
+    if result.is_ok() {
+        control.meter.file_done();
+    }
+    result
+}
+
+async fn download_handle(
+    sftp: &RawSftpSession,
+    handle: &str,
+    remote: &str,
+    local: &str,
+    options: &TransferOptions,
+    control: &mut Control<'_>,
+    file_options: FileOptions,
+) -> Result<Copied> {
+    let attrs = sftp.fstat(handle).await.ok().map(|attrs| attrs.attrs);
+    // Размер может быть неизвестен — тогда читаем до EOF
+    let end = attrs.as_ref().and_then(|attrs| attrs.size);
+    let mut hasher = file_options.checksum.then(Sha256::new);
+
+    let (part, sidecar) = PartState::paths(local);
+    let target = if file_options.resume { part.as_str() } else { local };
+    // Без размера и времени изменения нельзя проверить, что докачиваем тот же файл
+    let mut state = match (file_options.resume, attrs.as_ref()) {
+        (true, Some(FileAttributes { size: Some(size), mtime: Some(mtime), .. })) => {
+            Some(PartState { source: remote.to_string(), size: *size, mtime: *mtime, offset: 0, stripes: Vec::new() })
+        }
+        _ => None,
+    };
+    let mut resume_from = 0;
+    if let Some(state) = state.as_mut() {
+        resume_from = state.resume_local(&part, &sidecar).await;
+        state.offset = resume_from;
+        state.save(&sidecar).await?;
+    }
+    let checkpoint = state.map(|state| Checkpoint::new(&sidecar, state));
+    let mut file = if resume_from > 0 {
+        let mut file = tokio::fs::OpenOptions::new().read(true).write(true).open(target).await?;
+        file.set_len(resume_from).await?;
+        if let Some(hasher) = hasher.as_mut() {
+            hash_prefix(&mut file, resume_from, hasher).await?;
+        }
+        file.seek(std::io::SeekFrom::Start(resume_from)).await?;
+        file
+    } else {
+        File::create(target).await?
+    };
+
+    control.meter.skip(resume_from);
+    control.meter.begin(end);
+    let checkpoint = checkpoint.as_ref().map(|checkpoint| (checkpoint, None));
+    fetch_range(sftp, handle, &mut file, resume_from, end, options, control, hasher.as_mut(), checkpoint).await?;
+    finish_download(file, attrs.as_ref(), local, file_options).await?;
+    Ok(Copied { sha256: hasher.map(|hasher| format!("{:x}", hasher.finalize())) })
+}
+
+// Читает [start, end) конвейером запросов и пишет по порядку в `file`, уже стоящий на `start`;
+// без `end` — до EOF. Возвращает, докуда файл записан
+async fn fetch_range(
+    sftp: &RawSftpSession,
+    handle: &str,
+    file: &mut File,
+    start: u64,
+    mut end: Option<u64>,
+    options: &TransferOptions,
+    control: &mut Control<'_>,
+    mut hasher: Option<&mut Sha256>,
+    checkpoint: Option<(&Checkpoint<'_>, Option<usize>)>,
+) -> Result<u64> {
+    let chunk = options.read_chunk;
+    let mut window = Window::new(options);
+    let mut inflight = FuturesUnordered::new();
+    let mut next_offset = start; // первый ещё не запрошенный байт
+    let mut tails = Vec::new(); // недочитанные хвосты коротких ответов
+    let mut ready = BTreeMap::new(); // пришедшие не по порядку куски
+    let mut written = start;
+    let mut saved = Instant::now();
+    // Не убегаем вперёд записанного больше чем на максимальное окно
+    let ahead_limit = options.max_window as u64 * chunk as u64;
+
+    loop {
+        // Флаг паузы читается один раз: иначе пауза между двумя проверками оставит конвейер
+        // пустым, и это сойдёт за конец файла
+        let paused = control.is_paused();
+        // На паузе дожидаемся уже отправленных запросов и только потом отдаём слот
+        if paused && inflight.is_empty() {
+            control.ready().await?;
+            continue;
+        }
+        while !paused && inflight.len() < window.size {
+            let (offset, len) = match tails.pop() {
+                Some(tail) => tail,
+                None => {
+                    if end.is_some_and(|end| next_offset >= end) || next_offset - written >= ahead_limit {
+                        break;
+                    }
+                    let len = end.map_or(chunk as u64, |end| (end - next_offset).min(chunk as u64)) as u32;
+                    next_offset += len as u64;
+                    (next_offset - len as u64, len)
+                }
+            };
+            inflight.push(read_at(sftp, handle, offset, len));
+        }
+
+        let next = tokio::select! {
+            next = inflight.next() => next,
+            _ = control.cancelled() => return Err(anyhow!("Cancelled")),
+        };
+        let Some((offset, len, rtt, result)) = next else {
+            // Запросов больше нет: это конец, только если всё до конца диапазона записано
+            if end.is_some_and(|end| written >= end) {
+                break;
+            }
+            return Err(anyhow!("Transfer stopped at {} before the end of the file", written));
+        };
+        window.update(rtt);
+        match result {
+            Ok(data) if !data.data.is_empty() => {
+                let n = data.data.len() as u64;
+                if n < len as u64 && end.map_or(true, |end| offset + n < end) {
+                    tails.push((offset + n, len - n as u32));
+                }
+                ready.insert(offset, data.data);
+            }
+            Ok(_) => end = Some(end.map_or(offset, |end| end.min(offset))),
+            Err(SftpError::Status(status)) if status.status_code == StatusCode::Eof => {
+                end = Some(end.map_or(offset, |end| end.min(offset)));
+            }
+            Err(e) => return Err(anyhow!(e)),
+        }
+        // Файл короче, чем казалось: хвосты за концом уже не нужны
+        if let Some(end) = end {
+            tails.retain(|&(offset, _)| offset < end);
+        }
+
+        let before = written;
+        while let Some(data) = ready.remove(&written) {
+            file.write_all(&data).await?;
+            if let Some(hasher) = hasher.as_mut() {
+                hasher.update(&data);
+            }
+            written += data.len() as u64;
+        }
+        control.meter.advance(written - before);
+
+        // Смещение в .part.json не обгоняет то, что уже действительно лежит на диске
+        if let Some((checkpoint, stripe)) = checkpoint.filter(|_| saved.elapsed() >= CHECKPOINT_INTERVAL) {
+            file.flush().await?;
+            file.sync_data().await?;
+            checkpoint.save(stripe, written).await?;
+            saved = Instant::now();
+        }
+    }
+
+    if !ready.is_empty() {
+        return Err(anyhow!("Transfer stopped with a gap at offset {}", written));
+    }
+    file.flush().await?;
+    Ok(written)
+}
+
+// Права и время изменения как на сервере, затем .part становится самим файлом
+async fn finish_download(file: File, attrs: Option<&FileAttributes>, local: &str, file_options: FileOptions) -> Result<()> {
+    if let Some(attrs) = attrs.filter(|_| file_options.preserve) {
+        if let Some(permissions) = attrs.permissions {
+            file.set_permissions(std::fs::Permissions::from_mode(permissions & 0o7777)).await?;
+        }
+        if let Some(mtime) = attrs.mtime {
+            let file = file.into_std().await;
+            file.set_modified(UNIX_EPOCH + Duration::from_secs(mtime as u64))?;
+        }
+    }
+    if file_options.resume {
+        let (part, sidecar) = PartState::paths(local);
+        tokio::fs::rename(&part, local).await?;
+        let _ = tokio::fs::remove_file(&sidecar).await;
+    }
+    Ok(())
+}
+
+// Загрузка большого файла полосами: каждая полоса — свой диапазон по своему SFTP-каналу,
+// запись сразу на место в заранее выделенном файле. Докачка помнит смещение каждой полосы
+pub async fn download_striped(
+    channels: &[&RawSftpSession],
+    remote: &str,
+    local: &str,
+    attrs: &FileAttributes,
+    options: &TransferOptions,
+    control: &mut Control<'_>,
+    file_options: FileOptions,
+) -> Result<Copied> {
+    let size = attrs.size.ok_or_else(|| anyhow!("Size of {} is unknown", remote))?;
+    let (part, sidecar) = PartState::paths(local);
+    let target = if file_options.resume { part.as_str() } else { local };
+    let mut stripes = split_range(0, size, channels.len(), options.read_chunk);
+    let mut resumed = false;
+    let checkpoint = match (file_options.resume, attrs.mtime) {
+        (true, Some(mtime)) => {
+            let mut state = PartState { source: remote.to_string(), size, mtime, offset: 0, stripes: Vec::new() };
+            if let Some(saved) = PartState::load(&sidecar).await.filter(|saved| saved.same_file(&state)) {
+                let on_disk = tokio::fs::metadata(&part).await.map_or(0, |metadata| metadata.len());
+                // Полосатый .part уже выделен целиком; от обычного годится только начало
+                stripes = if !saved.stripes.is_empty() && on_disk == size {
+                    saved.stripes
+                } else {
+                    split_range(saved.offset.min(on_disk), size, channels.len(), options.read_chunk)
+                };
+                resumed = true;
+            }
+            state.offset = stripes.first().map_or(size, |stripe| stripe[0]);
+            state.stripes = stripes.clone();
+            state.save(&sidecar).await?;
+            Some(Checkpoint::new(&sidecar, state))
+        }
+        _ => None,
+    };
+    let file = if resumed {
+        tokio::fs::OpenOptions::new().write(true).open(target).await?
+    } else {
+        File::create(target).await?
+    };
+    file.set_len(size).await?;
+
+    let left: u64 = stripes.iter().map(|stripe| stripe[1] - stripe[0]).sum();
+    control.meter.skip(size - left);
+    control.meter.begin(Some(size));
+    let results = futures::future::join_all(stripes.iter().enumerate().map(|(index, &stripe)| {
+        let checkpoint = checkpoint.as_ref().map(|checkpoint| (checkpoint, Some(index)));
+        download_stripe(channels[index % channels.len()], remote, target, stripe, options, control.fork(), checkpoint)
+    }))
+    .await;
+    results.into_iter().collect::<Result<Vec<()>>>()?;
+
+    let mut hasher = file_options.checksum.then(Sha256::new);
+    if let Some(hasher) = hasher.as_mut() {
+        // Полосы пишутся вперемешку, поэтому хэш — отдельным проходом по диску
+        let mut file = File::open(target).await?;
+        hash_prefix(&mut file, size, hasher).await?;
+    }
+    finish_download(file, Some(attrs), local, file_options).await?;
+    control.meter.file_done();
+    Ok(Copied { sha256: hasher.map(|hasher| format!("{:x}", hasher.finalize())) })
+}
+
+async fn download_stripe(
+    sftp: &RawSftpSession,
+    remote: &str,
+    target: &str,
+    stripe: [u64; 2],
+    options: &TransferOptions,
+    mut control: Control<'_>,
+    checkpoint: Option<(&Checkpoint<'_>, Option<usize>)>,
+) -> Result<()> {
+    if stripe[0] >= stripe[1] {
+        return Ok(());
+    }
+    control.ready().await?;
+    let handle = sftp.open(remote, OpenFlags::READ, FileAttributes::empty()).await?.handle;
+    let result = async {
+        let mut file = tokio::fs::OpenOptions::new().write(true).open(target).await?;
+        file.seek(std::io::SeekFrom::Start(stripe[0])).await?;
+        let end = Some(stripe[1]);
+        let written = fetch_range(sftp, &handle, &mut file, stripe[0], end, options, &mut control, None, checkpoint).await?;
+        if written < stripe[1] {
+            return Err(anyhow!("{} became shorter during the transfer", remote));
+        }
+        Ok(())
+    }
+    .await;
+    let _ = sftp.close(handle).await;
+    result
+}
+
+// Делит [start, end) на `count` почти равных частей по границам запросов
+fn split_range(start: u64, end: u64, count: usize, chunk: u32) -> Vec<[u64; 2]> {
+    let chunks = (end - start).div_ceil(chunk as u64);
+    let per_stripe = chunks.div_ceil(count.max(1) as u64).max(1) * chunk as u64;
+    (0..count as u64)
+        .map(|index| [(start + index * per_stripe).min(end), (start + (index + 1) * per_stripe).min(end)])
+        .collect()
+}
+
+// Хэш уже скачанной части при докачке: локальный диск быстрее сети, это дёшево
+async fn hash_prefix(file: &mut File, len: u64, hasher: &mut Sha256) -> Result<()> {
+    let mut buffer = vec![0u8; 1024 * 1024];
+    let mut left = len;
+    while left > 0 {
+        let want = left.min(buffer.len() as u64) as usize;
+        let n = file.read(&mut buffer[..want]).await?;
+        if n == 0 {
+            return Err(anyhow!("Partial file is shorter than expected"));
+        }
+        hasher.update(&buffer[..n]);
+        left -= n as u64;
+    }
+    Ok(())
+}
+
+async fn read_at(sftp: &RawSftpSession, handle: &str, offset: u64, len: u32) -> (u64, u32, Duration, Result<Data, SftpError>) {
+    let started = Instant::now();
+    let result = sftp.read(handle, offset, len).await;
+    (offset, len, started.elapsed(), result)
+}
+
+pub async fn upload(
+    sftp: &RawSftpSession,
+    local: &str,
+    remote: &str,
+    options: &TransferOptions,
+    control: &mut Control<'_>,
+    file_options: FileOptions,
+) -> Result<Copied> {
+    control.ready().await?;
+    let mut file = File::open(local).await.map_err(|e| anyhow!("Failed to open local file {}: {}", local, e))?;
+    let metadata = file.metadata().await?;
+    let size = metadata.len();
+    let (part, sidecar) = PartState::paths(remote);
+    let target = if file_options.resume { part.as_str() } else { remote };
+
+    // Продолжаем, только если .part.json описывает этот же локальный файл, а .part на сервере
+    // не короче подтверждённого смещения
+    let mut resume_from = 0;
+    let mut checkpoint = None;
+    if file_options.resume {
+        let mut state = PartState::of_local(local, &metadata);
+        if let Some(saved) = PartState::load_remote(sftp, &sidecar).await.filter(|saved| saved.same_file(&state)) {
+            let on_server = sftp.stat(part.as_str()).await.ok().and_then(|attrs| attrs.attrs.size).unwrap_or(0);
+            if on_server >= saved.offset {
+                resume_from = saved.offset.min(size);
+            }
+        }
+        state.offset = resume_from;
+        state.save_remote(sftp, &sidecar).await?;
+        checkpoint = Some(Checkpoint::remote(sftp, &sidecar, state));
+    }
+
+    let flags = if resume_from > 0 { OpenFlags::WRITE } else { OpenFlags::CREATE | OpenFlags::TRUNCATE | OpenFlags::WRITE };
+    let handle = match sftp.open(target, flags, FileAttributes::empty()).await {
+        Ok(handle) => handle.handle,
+        Err(e) => return Err(anyhow!("Failed to create remote file {}: {}", target, e)),
+    };
+    let mut hasher = file_options.checksum.then(Sha256::new);
+    let prepared = match hasher.as_mut() {
+        Some(hasher) => hash_prefix(&mut file, resume_from, hasher).await,
+        None => file.seek(std::io::SeekFrom::Start(resume_from)).await.map(|_| ()).map_err(|e| anyhow!(e)),
+    };
+    if let Err(e) = prepared {
+        let _ = sftp.close(handle).await;
+        return Err(e);
+    }
+    control.meter.skip(resume_from);
+    control.meter.begin(Some(size));
+    let checkpoint = checkpoint.as_ref().map(|checkpoint| (checkpoint, None));
+    let result = send_range(sftp, &handle, &mut file, resume_from, None, options, control, hasher.as_mut(), checkpoint).await;
+    close_upload(sftp, handle, target, &metadata, result.is_ok() && file_options.preserve).await?;
+    result?;
+    if file_options.resume {
+        finish_upload(sftp, &part, remote, &sidecar).await?;
+    }
+    control.meter.file_done();
+    Ok(Copied { sha256: hasher.map(|hasher| format!("{:x}", hasher.finalize())) })
+}
+
+// .part становится самим файлом. В SFTP v3 RENAME поверх существующего файла не работает,
+// поэтому старый файл удаляется непосредственно перед повтором
+async fn finish_upload(sftp: &RawSftpSession, part: &str, remote: &str, sidecar: &str) -> Result<()> {
+    if sftp.rename(part, remote).await.is_err() {
+        let _ = sftp.remove(remote).await;
+        sftp.rename(part, remote).await.map_err(|e| anyhow!("Failed to rename {} to {}: {}", part, remote, e))?;
+    }
+    let _ = sftp.remove(sidecar).await;
+    Ok(())
+}
+
+// Ошибка при закрытии тоже значит, что данные могли не записаться
+async fn close_upload(sftp: &RawSftpSession, handle: String, remote: &str, metadata: &std::fs::Metadata, preserve: bool) -> Result<()> {
+    let closed = if preserve {
+        // SETSTAT уходит вместе с CLOSE: сервер выполняет их по порядку, лишнего RTT нет
+        let (set, closed) = tokio::join!(sftp.fsetstat(handle.as_str(), local_attributes(metadata)), sftp.close(handle.as_str()));
+        set.and(closed)
+    } else {
+        sftp.close(handle).await
+    };
+    closed.map(|_| ()).map_err(|e| anyhow!("Error closing remote file {}: {}", remote, e))
+}
+
+// Пишет на сервер [start, end) из `file`, уже стоящего на `start`; без `end` — до конца файла
+async fn send_range(
+    sftp: &RawSftpSession,
+    handle: &str,
+    file: &mut File,
+    start: u64,
+    end: Option<u64>,
+    options: &TransferOptions,
+    control: &mut Control<'_>,
+    mut hasher: Option<&mut Sha256>,
+    checkpoint: Option<(&Checkpoint<'_>, Option<usize>)>,
+) -> Result<()> {
+    let mut window = Window::new(options);
+    let mut inflight = FuturesUnordered::new();
+    let mut offset = start;
+    let mut eof = false;
+    // Подтверждения приходят не по порядку; докачка возможна только с начала неподтверждённого
+    let mut acked = start;
+    let mut acks = BTreeMap::new();
+    let mut saved = Instant::now();
+
+    loop {
+        let paused = control.is_paused();
+        if paused && inflight.is_empty() {
+            control.ready().await?;
+            continue;
+        }
+        while !eof && !paused && inflight.len() < window.size {
+            let len = end.map_or(options.write_chunk as u64, |end| (end - offset).min(options.write_chunk as u64));
+            let mut buffer = vec![0u8; len as usize];
+            let n = read_full(file, &mut buffer).await.map_err(|e| anyhow!("Error reading local file: {}", e))?;
+            if n == 0 {
+                eof = true;
+                break;
+            }
+            buffer.truncate(n);
+            if let Some(hasher) = hasher.as_mut() {
+                hasher.update(&buffer);
+            }
+            inflight.push(write_at(sftp, handle, offset, buffer));
+            offset += n as u64;
+        }
+
+        let next = tokio::select! {
+            next = inflight.next() => next,
+            _ = control.cancelled() => return Err(anyhow!("Cancelled")),
+        };
+        let Some((written_at, len, rtt, result)) = next else {
+            if eof {
+                break;
+            }
+            return Err(anyhow!("Transfer stopped at {} before the end of the file", offset));
+        };
+        window.update(rtt);
+        match result {
+            Ok(status) if status.status_code == StatusCode::Ok => control.meter.advance(len),
+            Ok(status) => return Err(anyhow!("Error writing to remote file: {}", status.error_message)),
+            Err(e) => return Err(anyhow!("Error writing to remote file: {}", e)),
+        }
+        if let Some((checkpoint, stripe)) = checkpoint {
+            acks.insert(written_at, len);
+            while let Some(len) = acks.remove(&acked) {
+                acked += len;
+            }
+            if saved.elapsed() >= CHECKPOINT_INTERVAL {
+                checkpoint.save(stripe, acked).await?;
+                saved = Instant::now();
+            }
+        }
+    }
+    if end.is_some_and(|end| offset < end) {
+        return Err(anyhow!("Local file became shorter during the transfer"));
+    }
+    Ok(())
+}
+
+// Выгрузка полосами: файл на сервере создаётся и растягивается до полного размера,
+// затем каждая полоса пишет свой диапазон через свой SFTP-канал. Докачка, как у загрузки,
+// помнит подтверждённое смещение каждой полосы в .part.json на сервере
+pub async fn upload_striped(
+    channels: &[&RawSftpSession],
+    local: &str,
+    remote: &str,
+    options: &TransferOptions,
+    control: &mut Control<'_>,
+    file_options: FileOptions,
+) -> Result<Copied> {
+    let metadata = tokio::fs::metadata(local).await.map_err(|e| anyhow!("Failed to open local file {}: {}", local, e))?;
+    let size = metadata.len();
+    let (part, sidecar) = PartState::paths(remote);
+    let target = if file_options.resume { part.as_str() } else { remote };
+    let sftp = channels[0];
+    let mut stripes = split_range(0, size, channels.len(), options.write_chunk);
+    let mut resumed = false;
+    let mut checkpoint = None;
+    if file_options.resume {
+        let mut state = PartState::of_local(local, &metadata);
+        if let Some(saved) = PartState::load_remote(sftp, &sidecar).await.filter(|saved| saved.same_file(&state)) {
+            let on_server = sftp.stat(part.as_str()).await.ok().and_then(|attrs| attrs.attrs.size).unwrap_or(0);
+            // Полосатый .part уже растянут до полного размера; от обычного годится только начало
+            if !saved.stripes.is_empty() && on_server == size {
+                stripes = saved.stripes;
+                resumed = true;
+            } else if on_server >= saved.offset {
+                stripes = split_range(saved.offset.min(size), size, channels.len(), options.write_chunk);
+                resumed = saved.offset > 0;
+            }
+        }
+        state.offset = stripes.first().map_or(size, |stripe| stripe[0]);
+        state.stripes = stripes.clone();
+        state.save_remote(sftp, &sidecar).await?;
+        checkpoint = Some(Checkpoint::remote(sftp, &sidecar, state));
+    }
+
+    let flags = if resumed { OpenFlags::WRITE } else { OpenFlags::CREATE | OpenFlags::TRUNCATE | OpenFlags::WRITE };
+    let handle = match sftp.open(target, flags, FileAttributes::empty()).await {
+        Ok(handle) => handle.handle,
+        Err(e) => return Err(anyhow!("Failed to create remote file {}: {}", target, e)),
+    };
+    let _ = sftp.fsetstat(handle.as_str(), FileAttributes { size: Some(size), ..FileAttributes::empty() }).await;
+
+    let left: u64 = stripes.iter().map(|stripe| stripe[1] - stripe[0]).sum();
+    control.meter.skip(size - left);
+    control.meter.begin(Some(size));
+    let results = futures::future::join_all(stripes.iter().enumerate().map(|(index, &stripe)| {
+        let checkpoint = checkpoint.as_ref().map(|checkpoint| (checkpoint, Some(index)));
+        upload_stripe(channels[index % channels.len()], local, target, stripe, options, control.fork(), checkpoint)
+    }))
+    .await;
+    let result = results.into_iter().collect::<Result<Vec<()>>>();
+    close_upload(sftp, handle, target, &metadata, result.is_ok() && file_options.preserve).await?;
+    result?;
+    if file_options.resume {
+        finish_upload(sftp, &part, remote, &sidecar).await?;
+    }
+
+    let mut hasher = file_options.checksum.then(Sha256::new);
+    if let Some(hasher) = hasher.as_mut() {
+        let mut file = File::open(local).await?;
+        hash_prefix(&mut file, size, hasher).await?;
+    }
+    control.meter.file_done();
+    Ok(Copied { sha256: hasher.map(|hasher| format!("{:x}", hasher.finalize())) })
+}
+
+async fn upload_stripe(
+    sftp: &RawSftpSession,
+    local: &str,
+    remote: &str,
+    stripe: [u64; 2],
+    options: &TransferOptions,
+    mut control: Control<'_>,
+    checkpoint: Option<(&Checkpoint<'_>, Option<usize>)>,
+) -> Result<()> {
+    if stripe[0] >= stripe[1] {
+        return Ok(());
+    }
+    control.ready().await?;
+    let handle = sftp.open(remote, OpenFlags::WRITE, FileAttributes::empty()).await?.handle;
+    let result = async {
+        let mut file = File::open(local).await?;
+        file.seek(std::io::SeekFrom::Start(stripe[0])).await?;
+        send_range(sftp, &handle, &mut file, stripe[0], Some(stripe[1]), options, &mut control, None, checkpoint).await
+    }
+    .await;
+    let closed = sftp.close(handle).await;
+    result?;
+    closed.map(|_| ()).map_err(|e| anyhow!("Error closing remote file {}: {}", remote, e))
+}
+
+async fn write_at(sftp: &RawSftpSession, handle: &str, offset: u64, data: Vec<u8>) -> (u64, u64, Duration, Result<Status, SftpError>) {
+    let len = data.len() as u64;
+    let started = Instant::now();
+    let result = sftp.write(handle, offset, data).await;
+    (offset, len, started.elapsed(), result)
+}
+
+// Заполняет буфер целиком, если файл не кончился: короткие запросы WRITE зря тратят окно
+async fn read_full<R: AsyncRead + Unpin>(reader: &mut R, buffer: &mut [u8]) -> std::io::Result<usize> {
+    let mut filled = 0;
+    while filled < buffer.len() {
+        let n = reader.read(&mut buffer[filled..]).await?;
+        if n == 0 {
+            break;
+        }
+        filled += n;
+    }
+    Ok(filled)
+}
+
+pub fn local_attributes(metadata: &std::fs::Metadata) -> FileAttributes {
+    let mtime = metadata.modified().ok()
+        .and_then(|time| time.duration_since(UNIX_EPOCH).ok())
+        .map(|since| since.as_secs() as u32);
+    FileAttributes {
+        permissions: Some(metadata.permissions().mode() & 0o7777),
+        atime: mtime,
+        mtime,
+        ..FileAttributes::empty()
+    }
+}
+
+// Создаёт каталог на сервере вместе с недостающими родителями
+pub async fn create_remote_dir_all(sftp: &RawSftpSession, path: &str) -> Result<()> {
+    let mut missing = Vec::new();
+    let mut current = Path::new(path);
+    while sftp.stat(current.to_string_lossy()).await.is_err() {
+        missing.push(current.to_string_lossy().into_owned());
+        match current.parent() {
+            Some(parent) if !parent.as_os_str().is_empty() => current = parent,
+            _ => break,
+        }
+    }
+    for dir in missing.into_iter().rev() {
+        if let Err(e) = sftp.mkdir(dir.as_str(), FileAttributes::empty()).await {
+            // Каталог мог появиться параллельно — тогда это не ошибка
+            if sftp.stat(dir.as_str()).await.map_or(true, |attrs| !attrs.attrs.is_dir()) {
+                return Err(anyhow!("Failed to create remote directory {}: {}", dir, e));
+            }
+        }
+    }
+    Ok(())
+}
+
+#[derive(Clone, Copy)]
+pub enum Direction {
+    Upload,
+    Download,
+}
+
+enum TreeItem {
+    File { from: String, to: String },
+    Symlink { target: String, to: String },
+}
+
+// Общее состояние передачи каталога: обход кладёт работу в очередь, рабочие её разбирают
+struct Tree<'a> {
+    sftp: &'a RawSftpSession,
+    direction: Direction,
+    options: &'a TransferOptions,
+    queue: tokio::sync::Mutex<mpsc::Receiver<TreeItem>>,
+    failures: Mutex<Vec<String>>,
+    // Права каталогов выставляются в самом конце, иначе read-only каталог не дал бы писать в себя
+    dir_modes: Mutex<Vec<(String, u32)>>,
+}
+
+impl Tree<'_> {
+    fn fail(&self, path: &str, error: impl std::fmt::Display) {
+        self.failures.lock().unwrap().push(format!("{}: {}", path, error));
+    }
+}
+
+// Рекурсивная передача каталога. Обход идёт по уровням и кладёт файлы в очередь сразу,
+// не дожидаясь конца; подкаталоги уровня создаются одной пачкой запросов; файлы копирует
+// пул рабочих, у каждого свой слот в очереди передач сессии
+pub async fn transfer_tree(
+    sftp: &RawSftpSession,
+    direction: Direction,
+    from: &str,
+    to: &str,
+    options: &TransferOptions,
+    workers: usize,
+    control: &mut Control<'_>,
+) -> Result<()> {
+    let (tx, rx) = mpsc::channel(TREE_QUEUE);
+    let tree = Tree {
+        sftp,
+        direction,
+        options,
+        queue: tokio::sync::Mutex::new(rx),
+        failures: Mutex::default(),
+        dir_modes: Mutex::default(),
+    };
+
+    let mut walker = control.fork();
+    let walk = async {
+        let result = match direction {
+            Direction::Upload => walk_local(&tree, from, to, &tx, &mut walker).await,
+            Direction::Download => walk_remote(&tree, from, to, &tx, &mut walker).await,
+        };
+        drop(tx);
+        result
+    };
+    let pool = futures::future::join_all((0..workers).map(|_| tree_worker(&tree, control.fork())));
+    let (walked, _) = tokio::join!(walk, pool);
+    walked?;
+    if control.is_cancelled() {
+        return Err(anyhow!("Cancelled"));
+    }
+
+    let dir_modes = std::mem::take(&mut *tree.dir_modes.lock().unwrap());
+    apply_dir_modes(&tree, dir_modes).await;
+    control.meter.finish();
+
+    let failures = tree.failures.into_inner().unwrap();
+    match failures.first() {
+        None => Ok(()),
+        Some(first) => Err(anyhow!("{} items failed, first: {}", failures.len(), first)),
+    }
+}
+
+async fn tree_worker(tree: &Tree<'_>, mut control: Control<'_>) {
+    loop {
+        let item = {
+            let mut queue = tree.queue.lock().await;
+            tokio::select! {
+                item = queue.recv() => item,
+                _ = control.cancelled() => return,
+            }
+        };
+        let Some(item) = item else {
+            return;
+        };
+        match item {
+            TreeItem::File { from, to } => {
+                let file_options = FileOptions { preserve: true, ..FileOptions::default() };
+                let copied = match tree.direction {
+                    Direction::Upload => upload(tree.sftp, &from, &to, tree.options, &mut control, file_options).await,
+                    Direction::Download => download(tree.sftp, &from, &to, tree.options, &mut control, file_options).await,
+                };
+                if let Err(e) = copied {
+                    if control.is_cancelled() {
+                        return;
+                    }
+                    tree.fail(&from, e);
+                }
+            }
+            TreeItem::Symlink { target, to } => {
+                if let Err(e) = create_symlink(tree, &target, &to).await {
+                    tree.fail(&to, e);
+                }
+            }
+        }
+    }
+}
+
+async fn create_symlink(tree: &Tree<'_>, target: &str, link: &str) -> Result<()> {
+    match tree.direction {
+        Direction::Upload => {
+            let (first, second) = if tree.options.symlink_swapped { (target, link) } else { (link, target) };
+            let status = tree.sftp.symlink(first, second).await?;
+            if status.status_code != StatusCode::Ok {
+                return Err(anyhow!(status.error_message));
+            }
+        }
+        Direction::Download => {
+            let _ = tokio::fs::remove_file(link).await;
+            tokio::fs::symlink(target, link).await?;
+        }
+    }
+    Ok(())
+}
+
+async fn send_item(tx: &mpsc::Sender<TreeItem>, item: TreeItem, control: &mut Control<'_>) -> bool {
+    tokio::select! {
+        sent = tx.send(item) => sent.is_ok(),
+        _ = control.cancelled() => false,
+    }
+}
+
+async fn walk_local(
+    tree: &Tree<'_>,
+    local_root: &str,
+    remote_root: &str,
+    tx: &mpsc::Sender<TreeItem>,
+    control: &mut Control<'_>,
+) -> Result<()> {
+    let root_mode = tokio::fs::metadata(local_root).await?.permissions().mode() & 0o7777;
+    create_remote_dir_all(tree.sftp, remote_root).await?;
+    tree.dir_modes.lock().unwrap().push((remote_root.to_string(), root_mode));
+
+    let mut level = vec![(local_root.to_string(), remote_root.to_string())];
+    while !level.is_empty() {
+        let mut subdirs = Vec::new();
+        for (local_dir, remote_dir) in level {
+            let mut entries = match tokio::fs::read_dir(&local_dir).await {
+                Ok(entries) => entries,
+                Err(e) => {
+                    tree.fail(&local_dir, e);
+                    continue;
+                }
+            };
+            loop {
+                let entry = match entries.next_entry().await {
+                    Ok(Some(entry)) => entry,
+                    Ok(None) => break,
+                    Err(e) => {
+                        tree.fail(&local_dir, e);
+                        break;
+                    }
+                };
+                let from = entry.path().to_string_lossy().into_owned();
+                let to = format!("{}/{}", remote_dir.trim_end_matches('/'), entry.file_name().to_string_lossy());
+                let metadata = match tokio::fs::symlink_metadata(&from).await {
+                    Ok(metadata) => metadata,
+                    Err(e) => {
+                        tree.fail(&from, e);
+                        continue;
+                    }
+                };
+                let item = if metadata.is_dir() {
+                    subdirs.push((from, to, metadata.permissions().mode() & 0o7777));
+                    continue;
+                } else if metadata.file_type().is_symlink() {
+                    match tokio::fs::read_link(&from).await {
+                        Ok(target) => TreeItem::Symlink { target: target.to_string_lossy().into_owned(), to },
+                        Err(e) => {
+                            tree.fail(&from, e);
+                            continue;
+                        }
+                    }
+                } else if metadata.is_file() {
+                    control.meter.expect(metadata.len());
+                    TreeItem::File { from, to }
+                } else {
+                    // Сокеты, FIFO и устройства по SFTP не передать
+                    continue;
+                };
+                if !send_item(tx, item, control).await {
+                    return Ok(());
+                }
+            }
+        }
+        level = make_remote_dirs(tree, subdirs).await;
+    }
+    Ok(())
+}
+
+// Пачка MKDIR одного уровня обхода уходит разом; возвращает каталоги, в которые можно идти дальше
+async fn make_remote_dirs(tree: &Tree<'_>, dirs: Vec<(String, String, u32)>) -> Vec<(String, String)> {
+    let mut created = FuturesUnordered::new();
+    for (from, to, mode) in dirs {
+        created.push(async move {
+            let result = match tree.sftp.mkdir(to.as_str(), FileAttributes::empty()).await {
+                Ok(_) => Ok(()),
+                Err(e) => match tree.sftp.stat(to.as_str()).await {
+                    Ok(attrs) if attrs.attrs.is_dir() => Ok(()),
+                    _ => Err(e),
+                },
+            };
+            (from, to, mode, result)
+        });
+    }
+    let mut next = Vec::new();
+    while let Some((from, to, mode, result)) = created.next().await {
+        match result {
+            Ok(()) => {
+                tree.dir_modes.lock().unwrap().push((to.clone(), mode));
+                next.push((from, to));
+            }
+            Err(e) => tree.fail(&to, e),
+        }
+    }
+    next
+}
+
+// Одна компонента пути: без разделителей и без "." / ".."
+fn is_safe_name(name: &str) -> bool {
+    !name.is_empty() && name != "." && name != ".." && !name.contains(['/', '\\', '\0'])
+}
+
+async fn walk_remote(
+    tree: &Tree<'_>,
+    remote_root: &str,
+    local_root: &str,
+    tx: &mpsc::Sender<TreeItem>,
+    control: &mut Control<'_>,
+) -> Result<()> {
+    let root = tree.sftp.stat(remote_root).await?.attrs;
+    tokio::fs::create_dir_all(local_root).await?;
+    if let Some(mode) = root.permissions {
+        tree.dir_modes.lock().unwrap().push((local_root.to_string(), mode & 0o7777));
+    }
+
+    let mut level = vec![(remote_root.to_string(), local_root.to_string())];
+    while !level.is_empty() {
+        let mut next = Vec::new();
+        for (remote_dir, local_dir) in level {
+            let files = match read_remote_dir(tree.sftp, &remote_dir).await {
+                Ok(files) => files,
+                Err(e) => {
+                    tree.fail(&remote_dir, e);
+                    continue;
+                }
+            };
+            for file in files {
+                let from = format!("{}/{}", remote_dir.trim_end_matches('/'), file.filename);
+                // Имя приходит от сервера и становится частью локального пути: касается и ссылок
+                if !is_safe_name(&file.filename) {
+                    tree.fail(&from, "Unsafe file name in server listing, skipped");
+                    continue;
+                }
+                let to = Path::new(&local_dir).join(&file.filename).to_string_lossy().into_owned();
+                let item = if file.attrs.is_dir() {
+                    // Каталог не должен оказаться уже созданной ссылкой: create_dir_all пошёл бы по ней
+                    if tokio::fs::symlink_metadata(&to).await.is_ok_and(|metadata| metadata.is_symlink()) {
+                        tree.fail(&to, "Directory name is already a symbolic link, skipped");
+                        continue;
+                    }
+                    // Локальные каталоги дёшевы, их создаём сразу
+                    if let Err(e) = tokio::fs::create_dir_all(&to).await {
+                        tree.fail(&to, e);
+                        continue;
+                    }
+                    if let Some(mode) = file.attrs.permissions {
+                        tree.dir_modes.lock().unwrap().push((to.clone(), mode & 0o7777));
+                    }
+                    next.push((from, to));
+                    continue;
+                } else if file.attrs.is_symlink() {
+                    // Ссылка с именем рабочего файла загрузки (<файл>.part, .part.json) увела бы
+                    // запись соседнего файла за пределы каталога
+                    if file.filename.ends_with(".part") || file.filename.ends_with(".part.json") {
+                        tree.fail(&from, "Symbolic link named like a partial download, skipped");
+                        continue;
+                    }
+                    match tree.sftp.readlink(from.as_str()).await {
+                        Ok(name) if !name.files.is_empty() => {
+                            TreeItem::Symlink { target: name.files[0].filename.clone(), to }
+                        }
+                        Ok(_) => continue,
+                        Err(e) => {
+                            tree.fail(&from, e);
+                            continue;
+                        }
+                    }
+                } else if file.attrs.is_regular() {
+                    control.meter.expect(file.attrs.size.unwrap_or(0));
+                    TreeItem::File { from, to }
+                } else {
+                    continue;
+                };
+                if !send_item(tx, item, control).await {
+                    return Ok(());
+                }
+            }
+        }
+        level = next;
+    }
+    Ok(())
+}
+
+pub async fn read_remote_dir(sftp: &RawSftpSession, path: &str) -> Result<Vec<russh_sftp::protocol::File>> {
+    let handle = sftp.opendir(path).await?.handle;
+    let mut files = Vec::new();
+    let result = loop {
+        match sftp.readdir(handle.as_str()).await {
+            Ok(name) => files.extend(name.files.into_iter().filter(|file| file.filename != "." && file.filename != "..")),
+            Err(SftpError::Status(status)) if status.status_code == StatusCode::Eof => break Ok(files),
+            Err(e) => break Err(anyhow!(e)),
+        }
+    };
+    let _ = sftp.close(handle).await;
+    result
+}
+
+async fn apply_dir_modes(tree: &Tree<'_>, dir_modes: Vec<(String, u32)>) {
+    match tree.direction {
+        Direction::Upload => {
+            let mut pending = FuturesUnordered::new();
+            for (path, mode) in dir_modes {
+                pending.push(async move {
+                    let attrs = FileAttributes { permissions: Some(mode), ..FileAttributes::empty() };
+                    (tree.sftp.setstat(path.as_str(), attrs).await, path)
+                });
+            }
+            while let Some((result, path)) = pending.next().await {
+                if let Err(e) = result {
+                    tree.fail(&path, e);
+                }
+            }
+        }
+        Direction::Download => {
+            // Вложенные каталоги раньше родителей: закрытый на запись родитель не помешает
+            for (path, mode) in dir_modes.into_iter().rev() {
+                if let Err(e) = tokio::fs::set_permissions(&path, std::fs::Permissions::from_mode(mode)).await {
+                    tree.fail(&path, e);
+                }
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    // Полосы идут подряд без дыр и перекрытий и начинаются на границе блока
+    fn check_stripes(start: u64, end: u64, count: usize, chunk: u32) -> Vec<[u64; 2]> {
+        let stripes = split_range(start, end, count, chunk);
+        assert_eq!(stripes.len(), count);
+        assert_eq!(stripes[0][0], start);
+        assert_eq!(stripes[count - 1][1], end);
+        for pair in stripes.windows(2) {
+            assert_eq!(pair[0][1], pair[1][0]);
+        }
+        for [from, to] in &stripes {
+            assert!(from <= to);
+            assert!(*from == end || (from - start) % chunk as u64 == 0);
+        }
+        stripes
+    }
+
+    #[test]
+    fn split_range_even() {
+        assert_eq!(check_stripes(0, 400, 4, 100), vec![[0, 100], [100, 200], [200, 300], [300, 400]]);
+    }
+
+    #[test]
+    fn split_range_uneven_tail() {
+        assert_eq!(check_stripes(0, 1050, 2, 100), vec![[0, 600], [600, 1050]]);
+        assert_eq!(check_stripes(1000, 1250, 3, 100), vec![[1000, 1100], [1100, 1200], [1200, 1250]]);
+    }
+
+    #[test]
+    fn split_range_more_stripes_than_chunks() {
+        // Лишние полосы получаются пустыми, а не перекрываются
+        assert_eq!(check_stripes(0, 150, 4, 100), vec![[0, 100], [100, 150], [150, 150], [150, 150]]);
+        check_stripes(5, 5, 3, 100);
+    }
+
+    #[test]
+    fn split_range_large_file() {
+        check_stripes(123 * 1024, 10 * 1024 * 1024 * 1024 + 17, 8, 255 * 1024);
+    }
+
+    fn ignore(_: Progress) {}
+
+    // Передача в очереди сессии: свои флаги отмены и паузы, общая полоса
+    struct Queued {
+        cancel: watch::Sender<bool>,
+        pause: watch::Sender<bool>,
+    }
+
+    fn queued<'a>(lane: &Arc<Semaphore>, meter: &'a Meter<'a>) -> (Queued, Control<'a>) {
+        let (cancel, cancelled) = watch::channel(false);
+        let (pause, paused) = watch::channel(false);
+        (Queued { cancel, pause }, Control::new(lane.clone(), cancelled, paused, meter))
+    }
+
+    async fn waits(control: &mut Control<'_>) -> bool {
+        tokio::time::timeout(Duration::from_millis(50), control.ready()).await.is_err()
+    }
+
+    #[tokio::test]
+    async fn lane_limits_concurrent_transfers() {
+        let meter = Meter::file(&ignore);
+        let lane = Arc::new(Semaphore::new(2));
+        let (_a, mut a) = queued(&lane, &meter);
+        let (_b, mut b) = queued(&lane, &meter);
+        let (_c, mut c) = queued(&lane, &meter);
+        a.ready().await.unwrap();
+        b.ready().await.unwrap();
+        assert!(waits(&mut c).await);
+        drop(a);
+        c.ready().await.unwrap();
+        // Слот уже свой: повторный ready не ждёт
+        c.ready().await.unwrap();
+    }
+
+    #[tokio::test]
+    async fn pause_gives_the_slot_away() {
+        let meter = Meter::file(&ignore);
+        let lane = Arc::new(Semaphore::new(1));
+        let (a_flags, mut a) = queued(&lane, &meter);
+        let (_b, mut b) = queued(&lane, &meter);
+        a.ready().await.unwrap();
+        assert!(waits(&mut b).await);
+
+        a_flags.pause.send_replace(true);
+        assert!(waits(&mut a).await);
+        b.ready().await.unwrap();
+
+        // Снятая с паузы передача встаёт в очередь за той, что заняла слот
+        a_flags.pause.send_replace(false);
+        assert!(waits(&mut a).await);
+        drop(b);
+        a.ready().await.unwrap();
+    }
+
+    #[tokio::test]
+    async fn cancel_stops_waiting_and_paused_transfers() {
+        let meter = Meter::file(&ignore);
+        let lane = Arc::new(Semaphore::new(1));
+        let (_a, mut a) = queued(&lane, &meter);
+        let (b_flags, mut b) = queued(&lane, &meter);
+        let (c_flags, mut c) = queued(&lane, &meter);
+        a.ready().await.unwrap();
+
+        let cancel_later = |flags: &Queued| {
+            let cancel = flags.cancel.clone();
+            async move {
+                tokio::time::sleep(Duration::from_millis(20)).await;
+                cancel.send_replace(true);
+            }
+        };
+        let (waiting, _) = tokio::join!(b.ready(), cancel_later(&b_flags));
+        assert_eq!(waiting.unwrap_err().to_string(), "Cancelled");
+
+        c_flags.pause.send_replace(true);
+        let (paused, _) = tokio::join!(c.ready(), cancel_later(&c_flags));
+        assert_eq!(paused.unwrap_err().to_string(), "Cancelled");
+    }
+
+    #[tokio::test]
+    async fn cancellable_waits_for_the_transfer_to_stop() {
+        let cancel = Notify::new();
+        let (stop, mut stopped) = watch::channel(false);
+        cancel.notify_one();
+        // Передача сама видит сигнал, закрывает дескрипторы и возвращает свою ошибку
+        let result = cancellable(&cancel, stop, async {
+            stopped.wait_for(|stop| *stop).await.unwrap();
+            "closed"
+        })
+        .await;
+        assert_eq!(result, "closed");
+    }
+
+    #[test]
+    fn unsafe_remote_names_are_rejected() {
+        for name in ["file.txt", ".hidden", "..double", "имя с пробелом", "a..b"] {
+            assert!(is_safe_name(name), "{:?}", name);
+        }
+        for name in ["", ".", "..", "../etc", "a/b", "/abs", "a\\..\\b", "nul\0byte"] {
+            assert!(!is_safe_name(name), "{:?}", name);
+        }
+    }
+
+    fn temp_path(name: &str) -> String {
+        let dir = std::env::temp_dir().join(format!("ssh-backend-transfer-{}", std::process::id()));
+        std::fs::create_dir_all(&dir).unwrap();
+        dir.join(name).to_string_lossy().into_owned()
+    }
+
+    fn remote_file(size: u64, mtime: u32) -> PartState {
+        PartState { source: "/srv/data.bin".into(), size, mtime, offset: 0, stripes: Vec::new() }
+    }
+
+    #[tokio::test]
+    async fn part_state_round_trip() {
+        let (_, sidecar) = PartState::paths(&temp_path("round_trip"));
+        let state = PartState { offset: 4096, stripes: vec![[4096, 8192], [12288, 16384]], ..remote_file(16384, 7) };
+        state.save(&sidecar).await.unwrap();
+        let loaded = PartState::load(&sidecar).await.unwrap();
+        assert!(loaded.same_file(&state));
+        assert_eq!((loaded.offset, loaded.stripes), (4096, state.stripes));
+        assert!(!Path::new(&format!("{}.tmp", sidecar)).exists());
+
+        std::fs::write(&sidecar, b"{\"source\": \"/srv/da").unwrap();
+        assert!(PartState::load(&sidecar).await.is_none());
+        // Состояние старого формата: источник в поле remote, полос нет
+        std::fs::write(&sidecar, br#"{"remote": "/srv/data.bin", "size": 10, "mtime": 7, "offset": 5}"#).unwrap();
+        let old = PartState::load(&sidecar).await.unwrap();
+        assert!(old.same_file(&remote_file(10, 7)));
+        assert!(old.stripes.is_empty());
+        let _ = std::fs::remove_file(&sidecar);
+    }
+
+    #[tokio::test]
+    async fn resume_only_from_the_same_source() {
+        let (part, sidecar) = PartState::paths(&temp_path("resume"));
+        let current = remote_file(1000, 7);
+        assert_eq!(current.resume_local(&part, &sidecar).await, 0);
+
+        std::fs::write(&part, vec![0u8; 600]).unwrap();
+        PartState { offset: 500, ..current.clone() }.save(&sidecar).await.unwrap();
+        assert_eq!(current.resume_local(&part, &sidecar).await, 500);
+        // Файл на сервере изменился: другой размер, время или путь — всё заново
+        assert_eq!(remote_file(1001, 7).resume_local(&part, &sidecar).await, 0);
+        assert_eq!(remote_file(1000, 8).resume_local(&part, &sidecar).await, 0);
+        let moved = PartState { source: "/srv/other.bin".into(), ..current.clone() };
+        assert_eq!(moved.resume_local(&part, &sidecar).await, 0);
+
+        // На диске меньше, чем записано в состоянии: продолжаем с того, что есть
+        std::fs::write(&part, vec![0u8; 300]).unwrap();
+        assert_eq!(current.resume_local(&part, &sidecar).await, 300);
+        std::fs::remove_file(&part).unwrap();
+        assert_eq!(current.resume_local(&part, &sidecar).await, 0);
+        let _ = std::fs::remove_file(&sidecar);
+    }
+
+    #[tokio::test]
+    async fn striped_checkpoint_keeps_the_contiguous_prefix() {
+        let (_, sidecar) = PartState::paths(&temp_path("stripes"));
+        let state = PartState { stripes: vec![[0, 100], [100, 200], [200, 300]], ..remote_file(300, 7) };
+        let checkpoint = Checkpoint::new(&sidecar, state);
+        checkpoint.save(Some(1), 150).await.unwrap();
+        checkpoint.save(Some(0), 40).await.unwrap();
+        let saved = PartState::load(&sidecar).await.unwrap();
+        assert_eq!(saved.stripes, vec![[40, 100], [150, 200], [200, 300]]);
+        assert_eq!(saved.offset, 40);
+        let _ = std::fs::remove_file(&sidecar);
+    }
+
+    #[test]
+    fn local_source_uses_size_and_mtime() {
+        let path = temp_path("local_source");
+        std::fs::write(&path, b"12345").unwrap();
+        let file = std::fs::File::options().write(true).open(&path).unwrap();
+        file.set_modified(UNIX_EPOCH + Duration::from_secs(1_700_000_000)).unwrap();
+        let state = PartState::of_local(&path, &file.metadata().unwrap());
+        assert_eq!((state.source.as_str(), state.size, state.mtime), (path.as_str(), 5, 1_700_000_000));
+        let _ = std::fs::remove_file(&path);
+    }
+}
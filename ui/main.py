@@ -1,22 +1,152 @@
 import sys
 import json
 import os
+import re
+import codecs
+import struct
+import time
+import itertools
+import bisect
+import mmap
+import posixpath
+from collections import OrderedDict, deque
+import stat as stat_module
+from array import array
 from pathlib import Path
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QTabWidget, QVBoxLayout, QHBoxLayout,
-                             QFileSystemModel, QTreeView, QActionGroup, QSplitter, QTextEdit, QTabBar, QPushButton,
+                             QTreeView, QActionGroup, QSplitter, QTextEdit, QPlainTextEdit, QPushButton,
                              QDialog, QLabel, QLineEdit, QDialogButtonBox, QFormLayout, QMessageBox,
-                             QMenu, QAction, QSpinBox, QComboBox, QTreeWidget, QTreeWidgetItem, QHeaderView,
-                             QFileIconProvider, QStyle, QFileDialog)
-from PyQt5.QtCore import QDir, Qt, QProcess, QTextStream, QIODevice, QTimer, QSettings, QFileInfo, QMimeData, QUrl
-from PyQt5.QtGui import QTextCursor, QTextCharFormat, QColor, QIcon, QFont, QPalette, QKeyEvent, QDragEnterEvent, QDropEvent, QDragMoveEvent
+                             QMenu, QAction, QSpinBox, QComboBox, QHeaderView,
+                             QFileIconProvider, QStyle, QFileDialog, QTreeWidget, QTreeWidgetItem, QCheckBox)
+from PyQt5.QtCore import (QDir, Qt, QProcess, QTimer, QSettings, QFileInfo, QMimeData, QUrl,
+                          QAbstractItemModel, QModelIndex, QThread, QFileSystemWatcher, QObject, pyqtSignal)
+from PyQt5.QtGui import (QTextCursor, QTextCharFormat, QColor, QIcon, QFont, QFontMetrics, QPalette, QKeyEvent,
+                         QDragEnterEvent, QDropEvent, QDragMoveEvent)
 
-class TerminalWidget(QTextEdit):
+# replay — запрос прервался разрывом связи и выполняется заново после переподключения
+PARTIAL_STATUSES = {"chunk", "exit_status", "files_page", "progress", "replay", "host_started", "host_result"}
+OUTPUT_FLUSH_INTERVAL_MS = 16  # не чаще одного обновления документа за кадр
+OUTPUT_LINES_PER_FLUSH = 2000  # остаток переносится на следующий кадр
+SHELL_TERM = "xterm"
+SHELL_RESIZE_DELAY_MS = 150
+# CSI-последовательность, прочие escape-последовательности, одиночный управляющий символ
+SHELL_TOKEN = re.compile(r"\x1b\[([0-9;?]*)([@-~])|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[()][0-9A-Za-z]|\x1b[=>78DEHMc]"
+                         r"|[\x00-\x08\x0a-\x1a\x1c-\x1f\x7f]")
+SHELL_KEYS = {
+    Qt.Key_Return: "\r", Qt.Key_Enter: "\r", Qt.Key_Backspace: "\x7f", Qt.Key_Tab: "\t", Qt.Key_Escape: "\x1b",
+    Qt.Key_Up: "\x1b[A", Qt.Key_Down: "\x1b[B", Qt.Key_Right: "\x1b[C", Qt.Key_Left: "\x1b[D",
+    Qt.Key_Home: "\x1b[H", Qt.Key_End: "\x1b[F", Qt.Key_Delete: "\x1b[3~",
+    Qt.Key_PageUp: "\x1b[5~", Qt.Key_PageDown: "\x1b[6~",
+}
+
+
+class ScrollbackSpill:
+    # Журнал вытесненных из терминала строк: лежит на диске, ищется через mmap
+    def __init__(self):
+        # Журнал включают редко, а tempfile тянет за собой random и shutil — не грузим их на старте
+        import tempfile
+        self.file = tempfile.NamedTemporaryFile(prefix="ssh-gui-scrollback-", suffix=".log")
+        self.size = 0
+
+    def write(self, text):
+        data = text.encode(errors="replace")
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+
+    def search(self, pattern, limit=200):
+        if not self.size:
+            return []
+        regex = re.compile(re.escape(pattern.encode(errors="replace")))
+        matches = []
+        with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as log:
+            for match in regex.finditer(log):
+                start = log.rfind(b"\n", 0, match.start()) + 1
+                end = log.find(b"\n", match.end())
+                line = log[start:end if end != -1 else len(log)].decode(errors="replace")
+                if not matches or matches[-1] != line:
+                    matches.append(line)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def close(self):
+        self.file.close()
+
+
+class ShellLine:
+    # Текущая строка удалённого shell. Разбирает то, чем readline правит строку ввода:
+    # \r, \b и CSI K/C/D/G/P/@; цвета и остальные последовательности отбрасываются.
+    # Полноэкранные программы так не нарисовать, для них нужен настоящий эмулятор терминала
+    def __init__(self):
+        self.line = ""
+        self.col = 0
+        self.tail = ""  # escape-последовательность, разрезанная границей кадра
+
+    def feed(self, data):
+        # Возвращает законченные строки, незаконченная остаётся в self.line
+        data = self.tail + data
+        self.tail = ""
+        lines = []
+        pos = 0
+        for match in SHELL_TOKEN.finditer(data):
+            self._write(data[pos:match.start()])
+            pos = match.end()
+            token = match.group(0)
+            if token == "\n":
+                lines.append(self.line)
+                self.line = ""
+                self.col = 0
+            elif token == "\r":
+                self.col = 0
+            elif token == "\b":
+                self.col = max(0, self.col - 1)
+            elif match.group(2):
+                self._csi(match.group(1), match.group(2))
+        rest = data[pos:]
+        cut = rest.find("\x1b")
+        if cut != -1 and len(rest) - cut < 64:
+            rest, self.tail = rest[:cut], rest[cut:]
+        self._write(rest)
+        return lines
+
+    def _write(self, text):
+        text = text.replace("\x1b", "")
+        if not text:
+            return
+        line = self.line.ljust(self.col)
+        self.line = line[:self.col] + text + line[self.col + len(text):]
+        self.col += len(text)
+
+    def _csi(self, params, command):
+        count = int(params) if params.isdigit() else 0
+        if command == "K":
+            if count == 0:
+                self.line = self.line[:self.col]
+            elif count == 1:
+                self.line = " " * self.col + self.line[self.col:]
+            else:
+                self.line = ""
+        elif command == "C":
+            self.col += max(count, 1)
+        elif command == "D":
+            self.col = max(0, self.col - max(count, 1))
+        elif command == "G":
+            self.col = max(count, 1) - 1
+        elif command == "P":
+            self.line = self.line[:self.col] + self.line[self.col + max(count, 1):]
+        elif command == "@":
+            self.line = self.line[:self.col] + " " * max(count, 1) + self.line[self.col:]
+
+
+class TerminalWidget(QPlainTextEdit):
     def __init__(self, parent=None, browser_tab=None):
         super().__init__(parent)
         self.browser_tab = browser_tab
         self.setReadOnly(False)
-        self.setAcceptRichText(False)
-        self.setLineWrapMode(QTextEdit.NoWrap)
+        self.setLineWrapMode(QPlainTextEdit.NoWrap)
+        # История правок растёт вместе с выводом, для терминала она не нужна
+        self.setUndoRedoEnabled(False)
         
         font = QFont("Monospace")
         font.setStyleHint(QFont.TypeWriter)
@@ -30,7 +160,28 @@ class TerminalWidget(QTextEdit):
         self.history = []
         self.history_index = -1
         self.current_prompt = ""
-        self.pending_output = ""
+        self.pending_output = []
+        self.running_request = None  # id потоковой команды, которую можно прервать Ctrl-C
+        # Интерактивный shell с PTY; пока его нет, команды выполняются по одной через Exec
+        self.shell = None
+        self.shell_request = None
+        self.shell_size = None
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(SHELL_RESIZE_DELAY_MS)
+        self.resize_timer.timeout.connect(self.send_shell_size)
+        
+        connection_data = browser_tab.connection_data if browser_tab else {}
+        self.scrollback_lines = connection_data.get("scrollback_lines", 10000)
+        self.scrollback_chars = connection_data.get("scrollback_chars", 0)
+        self.spill = ScrollbackSpill() if connection_data.get("scrollback_spill") else None
+        
+        # Вывод копится в pending_output и попадает в документ одной правкой за кадр
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(OUTPUT_FLUSH_INTERVAL_MS)
+        self.flush_timer.timeout.connect(self._process_output)
+        self.output_stats = {"chunks": 0, "flushes": 0, "chars": 0, "dropped_chars": 0, "max_flush_ms": 0.0}
         
         self.init_prompt()
 
@@ -48,8 +199,98 @@ class TerminalWidget(QTextEdit):
         self.insertPlainText(self.get_prompt())
         self.moveCursor(QTextCursor.End)
 
+    def start_shell(self):
+        if self.shell_request is not None or not self.browser_tab.connection_data.get("shell", True):
+            return
+        cols, rows = self.shell_size = self.terminal_size()
+        self.shell_request = self.browser_tab.send_command(
+            {"cmd": "Shell", "term": SHELL_TERM, "cols": cols, "rows": rows}, callback=self.on_shell_frame)
+        if self.shell_request is not None:
+            self.shell = ShellLine()
+
+    def stop_shell(self, cancel=False):
+        # cancel — shell закрывает вкладка, а не сервер: команда на бэкенде ещё идёт.
+        # Ответ на Cancel не нужен, shell мог закончиться и сам
+        if cancel and self.shell_request is not None:
+            self.browser_tab.send_command({"cmd": "Cancel", "target": self.shell_request},
+                                          callback=lambda response: None)
+        self.shell = None
+        self.shell_request = None
+
+    def on_shell_frame(self, response):
+        status = response.get("status")
+        if status == "chunk":
+            # Законченные строки дописываются, текущая перерисовывается при выводе
+            lines = self.shell.feed(response.get("data", ""))
+            self.append_stream("".join(line + "\n" for line in lines))
+        elif status == "exit_status":
+            self._queue_output("stream", "")
+        elif status in ("end", "error"):
+            self.stop_shell()
+            if status == "error":
+                self.append_output("Error: shell: " + response.get("message", "Unknown error"))
+            else:
+                self.append_output("[shell closed]")
+
+    def send_to_shell(self, data):
+        self.browser_tab.backend.notify(
+            self.browser_tab, {"cmd": "ShellInput", "target": self.shell_request, "data": data})
+
+    def terminal_size(self):
+        metrics = QFontMetrics(self.font())
+        viewport = self.viewport()
+        return (max(20, viewport.width() // max(1, metrics.horizontalAdvance("M"))),
+                max(5, viewport.height() // max(1, metrics.lineSpacing())))
+
+    def send_shell_size(self):
+        size = self.terminal_size()
+        if self.shell is None or size == self.shell_size:
+            return
+        self.shell_size = size
+        cols, rows = size
+        self.browser_tab.backend.notify(
+            self.browser_tab, {"cmd": "ShellResize", "target": self.shell_request, "cols": cols, "rows": rows})
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.shell is not None:
+            self.resize_timer.start()
+
+    def insertFromMimeData(self, source):
+        if self.shell is not None:
+            if source.hasText():
+                self.send_to_shell(source.text().replace("\r\n", "\r").replace("\n", "\r"))
+            return
+        super().insertFromMimeData(source)
+
+    def shell_key(self, event):
+        modifiers = event.modifiers()
+        key = event.key()
+        if modifiers & Qt.ControlModifier and modifiers & Qt.ShiftModifier:
+            # Ctrl+Shift+C/V — копирование и вставка, как в обычных терминалах
+            if key == Qt.Key_C:
+                self.copy()
+            elif key == Qt.Key_V:
+                self.paste()
+            return
+        if modifiers & Qt.ControlModifier and Qt.Key_A <= key <= Qt.Key_Z:
+            data = chr(key - Qt.Key_A + 1)
+        elif modifiers & Qt.ControlModifier and key in (Qt.Key_BracketLeft, Qt.Key_Backslash, Qt.Key_BracketRight):
+            data = chr(key - Qt.Key_BracketLeft + 0x1b)
+        else:
+            data = SHELL_KEYS.get(key) or event.text()
+            if data and modifiers & Qt.AltModifier:
+                data = "\x1b" + data
+        if data:
+            self.send_to_shell(data)
+
     def keyPressEvent(self, event):
-        if event.key() in (Qt.Key_Return, Qt.Key_Enter):
+        if self.shell is not None:
+            self.shell_key(event)
+        elif event.key() == Qt.Key_C and event.modifiers() & Qt.ControlModifier and self.running_request:
+            self.browser_tab.cancel_request(self.running_request)
+            self.append_stream("^C")
+        elif event.key() in (Qt.Key_Return, Qt.Key_Enter):
             self.execute_current_command()
         elif event.key() == Qt.Key_Up:
             self.navigate_history(-1)
@@ -87,22 +328,37 @@ class TerminalWidget(QTextEdit):
         self.insertPlainText("\n")
         
         if command.startswith("cd "):
-            path = command[3:].strip()
-            if path == "~":
-                path = self.browser_tab.home_dir
-            elif path == ".":
-                path = self.browser_tab.current_path
-            elif path == "..":
-                path = os.path.dirname(self.browser_tab.current_path.rstrip('/'))
-            self.browser_tab.send_command({"cmd": "SftpList", "path": path})
+            self.browser_tab.list_remote(command[3:].strip(), echo=True)
         elif command == "ls":
-            self.browser_tab.send_command({"cmd": "SftpList", "path": self.browser_tab.current_path or "."})
+            self.browser_tab.list_remote(self.browser_tab.current_path or ".", echo=True)
         elif command == "pwd":
             self.append_output(self.browser_tab.current_path or "~")
         elif command == "disconnect":
             self.browser_tab.disconnect()
+        elif command == "stats":
+            self.show_stats()
+        elif command.startswith("scrollback "):
+            self.search_scrollback(command[len("scrollback "):].strip())
         else:
-            self.browser_tab.send_command({"cmd": "Exec", "command": command})
+            self.running_request = self.browser_tab.send_command(
+                {"cmd": "Exec", "command": command, "stream": True},
+                callback=self.on_exec_frame)
+
+    def on_exec_frame(self, response):
+        status = response.get("status")
+        if status == "chunk":
+            self.append_stream(response.get("data", ""))
+        elif status == "exit_status":
+            if response.get("signal"):
+                self.append_line(f"[terminated by {response['signal']}]")
+            elif response.get("code"):
+                self.append_line(f"[exit {response['code']}]")
+        elif status == "end":
+            self.running_request = None
+            self.append_prompt()
+        elif status == "error":
+            self.running_request = None
+            self.append_output("Error: " + response.get("message", "Unknown error"))
 
     def navigate_history(self, direction):
         if not self.history:
@@ -118,194 +374,728 @@ class TerminalWidget(QTextEdit):
 
     def append_output(self, text):
         # Schedule output processing to avoid race conditions
-        self.pending_output += text
-        QTimer.singleShot(0, self._process_output)
+        self._queue_output("message", text)
+
+    def append_stream(self, text):
+        # Кусок вывода выполняющейся команды: без перевода строки и приглашения
+        self._queue_output("stream", text)
+
+    def append_line(self, text):
+        self._queue_output("line", text)
+
+    def append_prompt(self):
+        self._queue_output("prompt", "")
+
+    def _queue_output(self, kind, text):
+        self.pending_output.append((kind, text))
+        self.output_stats["chunks"] += 1
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
 
     def _process_output(self):
         if not self.pending_output:
             return
-            
-        self.moveCursor(QTextCursor.End)
-        
-        # Remove any trailing newlines from output
-        output = self.pending_output.rstrip('\n')
-        self.pending_output = ""
-        
-        # If we're not at start of line, add newline first
-        cursor = self.textCursor()
-        if cursor.positionInBlock() != 0:
-            self.insertPlainText("\n")
         
-        # Insert the actual output
-        self.insertPlainText(output)
+        started = time.perf_counter()
+        pending, self.pending_output = self.pending_output, []
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.End)
+        if self.shell is not None:
+            # Последний блок — текущая строка shell, она рисуется заново после вывода
+            cursor.movePosition(QTextCursor.StartOfBlock, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+        at_line_start = cursor.positionInBlock() == 0
+        
+        parts = []
+        for kind, text in pending:
+            if kind == "stream":
+                if text:
+                    parts.append(text)
+                    at_line_start = text.endswith("\n")
+                continue
+            
+            # If we're not at start of line, add newline first
+            if not at_line_start:
+                parts.append("\n")
+            
+            if kind in ("message", "line"):
+                # Remove any trailing newlines from output
+                parts.append(text.rstrip('\n') + "\n")
+            
+            # Add new prompt on new line; у shell приглашение своё
+            if kind != "line" and self.shell is None:
+                parts.append(self.get_prompt())
+            at_line_start = kind == "line"
+        
+        text = self._drop_overflow("".join(parts))
+        
+        # Большой поток выводим частями, чтобы один кадр не блокировал интерфейс
+        cut = -1
+        for _ in range(OUTPUT_LINES_PER_FLUSH):
+            cut = text.find("\n", cut + 1)
+            if cut == -1:
+                break
+        if cut != -1 and cut + 1 < len(text):
+            text, rest = text[:cut + 1], text[cut + 1:]
+            self.pending_output.insert(0, ("stream", rest))
+            self.flush_timer.start()
+        
+        cursor.beginEditBlock()
+        cursor.insertText(text)
+        if self.shell is not None:
+            if not cursor.atBlockStart():
+                cursor.insertText("\n")
+            cursor.insertText(self.shell.line)
+            cursor.movePosition(QTextCursor.StartOfBlock)
+            cursor.movePosition(QTextCursor.Right, QTextCursor.MoveAnchor, min(self.shell.col, len(self.shell.line)))
+        cursor.endEditBlock()
+        self.setTextCursor(cursor)
+        self._trim_scrollback()
         
-        # Add new prompt on new line
-        self.insertPlainText("\n" + self.get_prompt())
-        self.moveCursor(QTextCursor.End)
+        stats = self.output_stats
+        stats["flushes"] += 1
+        stats["chars"] += len(text)
+        stats["max_flush_ms"] = max(stats["max_flush_ms"], (time.perf_counter() - started) * 1000)
+
+    def _drop_overflow(self, text):
+        # То, что всё равно вытеснит ограничение прокрутки, в документ не вставляем
+        if not self.scrollback_lines or text.count("\n") <= self.scrollback_lines:
+            return text
+        cut = len(text)
+        for _ in range(self.scrollback_lines):
+            cut = text.rfind("\n", 0, cut)
+        head, text = text[:cut + 1], text[cut + 1:]
+        # Оставшегося хватит на всю прокрутку, так что документ уходит целиком, и раньше head:
+        # журнал должен идти по порядку вывода
+        document = self.document()
+        self._evict(document.characterCount() - 1)
+        if self.spill is not None:
+            self.spill.write(head)
+        self.output_stats["dropped_chars"] += len(head)
+        return text
+
+    def show_stats(self):
+        stats = self.output_stats
+        self.append_output(
+            f"Output: {stats['chunks']} chunks, {stats['flushes']} flushes, "
+            f"{stats['chars']} chars rendered, {stats['dropped_chars']} chars skipped, "
+            f"slowest flush {stats['max_flush_ms']:.1f} ms\n"
+            + self.browser_tab.listing_cache.stats() + "\n"
+            + self.browser_tab.prefetcher.stats())
+
+    def _trim_scrollback(self):
+        # Срезаем старые блоки с запасом в 10%, чтобы не резать документ на каждом выводе
+        document = self.document()
+        excess = 0
+        if self.scrollback_lines and document.blockCount() > self.scrollback_lines:
+            excess = document.blockCount() - self.scrollback_lines * 9 // 10
+        if self.scrollback_chars and document.characterCount() > self.scrollback_chars:
+            overflow = document.characterCount() - self.scrollback_chars * 9 // 10
+            block = document.firstBlock()
+            blocks = 0
+            while block.isValid() and overflow > 0:
+                overflow -= block.length()
+                blocks += 1
+                block = block.next()
+            excess = max(excess, blocks)
+        # Последний блок — строка с приглашением, её не трогаем
+        excess = min(excess, document.blockCount() - 1)
+        if excess <= 0:
+            return
+        self._evict(document.findBlockByNumber(excess).position())
+
+    def _evict(self, position):
+        # Начало документа до position — в журнал и из документа
+        cursor = QTextCursor(self.document())
+        cursor.setPosition(position, QTextCursor.KeepAnchor)
+        if self.spill is not None:
+            self.spill.write(cursor.selectedText().replace("\u2029", "\n"))
+        cursor.removeSelectedText()
+
+    def search_scrollback(self, pattern):
+        if not pattern:
+            self.append_output("Usage: scrollback <text>")
+        elif self.spill is None:
+            self.append_output("Scrollback spill is disabled (scrollback-spill in config.cfg)")
+        else:
+            matches = self.spill.search(pattern)
+            self.append_output("\n".join(matches) if matches else f"No matches for {pattern!r} in evicted history")
+
+    def release_scrollback(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+
+FLAG_DIR = 1
+FLAG_PARENT = 2  # строка ".."
+FILE_COLUMNS = ["Name", "Size", "Type", "Modified"]
+FETCH_BATCH = 1000
+PAGE_MERGE_INTERVAL_MS = 200
+PREFETCH_IDLE_MS = 400
+LOCAL_BATCH = 500
+LOCAL_RESCAN_DELAY_MS = 300
+
+
+def format_size(size):
+    if size < 1024:
+        return f"{size} B"
+    elif size < 1024*1024:
+        return f"{size/1024:.1f} KB"
+    elif size < 1024*1024*1024:
+        return f"{size/(1024*1024):.1f} MB"
+    else:
+        return f"{size/(1024*1024*1024):.1f} GB"
+
+
+class FileColumns:
+    # Компактное хранилище списка файлов: по массиву на колонку вместо объекта на строку
+    def __init__(self):
+        self.names = []
+        self.sizes = array("q")
+        self.mtimes = array("q")  # -1, если время неизвестно
+        self.flags = bytearray()
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, name, is_dir, size=0, mtime=-1, flags=0):
+        self.names.append(name)
+        self.sizes.append(size or 0)
+        self.mtimes.append(-1 if mtime is None else int(mtime))
+        self.flags.append(flags | (FLAG_DIR if is_dir else 0))
+
+
+class FileListModel(QAbstractItemModel):
+    def __init__(self, is_remote, folder_icon, file_icon, parent=None):
+        super().__init__(parent)
+        self.is_remote = is_remote
+        self.folder_icon = folder_icon
+        self.file_icon = file_icon
+        self.base_path = None  # каталог, для локальных записей
+        self.columns = FileColumns()
+        self.name_keys = []  # casefold-имена для сортировки, параллельно columns.names
+        self.order = array("L")  # порядок строк после сортировки: индексы в columns
+        self.visible = 0  # сколько строк уже отдано представлению (fetchMore)
+        self.sort_column = 0
+        self.sort_order = Qt.AscendingOrder
+
+    def set_columns(self, columns, base_path=None):
+        self.beginResetModel()
+        self.columns = columns
+        self.base_path = base_path
+        self.name_keys = []
+        self.order = self._sorted_order(range(len(columns)))
+        self.visible = min(len(self.order), FETCH_BATCH)
+        self.endResetModel()
+
+    def extend(self, entries):
+        # Следующая порция записей (name, is_dir, size, mtime): дописываем в колонки и вливаем в текущий порядок
+        first = len(self.columns)
+        for name, is_dir, size, mtime in entries:
+            self.columns.append(name, is_dir, size, mtime)
+        self._relayout(self._sorted_order(itertools.chain(self.order, range(first, len(self.columns)))))
+        visible = min(len(self.order), max(self.visible, FETCH_BATCH))
+        if visible > self.visible:
+            self.beginInsertRows(QModelIndex(), self.visible, visible - 1)
+            self.visible = visible
+            self.endInsertRows()
+
+    def snapshot(self):
+        # Текущее содержимое без "..": имя -> (is_dir, size, mtime), для сравнения с диском
+        columns = self.columns
+        return {columns.names[i]: (bool(columns.flags[i] & FLAG_DIR), columns.sizes[i], columns.mtimes[i])
+                for i in self.order if not columns.flags[i] & FLAG_PARENT}
+
+    def apply_diff(self, added, removed, modified):
+        # Точечные изменения вместо полной перезагрузки: выделение и прокрутка сохраняются
+        columns = self.columns
+        if removed or modified:
+            slots = {columns.names[i]: i for i in self.order if not columns.flags[i] & FLAG_PARENT}
+        if removed:
+            gone = {slots[name] for name in removed if name in slots}
+            if len(gone) > FETCH_BATCH:
+                # Массовое удаление дешевле показать сбросом, чем построчно
+                self.beginResetModel()
+                self.order = array("L", (i for i in self.order if i not in gone))
+                self.visible = min(len(self.order), max(self.visible, FETCH_BATCH))
+                self.endResetModel()
+                gone = ()
+            for row in range(len(self.order) - 1, -1, -1):
+                if self.order[row] not in gone:
+                    continue
+                if row < self.visible:
+                    self.beginRemoveRows(QModelIndex(), row, row)
+                    del self.order[row]
+                    self.visible -= 1
+                    self.endRemoveRows()
+                else:
+                    del self.order[row]
+        if modified:
+            for name, is_dir, size, mtime in modified:
+                i = slots.get(name)
+                if i is None:
+                    continue
+                columns.sizes[i] = size or 0
+                columns.mtimes[i] = -1 if mtime is None else int(mtime)
+                columns.flags[i] = FLAG_DIR if is_dir else 0
+            self._relayout(self._sorted_order(self.order))
+            if self.visible:
+                self.dataChanged.emit(self.index(0, 0), self.index(self.visible - 1, len(FILE_COLUMNS) - 1))
+        if added:
+            self.extend(added)
+
+    def file_info(self, row):
+        i = self.order[row]
+        name = self.columns.names[i]
+        is_dir = bool(self.columns.flags[i] & FLAG_DIR)
+        if self.columns.flags[i] & FLAG_PARENT:
+            if self.is_remote:
+                return {"is_dir": True, "name": ".."}
+            return {"is_dir": True, "name": "..", "path": str(Path(self.base_path).parent)}
+        if self.is_remote:
+            return {"name": name, "is_dir": is_dir, "size": self.columns.sizes[i]}
+        return {"is_dir": is_dir, "path": os.path.join(self.base_path, name)}
+
+    def _sorted_order(self, rows):
+        columns = self.columns
+        flags = columns.flags
+        if self.sort_column == 1:
+            keys = columns.sizes
+        elif self.sort_column == 3:
+            keys = columns.mtimes
+        else:
+            # Ключи имён считаем один раз и дописываем по мере прихода страниц
+            names = columns.names
+            self.name_keys.extend(name.casefold() for name in names[len(self.name_keys):])
+            keys = self.name_keys
+        
+        # Каталоги всегда выше файлов, ".." — самая первая строка
+        rows = list(rows)
+        parents = [i for i in rows if flags[i] & FLAG_PARENT]
+        dirs = [i for i in rows if flags[i] & (FLAG_DIR | FLAG_PARENT) == FLAG_DIR]
+        files = [i for i in rows if not flags[i] & FLAG_DIR]
+        # Вход уже почти отсортирован (прошлый порядок + новая страница), timsort сливает его почти линейно
+        descending = self.sort_order == Qt.DescendingOrder
+        dirs.sort(key=keys.__getitem__, reverse=descending)
+        files.sort(key=keys.__getitem__, reverse=descending)
+        return array("L", parents + dirs + files)
+
+    def _relayout(self, order):
+        self.layoutAboutToBeChanged.emit()
+        old_order, self.order = self.order, order
+        persistent = self.persistentIndexList()
+        if persistent:
+            rows = {i: row for row, i in enumerate(order)}
+            moved = []
+            for index in persistent:
+                row = rows.get(old_order[index.row()], -1) if index.row() < len(old_order) else -1
+                moved.append(self.index(row, index.column()))
+            self.changePersistentIndexList(persistent, moved)
+        self.layoutChanged.emit()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order
+        self._relayout(self._sorted_order(self.order))
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < self.visible and 0 <= column < len(FILE_COLUMNS)):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.visible
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(FILE_COLUMNS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.visible < len(self.order)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(FETCH_BATCH, len(self.order) - self.visible)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.visible, self.visible + count - 1)
+        self.visible += count
+        self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return FILE_COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        i = self.order[index.row()]
+        flags = self.columns.flags[i]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return self.columns.names[i]
+            if flags & FLAG_PARENT:
+                return ""
+            if column == 1:
+                return "" if flags & FLAG_DIR else format_size(self.columns.sizes[i])
+            if column == 2:
+                return "Directory" if flags & FLAG_DIR else "File"
+            mtime = self.columns.mtimes[i]
+            return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime)) if mtime >= 0 else ""
+        if role == Qt.DecorationRole and column == 0:
+            return self.folder_icon if flags & FLAG_DIR else self.file_icon
+        if role == Qt.UserRole:
+            return self.file_info(index.row())
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if not self.is_remote and not self.columns.flags[self.order[index.row()]] & FLAG_PARENT:
+            flags |= Qt.ItemIsDragEnabled
+        return flags
+
+    def mimeTypes(self):
+        return ["text/uri-list"]
+
+    def mimeData(self, indexes):
+        # Перетаскивание локальных файлов отдаёт обычные file:// ссылки
+        rows = sorted({index.row() for index in indexes})
+        mime_data = QMimeData()
+        mime_data.setUrls([QUrl.fromLocalFile(self.file_info(row)["path"]) for row in rows])
+        return mime_data
+
+    def supportedDragActions(self):
+        return Qt.CopyAction
+
+
+_file_icons = None
 
 
-class UnifiedFileSystemView(QTreeWidget):
+def file_icons():
+    # Иконки из темы грузятся один раз на все панели всех вкладок
+    global _file_icons
+    if _file_icons is None:
+        provider = QFileIconProvider()
+        _file_icons = provider.icon(QFileIconProvider.Folder), provider.icon(QFileIconProvider.File)
+    return _file_icons
+
+
+def scan_entry(entry):
+    try:
+        stat = entry.stat()
+    except OSError:
+        stat = entry.stat(follow_symlinks=False)
+    is_dir = stat_module.S_ISDIR(stat.st_mode)
+    return entry.name, is_dir, 0 if is_dir else stat.st_size, int(stat.st_mtime)
+
+
+class LocalLister(QThread):
+    # Читает локальный каталог вне GUI-потока. Без known отдаёт записи порциями,
+    # с known (снимок модели) — только разницу с ним одним сигналом
+    batch = pyqtSignal(int, list)
+    diff = pyqtSignal(int, list, list, list)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self, generation, path, known=None, parent=None):
+        super().__init__(parent)
+        self.generation = generation
+        self.path = path
+        self.known = known
+
+    def run(self):
+        entries = []
+        seen = set()
+        added, modified = [], []
+        try:
+            with os.scandir(self.path) as iterator:
+                for entry in iterator:
+                    if self.isInterruptionRequested():
+                        return
+                    try:
+                        row = scan_entry(entry)
+                    except OSError:
+                        continue
+                    if self.known is None:
+                        entries.append(row)
+                        if len(entries) >= LOCAL_BATCH:
+                            self.batch.emit(self.generation, entries)
+                            entries = []
+                        continue
+                    seen.add(row[0])
+                    previous = self.known.get(row[0])
+                    if previous is None:
+                        added.append(row)
+                    elif previous != row[1:]:
+                        modified.append(row)
+        except OSError as e:
+            self.failed.emit(self.generation, str(e))
+            return
+        if self.known is None:
+            self.batch.emit(self.generation, entries)
+        else:
+            removed = [name for name in self.known if name not in seen]
+            if added or removed or modified:
+                self.diff.emit(self.generation, added, removed, modified)
+
+
+class UnifiedFileSystemView(QTreeView):
     def __init__(self, parent=None, is_remote=False):
         super().__init__(parent)
         self.is_remote = is_remote
         self.parent_browser = parent
-        self.setHeaderLabels(["Name", "Size", "Type", "Modified"])
+        self.local_path = None
+        
+        self.folder_icon, self.file_icon = file_icons()
+        
+        self.file_model = FileListModel(is_remote, self.folder_icon, self.file_icon, self)
+        self.setModel(self.file_model)
+        
+        self.pending_pages = []
+        self.page_timer = QTimer(self)
+        self.page_timer.setSingleShot(True)
+        self.page_timer.setInterval(PAGE_MERGE_INTERVAL_MS)
+        self.page_timer.timeout.connect(self.flush_pending_pages)
+        
+        if not self.is_remote:
+            self.listing_generation = 0
+            self.listers = set()  # живые потоки; Python-объект QThread нельзя терять до finished
+            self.listing_done = True
+            self.rescan_pending = False
+            self.watcher = QFileSystemWatcher(self)
+            self.watcher.directoryChanged.connect(self.on_local_dir_changed)
+            self.rescan_timer = QTimer(self)
+            self.rescan_timer.setSingleShot(True)
+            self.rescan_timer.setInterval(LOCAL_RESCAN_DELAY_MS)
+            self.rescan_timer.timeout.connect(self.rescan_local_files)
         self.header().setSectionResizeMode(0, QHeaderView.Stretch)
         self.header().setSectionResizeMode(1, QHeaderView.ResizeToContents)
         self.header().setSectionResizeMode(2, QHeaderView.ResizeToContents)
         self.header().setSectionResizeMode(3, QHeaderView.ResizeToContents)
-        self.setRootIsDecorated(True)
+        self.setRootIsDecorated(False)
+        self.setUniformRowHeights(True)
         self.setSortingEnabled(True)
-        self.itemDoubleClicked.connect(self.on_item_double_clicked)
+        self.sortByColumn(0, Qt.AscendingOrder)
+        self.doubleClicked.connect(self.on_item_double_clicked)
         
         # Enable drag and drop for remote file view
         if self.is_remote:
+            # Наведение и выделение подсказывают, какие каталоги прочитать заранее
+            self.setMouseTracking(True)
+            self.entered.connect(self.hint_prefetch)
+            self.selectionModel().currentChanged.connect(self.hint_prefetch)
             self.setAcceptDrops(True)
             self.setDragEnabled(False)
-            self.setDragDropMode(QTreeWidget.DropOnly)
+            self.setDragDropMode(QTreeView.DropOnly)
         else:
             self.setDragEnabled(True)
             self.setAcceptDrops(False)
-            self.setDragDropMode(QTreeWidget.DragOnly)
-        
-        self.icon_provider = QFileIconProvider()
-        self.folder_icon = self.icon_provider.icon(QFileIconProvider.Folder)
-        self.file_icon = self.icon_provider.icon(QFileIconProvider.File)
+            self.setDragDropMode(QTreeView.DragOnly)
         
         # Enable context menu
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.show_context_menu)
     
     def update_files(self, files):
-        self.clear()
-        
         if self.is_remote:
             self.update_remote_files(files)
         else:
             self.update_local_files(files)
     
     def update_remote_files(self, files):
-        self.clear()
+        self.page_timer.stop()
+        self.pending_pages = []
+        columns = FileColumns()
         
         # Добавляем кнопку ".." только если текущий путь не корневой
         if self.parent_browser.current_path and self.parent_browser.current_path != "/":
-            parent_item = QTreeWidgetItem()
-            parent_item.setText(0, "..")
-            parent_item.setIcon(0, self.folder_icon)
-            parent_item.setData(0, Qt.UserRole, {"is_dir": True, "name": ".."})
-            self.addTopLevelItem(parent_item)
+            columns.append("..", True, flags=FLAG_PARENT)
 
         for file_info in files:
-            item = QTreeWidgetItem()
-            item.setText(0, file_info.get("name", ""))
-            
-            size = file_info.get("size", 0)
-            item.setText(1, self.format_size(size) if not file_info.get("is_dir", False) else "")
-            
-            item_type = "Directory" if file_info.get("is_dir", False) else "File"
-            item.setText(2, item_type)
-            
-            modified = file_info.get("modified", "")
-            item.setText(3, modified)
-            
-            item.setIcon(0, self.folder_icon if file_info.get("is_dir", False) else self.file_icon)
-            item.setData(0, Qt.UserRole, file_info)
-            self.addTopLevelItem(item)
+            columns.append(file_info.get("name", ""), file_info.get("is_dir", False),
+                           file_info.get("size", 0), file_info.get("mtime"))
+        self.file_model.set_columns(columns)
+
+    def append_remote_files(self, files):
+        # Страницы копятся и вливаются в модель не чаще раза в PAGE_MERGE_INTERVAL_MS
+        self.pending_pages.extend((file_info.get("name", ""), file_info.get("is_dir", False),
+                                   file_info.get("size", 0), file_info.get("mtime")) for file_info in files)
+        if not self.page_timer.isActive():
+            self.page_timer.start()
+
+    def flush_pending_pages(self):
+        self.page_timer.stop()
+        if self.pending_pages:
+            files, self.pending_pages = self.pending_pages, []
+            self.file_model.extend(files)
     
     def update_local_files(self, path):
-        self.clear()
+        if self.local_path and self.local_path != path:
+            self.watcher.removePath(self.local_path)
+        self.local_path = path
+        self.page_timer.stop()
+        self.pending_pages = []
+        self.rescan_timer.stop()
+        self.rescan_pending = False
+        columns = FileColumns()
         
         if QDir(path).dirName():
-            parent_item = QTreeWidgetItem()
-            parent_item.setText(0, "..")
-            parent_item.setIcon(0, self.folder_icon)
-            parent_item.setData(0, Qt.UserRole, {"is_dir": True, "path": str(Path(path).parent)})
-            self.addTopLevelItem(parent_item)
-        
-        dir_info = QFileInfo(path)
-        if dir_info.isDir():
-            dir = QDir(path)
-            for file_info in dir.entryInfoList(QDir.AllEntries | QDir.NoDotAndDotDot | QDir.Hidden, 
-                                            QDir.DirsFirst | QDir.IgnoreCase):
-                item = QTreeWidgetItem()
-                item.setText(0, file_info.fileName())
-                
-                if file_info.isDir():
-                    item.setText(1, "")
-                    item.setText(2, "Directory")
-                else:
-                    item.setText(1, self.format_size(file_info.size()))
-                    item.setText(2, "File")
-                
-                item.setText(3, file_info.lastModified().toString("yyyy-MM-dd HH:mm:ss"))
-                item.setIcon(0, self.folder_icon if file_info.isDir() else self.file_icon)
-                item.setData(0, Qt.UserRole, {
-                    "is_dir": file_info.isDir(),
-                    "path": file_info.absoluteFilePath()
-                })
-                self.addTopLevelItem(item)
-    
-    def format_size(self, size):
-        if size < 1024:
-            return f"{size} B"
-        elif size < 1024*1024:
-            return f"{size/1024:.1f} KB"
-        elif size < 1024*1024*1024:
-            return f"{size/(1024*1024):.1f} MB"
+            columns.append("..", True, flags=FLAG_PARENT)
+        self.file_model.set_columns(columns, path)
+        # Следим с самого начала, чтобы не пропустить изменения во время чтения
+        if path not in self.watcher.directories():
+            self.watcher.addPath(path)
+        self.listing_done = False
+        self.start_lister(path)
+    
+    def start_lister(self, path, known=None):
+        self.listing_generation += 1
+        for lister in self.listers:
+            lister.requestInterruption()
+        lister = LocalLister(self.listing_generation, path, known, self)
+        lister.batch.connect(self.on_local_batch)
+        lister.diff.connect(self.on_local_diff)
+        lister.failed.connect(self.on_local_failed)
+        lister.finished.connect(lambda: self.on_lister_finished(lister))
+        self.listers.add(lister)
+        lister.start()
+    
+    def on_local_batch(self, generation, entries):
+        if generation != self.listing_generation:
+            return
+        if len(self.file_model.order) <= 1:
+            # Первая порция показывается сразу, остальные сливаются по таймеру
+            self.file_model.extend(entries)
         else:
-            return f"{size/(1024*1024*1024):.1f} GB"
+            self.pending_pages.extend(entries)
+            if not self.page_timer.isActive():
+                self.page_timer.start()
+    
+    def on_local_diff(self, generation, added, removed, modified):
+        if generation == self.listing_generation:
+            self.file_model.apply_diff(added, removed, modified)
+    
+    def on_local_failed(self, generation, message):
+        if generation != self.listing_generation:
+            return
+        if not os.path.isdir(self.local_path):
+            # Каталог удалили — поднимаемся к ближайшему существующему
+            parent = os.path.dirname(self.local_path)
+            while parent and not os.path.isdir(parent) and parent != os.path.dirname(parent):
+                parent = os.path.dirname(parent)
+            if parent and parent != self.local_path:
+                self.update_local_files(parent)
+                return
+        self.parent_browser.terminal.append_output(f"Error listing {self.local_path}: {message}")
+    
+    def on_lister_finished(self, lister):
+        self.listers.discard(lister)
+        lister.deleteLater()
+        if lister.generation != self.listing_generation:
+            return
+        if not self.listing_done:
+            self.listing_done = True
+            self.flush_pending_pages()
+        if self.rescan_pending:
+            self.rescan_pending = False
+            self.rescan_timer.start()
+    
+    def on_local_dir_changed(self, path):
+        if path == self.local_path:
+            self.rescan_timer.start()
+    
+    def rescan_local_files(self):
+        # Пока идёт чтение, снимок модели неполный — перечитываем после него
+        if not self.listing_done:
+            self.rescan_pending = True
+            return
+        self.start_lister(self.local_path, self.file_model.snapshot())
+    
+    def stop_local_listing(self):
+        for lister in list(self.listers):
+            lister.requestInterruption()
+            lister.wait()
     
-    def on_item_double_clicked(self, item):
-        file_info = item.data(0, Qt.UserRole)
+    def hint_prefetch(self, index, previous=None):
+        if not index.isValid():
+            return
+        file_info = self.file_model.file_info(index.row())
+        if file_info.get("is_dir", False) and file_info["name"] != ".." and self.parent_browser.current_path:
+            path = posixpath.join(self.parent_browser.current_path, file_info["name"])
+            self.parent_browser.prefetcher.hint(canonical_remote_path(path))
+
+    def on_item_double_clicked(self, index):
+        file_info = self.file_model.file_info(index.row())
         
         if file_info.get("is_dir", False):
             if self.is_remote:
                 if file_info["name"] == "..":
                     # Поднимаемся на уровень выше
-                    parent_path = os.path.dirname(self.parent_browser.current_path.rstrip('/'))
+                    parent_path = posixpath.dirname(self.parent_browser.current_path.rstrip('/')) or "/"
                     # Не поднимаемся выше корня
                     if parent_path == self.parent_browser.current_path:
                         return
                     path = parent_path
                 else:
                     # Переходим в выбранную папку
-                    path = os.path.join(self.parent_browser.current_path, file_info["name"])
+                    path = posixpath.join(self.parent_browser.current_path, file_info["name"])
                 
-                # Обновляем текущий путь и запрашиваем содержимое
-                self.parent_browser.current_path = path
-                self.parent_browser.send_command({"cmd": "SftpList", "path": path})
+                # Запрашиваем содержимое, текущий путь сменится с первой страницей
+                self.parent_browser.list_remote(path)
             else:
                 # Локальная файловая система
                 self.update_local_files(file_info["path"])
     
     def show_context_menu(self, position):
-        item = self.itemAt(position)
-        if not item:
+        index = self.indexAt(position)
+        if not index.isValid():
             return
             
-        file_info = item.data(0, Qt.UserRole)
+        file_info = self.file_model.file_info(index.row())
         menu = QMenu()
         
         if self.is_remote:
             # Context menu for remote files
-            if not file_info.get("is_dir", False):
+            if file_info["name"] != "..":
                 download_action = QAction("Download", self)
                 download_action.triggered.connect(lambda: self.download_file(file_info))
                 menu.addAction(download_action)
+                if file_info.get("is_dir", False):
+                    sync_action = QAction("Sync from Local Folder...", self)
+                    sync_action.triggered.connect(lambda: self.sync_from_local(file_info))
+                    menu.addAction(sync_action)
             
             delete_action = QAction("Delete", self)
             delete_action.triggered.connect(lambda: self.delete_file(file_info))
             menu.addAction(delete_action)
         else:
             # Context menu for local files
-            if not file_info.get("is_dir", False):
+            if file_info.get("name") != "..":
                 upload_action = QAction("Upload to Server", self)
                 upload_action.triggered.connect(lambda: self.upload_file(file_info))
                 menu.addAction(upload_action)
+                if file_info.get("is_dir", False):
+                    sync_action = QAction("Sync to Server", self)
+                    sync_action.triggered.connect(lambda: self.sync_to_server(file_info))
+                    menu.addAction(sync_action)
         
         menu.exec_(self.viewport().mapToGlobal(position))
     
     def download_file(self, file_info):
+        remote_path = posixpath.join(self.parent_browser.current_path, file_info["name"])
+        if file_info.get("is_dir", False):
+            # Каталог скачивается целиком внутрь выбранной папки
+            target_dir = QFileDialog.getExistingDirectory(self, "Download Folder To", QDir.homePath())
+            if target_dir:
+                self.parent_browser.transfers.enqueue(
+                    "download", os.path.join(target_dir, file_info["name"]), remote_path, recursive=True)
+            return
+        
         # Ask where to save the file
         save_path, _ = QFileDialog.getSaveFileName(
             self, 
@@ -317,14 +1107,7 @@ class UnifiedFileSystemView(QTreeWidget):
         if not save_path:
             return
             
-        # Send download command to server
-        remote_path = os.path.join(self.parent_browser.current_path, file_info["name"])
-        self.parent_browser.send_command({
-            "cmd": "SftpDownload",
-            "remote": remote_path,
-            "local": save_path
-        })
-        self.parent_browser.terminal.append_output(f"Downloading {remote_path} to {save_path}...")
+        self.parent_browser.transfers.enqueue("download", save_path, remote_path)
     
     def delete_file(self, file_info):
         reply = QMessageBox.question(
@@ -335,12 +1118,11 @@ class UnifiedFileSystemView(QTreeWidget):
         )
         
         if reply == QMessageBox.Yes:
-            remote_path = os.path.join(self.parent_browser.current_path, file_info["name"])
-            self.parent_browser.send_command({
-                "cmd": "SftpDelete",
+            remote_path = posixpath.join(self.parent_browser.current_path, file_info["name"])
+            self.parent_browser.send_mutation({
+                "cmd": "SftpRmdir" if file_info.get("is_dir", False) else "SftpRemove",
                 "path": remote_path,
-                "is_dir": file_info.get("is_dir", False)
-            })
+            }, remote_path)
             self.parent_browser.terminal.append_output(f"Deleting {remote_path}...")
     
     def upload_file(self, file_info):
@@ -348,21 +1130,26 @@ class UnifiedFileSystemView(QTreeWidget):
             QMessageBox.warning(self, "Error", "Not connected to server")
             return
         
-        # Получаем только имя файла
+        # Загружаем в каталог, открытый в удалённой панели
         filename = os.path.basename(file_info["path"])
+        remote_path = posixpath.join(self.parent_browser.current_path, filename)
         
-        # Всегда используем относительный путь (имя файла)
-        remote_filename = filename
-        
-        self.parent_browser.send_command({
-            "cmd": "SftpUpload",
-            "local": file_info["path"],  # Полный локальный путь
-            "remote": remote_filename    # Только имя файла
-        })
-        
-        # Понятное сообщение для пользователя
-        msg = f"Uploading {file_info['path']} to {self.parent_browser.current_path}/{filename}"
-        self.parent_browser.terminal.append_output(msg)
+        self.parent_browser.transfers.enqueue("upload", file_info["path"], remote_path,
+                                              recursive=file_info.get("is_dir", False))
+
+    def sync_to_server(self, file_info):
+        if not self.parent_browser.connected:
+            QMessageBox.warning(self, "Error", "Not connected to server")
+            return
+        remote_path = posixpath.join(self.parent_browser.current_path, os.path.basename(file_info["path"]))
+        self.parent_browser.transfers.enqueue("sync", file_info["path"], remote_path)
+
+    def sync_from_local(self, file_info):
+        # Удалённый каталог приводится к содержимому выбранной локальной папки
+        remote_path = posixpath.join(self.parent_browser.current_path, file_info["name"])
+        local_dir = QFileDialog.getExistingDirectory(self, f"Sync {file_info['name']} From", QDir.homePath())
+        if local_dir:
+            self.parent_browser.transfers.enqueue("sync", local_dir, remote_path)
 
     # Drag and drop implementation
     def dragEnterEvent(self, event: QDragEnterEvent):
@@ -385,24 +1172,694 @@ class UnifiedFileSystemView(QTreeWidget):
         mime_data = event.mimeData()
         if mime_data.hasUrls():
             for url in mime_data.urls():
-                local_path = url.toLocalFile()
-                if os.path.isfile(local_path):
-                    remote_path = os.path.join(
+                local_path = url.toLocalFile().rstrip(os.sep) or os.sep
+                if os.path.isfile(local_path) or os.path.isdir(local_path):
+                    remote_path = posixpath.join(
                         self.parent_browser.current_path,
                         os.path.basename(local_path))
                     
-                    self.parent_browser.send_command({
-                        "cmd": "SftpUpload",
-                        "local": local_path,
-                        "remote": remote_path
-                    })
-                    self.parent_browser.terminal.append_output(f"Uploading {local_path} to {remote_path}...")
+                    self.parent_browser.transfers.enqueue("upload", local_path, remote_path,
+                                                          recursive=os.path.isdir(local_path))
             
             event.acceptProposedAction()
         else:
             event.ignore()
 
 
+def canonical_remote_path(path):
+    path = posixpath.normpath(path)
+    return "/" if path.startswith("//") and not path.strip("/") else path
+
+
+class ListingCache:
+    # Кэш листингов удалённых каталогов сессии: LRU по общему числу записей,
+    # устаревшие листинги отдаются сразу и перечитываются в фоне
+    def __init__(self, max_entries=200000, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.listings = OrderedDict()  # каноничный путь -> (files, время получения)
+        self.size = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, path):
+        cached = self.listings.get(path)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.listings.move_to_end(path)
+        files, fetched_at = cached
+        fresh = time.monotonic() - fetched_at < self.ttl
+        if fresh:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+        return files, fresh
+
+    def is_fresh(self, path):
+        cached = self.listings.get(path)
+        return cached is not None and time.monotonic() - cached[1] < self.ttl
+
+    def peek(self, path):
+        cached = self.listings.get(path)
+        return cached[0] if cached is not None else None
+
+    def put(self, path, files):
+        self._drop(path)
+        if len(files) > self.max_entries:
+            return
+        self.listings[path] = (files, time.monotonic())
+        self.size += len(files)
+        while self.size > self.max_entries:
+            oldest = next(iter(self.listings))
+            self._drop(oldest)
+
+    def invalidate(self, path, recursive=False):
+        paths = [path]
+        if recursive:
+            prefix = path.rstrip("/") + "/"
+            paths += [cached for cached in self.listings if cached.startswith(prefix)]
+        for cached in paths:
+            if self._drop(cached):
+                self.invalidations += 1
+
+    def clear(self):
+        self.listings.clear()
+        self.size = 0
+
+    def _drop(self, path):
+        cached = self.listings.pop(path, None)
+        if cached is not None:
+            self.size -= len(cached[0])
+        return cached is not None
+
+    def stats(self):
+        return (f"Listing cache: {len(self.listings)} dirs, {self.size} entries, "
+                f"{self.hits} hits, {self.stale_hits} stale hits, {self.misses} misses, "
+                f"{self.invalidations} invalidations")
+
+
+class Prefetcher:
+    # Когда вкладка простаивает, заранее читает каталоги, в которые скорее всего перейдут:
+    # сначала наведённые/выделенные, потом недавно посещённые. Результат идёт только в кэш.
+    def __init__(self, browser_tab, limit=5, per_minute=30):
+        self.tab = browser_tab
+        self.limit = limit
+        self.per_minute = per_minute
+        self.hints = OrderedDict()  # подсказки из панели, самые свежие в конце
+        self.visited = deque(maxlen=20)
+        self.inflight = None
+        self.round_left = limit
+        self.tokens = float(per_minute)
+        self.refilled_at = time.monotonic()
+        self.fetched = 0
+        self.timer = QTimer(browser_tab)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(PREFETCH_IDLE_MS)
+        self.timer.timeout.connect(self.run)
+
+    def hint(self, path):
+        self.hints.pop(path, None)
+        self.hints[path] = None
+        if len(self.hints) > 50:
+            self.hints.popitem(last=False)
+        self.schedule()
+
+    def visit(self, path):
+        if path in self.visited:
+            self.visited.remove(path)
+        self.visited.append(path)
+        self.schedule()
+
+    def schedule(self):
+        # Любое действие пользователя откладывает предзагрузку и начинает новый раунд.
+        # Нулевой лимит или бюджет (prefetch-count, prefetch-per-minute) выключает предзагрузку
+        if self.limit <= 0 or self.per_minute <= 0:
+            return
+        self.round_left = self.limit
+        self.timer.start()
+
+    def run(self):
+        if self.inflight is not None or not self.tab.connected or self.round_left <= 0 or self.per_minute <= 0:
+            return
+        if self.tab.has_user_requests():
+            self.timer.start()
+            return
+        path = self.next_candidate()
+        if path is None:
+            return
+        if not self.take_token():
+            self.timer.start(int(60000 / self.per_minute))
+            return
+        self.round_left -= 1
+
+        def on_done(files):
+            self.inflight = None
+            if files is not None:
+                self.fetched += 1
+                self.tab.listing_cache.put(path, files)
+            QTimer.singleShot(0, self.run)
+        self.inflight = self.tab.fetch_listing(path, on_done, background=True)
+
+    def next_candidate(self):
+        cache = self.tab.listing_cache
+        for source in (self.hints, self.visited):
+            for path in reversed(list(source)):
+                if path != self.tab.current_path and path not in self.tab.revalidating and not cache.is_fresh(path):
+                    if source is self.hints:
+                        del self.hints[path]
+                    return path
+        return None
+
+    def stats(self):
+        return (f"Prefetch: {self.fetched} directories fetched, {len(self.hints)} hints queued, "
+                f"{int(self.tokens)}/{self.per_minute} budget left")
+
+    def take_token(self):
+        now = time.monotonic()
+        self.tokens = min(self.per_minute, self.tokens + (now - self.refilled_at) * self.per_minute / 60)
+        self.refilled_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+TRANSFER_COLUMNS = ["File", "Status", "Progress", "Speed", "ETA"]
+TRANSFER_ACTIVE = {"queued", "running", "paused", "cancelling"}
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return ""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class TransferPanel(QWidget):
+    # Очередь передач вкладки. Бэкенд сам держит не больше max_transfers одновременно,
+    # панель показывает прогресс и даёт ставить на паузу, отменять и повторять передачи
+    def __init__(self, browser_tab):
+        super().__init__(browser_tab)
+        self.browser_tab = browser_tab
+        self.transfers = []
+        
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(TRANSFER_COLUMNS)
+        self.tree.setRootIsDecorated(False)
+        self.tree.setUniformRowHeights(True)
+        self.tree.setSelectionMode(QTreeWidget.ExtendedSelection)
+        self.tree.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        for column in range(1, len(TRANSFER_COLUMNS)):
+            self.tree.header().setSectionResizeMode(column, QHeaderView.ResizeToContents)
+        
+        buttons = QHBoxLayout()
+        for title, handler in (("Pause", self.pause_selected), ("Resume", self.resume_selected),
+                               ("Cancel", self.cancel_selected), ("Retry", self.retry_selected),
+                               ("Clear finished", self.clear_finished)):
+            button = QPushButton(title)
+            button.clicked.connect(handler)
+            buttons.addWidget(button)
+        buttons.addStretch()
+        
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.tree)
+        layout.addLayout(buttons)
+        self.hide()
+
+    def enqueue(self, direction, local, remote, recursive=False):
+        name = posixpath.basename(remote) if direction == "download" else os.path.basename(local)
+        item = QTreeWidgetItem([name])
+        item.setToolTip(0, f"{remote} → {local}" if direction == "download" else f"{local} → {remote}")
+        transfer = {"direction": direction, "local": local, "remote": remote, "recursive": recursive, "item": item}
+        self.transfers.append(transfer)
+        self.tree.addTopLevelItem(item)
+        self.show()
+        self.start(transfer)
+
+    def start(self, transfer):
+        transfer.update(state="queued", bytes=0, total=None, rate=0, eta=None, error=None, files=None, synced=None)
+        on_frame = lambda response: self.on_frame(transfer, response)
+        suffix = "Dir" if transfer["recursive"] else ""
+        command = {"local": transfer["local"], "remote": transfer["remote"]}
+        if not transfer["recursive"] and self.browser_tab.connection_data.get("verify_transfers"):
+            # Сверка SHA-256 с сервером после передачи
+            command["verify"] = True
+        if transfer["direction"] == "sync":
+            # Только изменившиеся файлы, а от них — только отличающиеся блоки
+            transfer["request"] = self.browser_tab.send_mutation(
+                dict(command, cmd="SftpSync"), transfer["remote"], callback=on_frame)
+        elif transfer["direction"] == "upload":
+            transfer["request"] = self.browser_tab.send_mutation(
+                dict(command, cmd="SftpUpload" + suffix), transfer["remote"], callback=on_frame)
+        else:
+            # Повтор оборвавшейся загрузки докачивает файл из .part, а не начинает заново
+            transfer["request"] = self.browser_tab.send_command(
+                dict(command, cmd="SftpDownload" + suffix), callback=on_frame)
+        if transfer["request"] is None:
+            transfer.update(state="failed", error="Backend is not running")
+        self.refresh(transfer)
+
+    def on_frame(self, transfer, response):
+        status = response.get("status")
+        if status == "progress":
+            if transfer["state"] == "queued":
+                transfer["state"] = "running"
+            transfer.update(bytes=response.get("bytes", 0), total=response.get("total"),
+                            rate=response.get("rate", 0), eta=response.get("eta"))
+            if "files_total" in response:
+                transfer["files"] = (response["files"], response["files_total"])
+        elif status == "ok":
+            transfer.update(state="done", bytes=transfer["total"] or transfer["bytes"], eta=None)
+        elif status == "synced":
+            transfer.update(state="done", bytes=transfer["total"] or transfer["bytes"], eta=None, synced=response)
+            self.browser_tab.terminal.append_output(
+                f"Sync {transfer['remote']}: {response['updated']} of {response['files']} files changed, "
+                f"sent {format_size(response['sent'])} of {format_size(response['bytes'])} "
+                f"(saved {format_size(response['saved'])})")
+            if response.get("skipped"):
+                self.browser_tab.terminal.append_output(
+                    f"Sync {transfer['remote']}: skipped {response['skipped']} local symlinks and special files")
+            for path in response.get("conflicts", []):
+                self.browser_tab.terminal.append_output(
+                    f"Sync conflict: {path} is a symlink or special file on the server, left as is")
+        elif status == "error":
+            cancelled = transfer["state"] == "cancelling"
+            transfer.update(state="cancelled" if cancelled else "failed", error=response.get("message"), eta=None)
+            if not cancelled:
+                self.browser_tab.terminal.append_output(
+                    f"Error: {transfer['direction']} {transfer['item'].text(0)}: {transfer['error']}")
+        self.refresh(transfer)
+
+    def refresh(self, transfer):
+        item = transfer["item"]
+        state = transfer["state"]
+        item.setText(1, f"Failed: {transfer['error']}" if state == "failed" else state.capitalize())
+        total = transfer["total"]
+        if total:
+            progress = f"{transfer['bytes'] * 100 // total}% of {format_size(total)}"
+        else:
+            progress = format_size(transfer["bytes"])
+        if transfer["files"] is not None:
+            progress += ", {} of {} files".format(*transfer["files"])
+        if transfer["synced"] is not None:
+            progress = f"{transfer['synced']['updated']} changed, saved {format_size(transfer['synced']['saved'])}"
+        item.setText(2, progress)
+        item.setText(3, f"{format_size(int(transfer['rate']))}/s" if state == "running" and transfer["rate"] else "")
+        item.setText(4, format_eta(transfer["eta"]) if state == "running" else "")
+
+    def selected(self, states):
+        items = set(map(id, self.tree.selectedItems()))
+        return [transfer for transfer in self.transfers
+                if id(transfer["item"]) in items and transfer["state"] in states]
+
+    def pause_selected(self):
+        for transfer in self.selected({"queued", "running"}):
+            self.send_control(transfer, "Pause", "paused")
+
+    def resume_selected(self):
+        for transfer in self.selected({"paused"}):
+            self.send_control(transfer, "Resume", "queued")
+
+    def send_control(self, transfer, command, state):
+        def on_reply(response):
+            if response.get("status") == "ok" and transfer["state"] in TRANSFER_ACTIVE:
+                transfer["state"] = state
+                self.refresh(transfer)
+        self.browser_tab.send_command({"cmd": command, "target": transfer["request"]}, callback=on_reply)
+
+    def cancel_selected(self):
+        for transfer in self.selected({"queued", "running", "paused"}):
+            transfer["state"] = "cancelling"
+            self.browser_tab.cancel_request(transfer["request"])
+            self.refresh(transfer)
+
+    def retry_selected(self):
+        for transfer in self.selected({"failed", "cancelled"}):
+            self.start(transfer)
+
+    def clear_finished(self):
+        for transfer in [transfer for transfer in self.transfers if transfer["state"] not in TRANSFER_ACTIVE]:
+            self.transfers.remove(transfer)
+            self.tree.takeTopLevelItem(self.tree.indexOfTopLevelItem(transfer["item"]))
+        if not self.transfers:
+            self.hide()
+
+    def fail_active(self, message):
+        # Бэкенд завершился: ответов на незаконченные передачи уже не будет
+        for transfer in self.transfers:
+            if transfer["state"] in TRANSFER_ACTIVE:
+                transfer.update(state="failed", error=message, eta=None)
+                self.refresh(transfer)
+
+
+# Двоичный кадр бэкенда: 0x00, длины заголовка и данных, заголовок JSON, данные (см. src/framing.rs)
+FRAME_MARKER = 0
+FRAME_LENGTHS = struct.Struct("<II")
+FRAME_DIR = 1
+FRAME_MTIME = 2
+
+
+def decode_files(payload, count):
+    # Листинг колонками: флаги, размеры u64, mtime u32, имена через \0
+    if not count:
+        return []
+    sizes = array("Q")
+    sizes.frombytes(payload[count:count * 9])
+    mtimes = array("I")
+    mtimes.frombytes(payload[count * 9:count * 13])
+    if sys.byteorder == "big":
+        sizes.byteswap()
+        mtimes.byteswap()
+    names = payload[count * 13:].decode(errors="replace").split("\0")
+    return [{"name": name, "is_dir": bool(flags & FRAME_DIR), "size": size,
+             "mtime": mtime if flags & FRAME_MTIME else None}
+            for name, flags, size, mtime in zip(names, payload[:count], sizes, mtimes)]
+
+
+class ResponseReader:
+    # Инкрементальный разбор ответов: строки NDJSON и двоичные кадры вперемешку;
+    # ответ может прийти частями или несколько ответов за одно чтение
+    def __init__(self):
+        self.buffer = bytearray()
+        self.decoders = {}  # (id, поток) -> декодер UTF-8: символ может разрезать граница кадра
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        start = 0
+        while start < len(self.buffer):
+            if self.buffer[start] == FRAME_MARKER:
+                header_start = start + 1 + FRAME_LENGTHS.size
+                if len(self.buffer) < header_start:
+                    break
+                header_length, payload_length = FRAME_LENGTHS.unpack_from(self.buffer, start + 1)
+                end = header_start + header_length + payload_length
+                if len(self.buffer) < end:
+                    break
+                header = self.buffer[header_start:header_start + header_length].decode(errors="replace")
+                payload = bytes(self.buffer[header_start + header_length:end])
+                start = end
+                messages.append((header, self.decode_frame(json.loads(header), payload)))
+                continue
+            end = self.buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line = self.buffer[start:end].decode(errors="replace").strip()
+            start = end + 1
+            if not line:
+                continue
+            try:
+                response = json.loads(line)
+            except json.JSONDecodeError:
+                response = None
+            if not isinstance(response, dict):
+                response = None
+            elif self.decoders and response.get("status") not in PARTIAL_STATUSES:
+                self.decoders.pop((response.get("id"), "stdout"), None)
+                self.decoders.pop((response.get("id"), "stderr"), None)
+            messages.append((line, response))
+        del self.buffer[:start]
+        return messages
+
+    def decode_frame(self, header, payload):
+        status = header.get("status")
+        if status == "chunk":
+            # data — текст для терминала, raw — байты как есть
+            key = (header.get("id"), header.get("stream"))
+            decoder = self.decoders.get(key)
+            if decoder is None:
+                decoder = self.decoders[key] = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            header["data"] = decoder.decode(payload)
+            header["raw"] = payload
+        elif status == "files_page":
+            header["files"] = decode_files(payload, header.get("count", 0))
+        return header
+
+
+TRACE_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+TRACE_KEEP = 5000  # столько последних запросов хранится для перцентилей и экспорта
+# Этапы запроса: от отправки в stdin бэкенда до отрисовки ответа. Отметки received, done
+# и written ставит бэкенд, остальные — клиент; все в секундах от эпохи Unix
+TRACE_STAGES = [
+    ("pipe_in", "sent", "received"),
+    ("backend", "received", "done"),
+    ("write", "done", "written"),
+    ("pipe_out", "written", "read"),
+    ("parse", "read", "parsed"),
+    ("ui", "parsed", "handled"),
+    ("paint", "handled", "painted"),
+]
+TRACE_BACKEND_STAGES = {"backend", "write"}
+
+
+class RequestTracer:
+    # Трассировка запросов к бэкенду. Выключенная стоит одну проверку флага на отправку
+    # и одну на чтение из процесса
+    def __init__(self):
+        self.enabled = False
+        self.active = {}  # id запроса -> незаконченный span
+        self.reset()
+
+    def reset(self):
+        self.spans = deque(maxlen=TRACE_KEEP)
+        self.stats = {}  # команда -> счётчики и гистограмма
+
+    def start(self, request_id, envelope):
+        self.active[request_id] = {"id": request_id, "cmd": envelope.get("cmd"), "session": envelope.get("session"),
+                                   "sent": time.time(), "frames": 0, "bytes": 0, "items": 0}
+
+    def on_response(self, request_id, response, read, parsed):
+        span = self.active.get(request_id)
+        if span is None:
+            return
+        if response.get("status") in PARTIAL_STATUSES:
+            span.setdefault("first", parsed)
+            span["frames"] += 1
+            data = response.get("raw", response.get("data"))
+            if data is not None:
+                span["bytes"] += len(data)
+            span["items"] += len(response.get("files", ()))
+            return
+        del self.active[request_id]
+        span.update(read=read, parsed=parsed, handled=time.time(), status=response.get("status"))
+        trace = response.get("trace")
+        if trace:
+            for key in ("received", "done", "written"):
+                span[key] = trace[key + "_us"] / 1e6
+        # Перерисовка идёт в следующем проходе цикла событий, после обработчика ответа
+        QTimer.singleShot(0, lambda: self.complete(span))
+
+    def complete(self, span):
+        span["painted"] = time.time()
+        span["total_ms"] = (span["painted"] - span["sent"]) * 1000
+        self.spans.append(span)
+        stats = self.stats.get(span["cmd"])
+        if stats is None:
+            stats = self.stats[span["cmd"]] = {"count": 0, "errors": 0, "max_ms": 0.0, "busy_s": 0.0, "bytes": 0,
+                                               "items": 0, "buckets": [0] * (len(TRACE_BUCKETS_MS) + 1),
+                                               "stages_ms": {}, "stage_counts": {}}
+        stats["count"] += 1
+        stats["errors"] += span["status"] == "error"
+        stats["max_ms"] = max(stats["max_ms"], span["total_ms"])
+        stats["busy_s"] += span["total_ms"] / 1000
+        stats["bytes"] += span["bytes"]
+        stats["items"] += span["items"]
+        stats["buckets"][bisect.bisect_left(TRACE_BUCKETS_MS, span["total_ms"])] += 1
+        for stage, start, end in TRACE_STAGES:
+            if start in span and end in span:
+                stats["stages_ms"][stage] = stats["stages_ms"].get(stage, 0.0) + (span[end] - span[start]) * 1000
+                stats["stage_counts"][stage] = stats["stage_counts"].get(stage, 0) + 1
+
+    def percentile(self, cmd, fraction):
+        times = sorted(span["total_ms"] for span in self.spans if span["cmd"] == cmd)
+        if not times:
+            return None
+        return times[min(len(times) - 1, int(len(times) * fraction))]
+
+    def stage_mean(self, cmd, stage):
+        stats = self.stats[cmd]
+        count = stats["stage_counts"].get(stage)
+        return stats["stages_ms"][stage] / count if count else None
+
+    def export(self):
+        return {"buckets_ms": TRACE_BUCKETS_MS, "commands": self.stats, "requests": list(self.spans)}
+
+    def chrome_trace(self):
+        # Формат chrome://tracing и Perfetto: у каждого запроса своя дорожка, этапы вложены в него
+        events = [{"ph": "M", "name": "process_name", "pid": 1, "args": {"name": "ui"}},
+                  {"ph": "M", "name": "process_name", "pid": 2, "args": {"name": "ssh_backend"}}]
+        for span in self.spans:
+            args = {key: span[key] for key in ("session", "status", "frames", "bytes", "items")}
+            events.append({"name": span["cmd"], "cat": "request", "ph": "X", "pid": 1, "tid": span["id"],
+                           "ts": span["sent"] * 1e6, "dur": span["total_ms"] * 1000, "args": args})
+            for stage, start, end in TRACE_STAGES:
+                if start in span and end in span:
+                    pid = 2 if stage in TRACE_BACKEND_STAGES else 1
+                    events.append({"name": stage, "cat": span["cmd"], "ph": "X", "pid": pid, "tid": span["id"],
+                                   "ts": span[start] * 1e6, "dur": max(0.0, span[end] - span[start]) * 1e6})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+class BackendClient(QObject):
+    # Один процесс ssh_backend на всё приложение: каждая вкладка — сессия в нём, а вкладки
+    # к одному user@host:port делят одно SSH-соединение. Ответы находят вкладку по id запроса
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        super().__init__()
+        self.process = self.new_process()
+        self.reader = ResponseReader()
+        self.errors = b""  # незаконченная строка stderr
+        self.request_ids = itertools.count(1)
+        self.session_ids = itertools.count(1)
+        self.tabs = {}  # id сессии -> вкладка
+        self.routes = {}  # id запроса -> вкладка
+        self.tracer = RequestTracer()
+
+    def new_process(self):
+        # Сигналы процесса, который уже заменён новым, вкладкам не передаются: у него закрыт stdin,
+        # он дописывает ответы закрытым вкладкам и выходит сам
+        process = QProcess(self)
+        # stderr отдельно: строка лога посреди двоичного кадра сломала бы разбор ответов
+        process.setProcessChannelMode(QProcess.SeparateChannels)
+
+        def forward(handler):
+            def slot(*args):
+                if process is self.process:
+                    handler(*args)
+                elif process.state() == QProcess.NotRunning:
+                    process.deleteLater()
+                else:
+                    process.readAllStandardOutput()
+                    process.readAllStandardError()
+            return slot
+
+        process.readyReadStandardOutput.connect(forward(self.handle_output))
+        process.readyReadStandardError.connect(forward(self.handle_errors))
+        process.finished.connect(forward(self.on_finished))
+        process.errorOccurred.connect(forward(self.on_error))
+        return process
+
+    def register(self, tab):
+        session_id = f"tab-{next(self.session_ids)}"
+        self.tabs[session_id] = tab
+        return session_id
+
+    def release(self, tab):
+        self.tabs.pop(tab.session_id, None)
+        self.routes = {request_id: owner for request_id, owner in self.routes.items() if owner is not tab}
+        if not self.tabs and self.is_running():
+            # Последняя вкладка закрыта: бэкенд доотвечает и выйдет по концу stdin. Ждать его
+            # не нужно, а следующая вкладка запустит новый процесс
+            self.process.closeWriteChannel()
+            self.process = self.new_process()
+
+    def wait_closing(self, msecs):
+        # При выходе из приложения: процессы с закрытым stdin дописывают ответы, а не убиваются вместе с окном
+        for process in self.findChildren(QProcess):
+            if process is not self.process:
+                process.waitForFinished(msecs)
+
+    def is_running(self):
+        # Запускающийся процесс тоже считается: QProcess копит записанное и отдаст его после старта
+        return self.process.state() != QProcess.NotRunning
+
+    def start(self):
+        # Возвращает текст ошибки или None; уже запущенный процесс переиспользуется.
+        # Запуск не ждём: если процесс не поднимется, вкладки узнают об этом из on_error
+        if self.is_running():
+            return None
+        backend_path = Path("../target/debug/ssh_backend").absolute()
+        if not backend_path.exists():
+            return f"SSH backend not found at {backend_path}"
+        self.reader = ResponseReader()
+        self.errors = b""
+        self.process.start(str(backend_path))
+        # Вывод команд и листинги — двоичными кадрами; старый бэкенд ответит ошибкой и останется на JSON
+        self.process.write(b'{"cmd": "Hello", "binary": true}\n')
+        return None
+
+    def send(self, tab, envelope):
+        request_id = next(self.request_ids)
+        self.routes[request_id] = tab
+        envelope = dict(envelope, id=request_id, session=tab.session_id)
+        if self.tracer.enabled:
+            envelope["trace"] = True
+            self.tracer.start(request_id, envelope)
+        self.process.write((json.dumps(envelope) + "\n").encode())
+        return request_id
+
+    def notify(self, tab, envelope):
+        # Команда без id: бэкенд на неё не отвечает (ввод в shell)
+        self.process.write((json.dumps(dict(envelope, session=tab.session_id)) + "\n").encode())
+
+    def handle_output(self):
+        read = time.time() if self.tracer.active else None
+        data = self.process.readAllStandardOutput().data()
+        messages = self.reader.feed(data)
+        parsed = time.time() if read is not None else None
+        for line, response in messages:
+            if response is None:
+                # Не-JSON в stdout не принадлежит ни одной сессии
+                self.broadcast_text(line)
+                continue
+            request_id = response.get("id")
+            if request_id is None and response.get("session") in self.tabs:
+                # События соединения приходят без id, с именем сессии
+                self.tabs[response["session"]].on_link_event(response)
+                continue
+            if response.get("status") in PARTIAL_STATUSES:
+                tab = self.routes.get(request_id)
+            else:
+                tab = self.routes.pop(request_id, None)
+            if tab is not None:
+                tab.on_backend_response(response)
+            if read is not None:
+                self.tracer.on_response(request_id, response, read, parsed)
+
+    def handle_errors(self):
+        # stderr бэкенда (логи, паника) — текстом во все вкладки построчно
+        self.errors += self.process.readAllStandardError().data()
+        *lines, self.errors = self.errors.split(b"\n")
+        for line in lines:
+            self.broadcast_text(line.decode(errors="replace").rstrip())
+
+    def broadcast_text(self, text):
+        if not text:
+            return
+        for tab in list(self.tabs.values()):
+            tab.on_backend_text(text)
+
+    def on_error(self, error):
+        # Упавший после старта процесс сообщит о себе через finished
+        if error != QProcess.FailedToStart:
+            return
+        for tab in list(self.tabs.values()):
+            tab.on_backend_text(f"Error: Failed to start SSH backend: {self.process.errorString()}")
+        self.on_finished(-1, QProcess.CrashExit)
+
+    def on_finished(self, exit_code, exit_status):
+        # Последняя строка паники может прийти без перевода строки
+        self.broadcast_text(self.errors.decode(errors="replace").rstrip())
+        self.errors = b""
+        self.routes.clear()
+        self.tracer.active.clear()
+        for tab in list(self.tabs.values()):
+            tab.on_process_finished(exit_code, exit_status)
+
+
 class ConnectionDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -432,19 +1889,41 @@ class ConnectionDialog(QDialog):
 
 
 class BrowserTab(QWidget):
+    # connecting, connected или disconnected — для заголовка вкладки
+    state_changed = pyqtSignal(str)
+
     def __init__(self, connection_data=None, parent=None):
         super().__init__(parent)
         self.connection_data = connection_data or {}
-        self.process = QProcess()
-        self.process.setProcessChannelMode(QProcess.MergedChannels)
-        self.process.readyReadStandardOutput.connect(self.handle_output)
-        self.process.readyReadStandardError.connect(self.handle_error)
-        self.process.finished.connect(self.on_process_finished)
+        self.backend = BackendClient.instance()
+        self.session_id = self.backend.register(self)
+        self.pending = {}  # id запроса -> (команда, callback)
+        self.listing_request = None  # текущий SftpList удалённой панели
+        self.revalidating = set()  # каталоги, которые перечитываются в фоне
+        self.background_requests = set()  # id фоновых запросов, не мешающих пользователю
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(150)
+        self.refresh_timer.timeout.connect(lambda: self.list_remote(self.current_path))
+        self.connection_timeout = QTimer(self)
+        self.connection_timeout.setSingleShot(True)
+        self.connection_timeout.timeout.connect(self.check_connection_status)
+        self.listing_cache = ListingCache(
+            self.connection_data.get("listing_cache_entries", 200000),
+            self.connection_data.get("listing_cache_ttl", 30.0))
+        self.prefetcher = Prefetcher(self, self.connection_data.get("prefetch_count", 5),
+                                     self.connection_data.get("prefetch_per_minute", 30))
         self.connected = False
         self.current_path = None  # Будет установлено после подключения
         self.home_dir = None      # Домашняя директория на сервере
         
         self.setup_ui()
+        # Вкладка появляется сразу; чтение домашнего каталога, запуск бэкенда и подключение
+        # начинаются после того, как она отрисована
+        QTimer.singleShot(0, self.start)
+
+    def start(self):
+        self.local_file_view.update_files(QDir.homePath())
         self.connect_to_host()
     
     def setup_ui(self):
@@ -456,12 +1935,14 @@ class BrowserTab(QWidget):
         right_splitter = QSplitter(Qt.Vertical)
         
         self.local_file_view = UnifiedFileSystemView(self, is_remote=False)
-        self.local_file_view.update_files(QDir.homePath())
         
         self.remote_file_view = UnifiedFileSystemView(self, is_remote=True)
         
+        self.transfers = TransferPanel(self)
+        
         right_splitter.addWidget(self.local_file_view)
         right_splitter.addWidget(self.remote_file_view)
+        right_splitter.addWidget(self.transfers)
         
         splitter.addWidget(self.terminal)
         splitter.addWidget(right_splitter)
@@ -472,125 +1953,722 @@ class BrowserTab(QWidget):
         main_layout.addWidget(splitter)
     
     def disconnect(self):
-        if self.process.state() == QProcess.Running:
-            self.process.write(json.dumps({"cmd":"Disconnect"}).encode() + b'\n')
+        if self.backend.is_running():
+            self.send_command({"cmd": "Disconnect"})
             self.terminal.append_output("Disconnecting from server...")
     
+    def on_backend_text(self, line):
+        self.terminal.append_output(line)
+
     def on_process_finished(self, exit_code, exit_status):
         self.terminal.append_output(f"\nConnection closed (code: {exit_code})")
+        self.reset_session("Connection closed")
+
+    def reset_session(self, message):
+        # Ответов на незаконченные запросы этой сессии уже не будет
         self.connected = False
+        self.connection_timeout.stop()
+        self.state_changed.emit("disconnected")
+        self.terminal.running_request = None
+        self.pending.clear()
+        self.listing_cache.clear()
+        self.revalidating.clear()
+        self.background_requests.clear()
+        self.prefetcher.inflight = None
+        self.terminal.stop_shell(cancel=True)
+        self.transfers.fail_active(message)
     
     def connect_to_host(self):
-        backend_path = Path("../target/debug/ssh_backend").absolute()
-        
-        if not backend_path.exists():
-            self.terminal.append_output(f"Error: SSH backend not found at {backend_path}")
-            return
-        
-        self.process.start(str(backend_path))
-        
-        if not self.process.waitForStarted(5000):
-            self.terminal.append_output("Error: Failed to start SSH backend")
+        error = self.backend.start()
+        if error:
+            self.terminal.append_output(f"Error: {error}")
+            self.state_changed.emit("disconnected")
             return
+        self.state_changed.emit("connecting")
         
         connect_cmd = {
             "cmd": "Connect",
             "host": self.connection_data['host'],
             "port": int(self.connection_data['port']),
             "username": self.connection_data['username'],
+            # Домашний каталог и его листинг приходят вместе с ответом на Connect
+            "list_home": True,
         }
         
         if self.connection_data.get('password'):
             connect_cmd['password'] = self.connection_data['password']
         if self.connection_data.get('key'):
             connect_cmd['key'] = self.connection_data['key']
-        
-        json_str = json.dumps(connect_cmd) + "\n"
-        self.process.write(json_str.encode())
+        if self.connection_data.get('max_inflight'):
+            connect_cmd['max_inflight'] = self.connection_data['max_inflight']
+        for option in ('max_transfers', 'chunk_size', 'window', 'max_window', 'stripes', 'stripe_threshold',
+                       'keepalive_interval', 'keepalive_max', 'reconnect_attempts'):
+            if self.connection_data.get(option):
+                connect_cmd[option] = self.connection_data[option]
+        
+        self.send_command(connect_cmd)
         self.terminal.append_output(f"Connecting to {self.connection_data['username']}@{self.connection_data['host']}...")
-        
-        self.connection_timeout = QTimer(self)
-        self.connection_timeout.setSingleShot(True)
-        self.connection_timeout.timeout.connect(self.check_connection_status)
         self.connection_timeout.start(10000)
     
     def check_connection_status(self):
         if not self.connected:
             self.terminal.append_output("Error: Connection timeout")
-            self.process.terminate()
+            # Бэкенд общий, закрывается только сессия этой вкладки
+            self.disconnect()
+            self.reset_session("Connection timeout")
     
-    def handle_output(self):
-        data = self.process.readAllStandardOutput().data().decode().strip()
-        if not data:
+    def on_link_event(self, response):
+        state = response.get("state")
+        if state == "reconnecting":
+            self.terminal.append_output("Connection lost, reconnecting...")
+            self.state_changed.emit("connecting")
+        elif state == "connected":
+            self.terminal.append_output("Reconnected")
+            self.state_changed.emit("connected")
+            self.terminal.start_shell()
+            # Пока связи не было, каталоги на сервере могли измениться
+            self.listing_cache.clear()
+            if self.current_path and self.listing_request is None:
+                self.list_remote(self.current_path)
+        elif state == "lost":
+            message = response.get("message") or "Connection lost"
+            self.terminal.append_output(f"Error: {message}")
+            self.reset_session(message)
+
+    def on_backend_response(self, response):
+        request_id = response.get("id")
+        if request_id not in self.pending:
+            # Ответ на запрос, брошенный вместе с сессией
             return
-        
-        try:
-            response = json.loads(data)
-            if response.get("status") == "connected":
-                self.connected = True
-                self.connection_timeout.stop()
-                self.terminal.append_output("SSH connection established!")
-                
+        # Промежуточные кадры потоковых команд не завершают запрос
+        if response.get("status") in PARTIAL_STATUSES:
+            request, callback = self.pending[request_id]
+        else:
+            request, callback = self.pending.pop(request_id)
+            self.background_requests.discard(request_id)
+        if callback is not None:
+            callback(response)
+        else:
+            self.handle_response(response, request)
+
+    def handle_response(self, response, request=None):
+        status = response.get("status")
+        if status == "connected":
+            self.connected = True
+            self.connection_timeout.stop()
+            self.state_changed.emit("connected")
+            self.terminal.append_output("SSH connection established!")
+            timings = response.get("timings")
+            if timings:
+                details = ["shared connection"] if timings.get("reused") else []
+                details += [f"{phase} {timings.get(phase + '_ms', 0):.0f}"
+                            for phase in ("handshake", "auth", "channels", "home", "listing")]
+                self.terminal.append_output(f"Connected in {timings.get('total_ms', 0):.0f} ms ({', '.join(details)})")
+            self.terminal.start_shell()
+            
+            if response.get("home") is None:
                 # Запрашиваем домашнюю директорию
                 self.send_command({"cmd": "GetHomeDir"})
-                
-            elif response.get("status") == "home_dir":
-                self.home_dir = response.get("path")
-                self.current_path = self.home_dir
-                self.send_command({"cmd": "SftpList", "path": self.current_path})
+            else:
+                self.home_dir = self.current_path = response["home"]
+                if response.get("files") is not None:
+                    self.listing_cache.put(self.current_path, response["files"])
+                self.list_remote(self.current_path)
+            
+        elif status == "home_dir":
+            self.home_dir = response.get("path")
+            self.current_path = self.home_dir
+            self.list_remote(self.current_path)
 
-            elif response.get("status") == "ok":
-                self.terminal.append_output("Всё успешно выполнено")
-                
-            elif response.get("status") == "files":
-                files = response.get("files", [])
-                path = response.get("path", ".")
-                self.current_path = path if path != "." else self.home_dir  # Исправляем здесь
-                
-                # Форматируем вывод для команды ls
-                if len(files) > 0:
-                    file_list = "  ".join([f["name"] + ("/" if f.get("is_dir", False) else "") 
-                                        for f in files])
-                    self.terminal.append_output(file_list)
-                
+        elif status == "ok":
+            self.terminal.append_output("Всё успешно выполнено")
+            
+        elif status == "output":
+            self.terminal.append_output(response.get("output", ""))
+        elif status == "error":
+            self.terminal.append_output("Error: " + response.get("message", "Unknown error"))
+        elif status == "download_complete":
+            self.terminal.append_output(f"Download complete: {response.get('local')}")
+        elif status == "upload_complete":
+            self.terminal.append_output(f"Upload complete: {response.get('remote')}")
+            # Refresh remote file list
+            self.send_command({"cmd": "SftpList", "path": self.current_path})
+        elif status == "delete_complete":
+            self.terminal.append_output(f"Delete complete: {response.get('path')}")
+            # Refresh remote file list
+            self.send_command({"cmd": "SftpList", "path": self.current_path})
+        else:
+            self.terminal.append_output(json.dumps(response))
+    
+    def resolve_remote_path(self, path):
+        base = self.current_path or self.home_dir or "/"
+        if not path or path == ".":
+            path = base
+        elif path == "~" or path.startswith("~/"):
+            path = (self.home_dir or "/") + path[1:]
+        elif not path.startswith("/"):
+            path = posixpath.join(base, path)
+        return canonical_remote_path(path)
+
+    def list_remote(self, path, echo=False):
+        path = self.resolve_remote_path(path)
+        self.prefetcher.visit(path)
+        # Новый переход отменяет незаконченный листинг предыдущего каталога
+        if self.listing_request in self.pending:
+            self.cancel_request(self.listing_request)
+        self.listing_request = None
+        
+        cached = self.listing_cache.get(path)
+        if cached is not None:
+            files, fresh = cached
+            self.current_path = path
+            self.remote_file_view.update_files(files)
+            if echo:
+                self.echo_listing(files)
+            if not fresh:
+                self.revalidate(path)
+            return
+        
+        listing = {"path": path, "echo": echo, "started": False, "files": []}
+        listing["id"] = self.listing_request = self.send_command(
+            {"cmd": "SftpList", "path": path},
+            callback=lambda response: self.on_listing_frame(listing, response))
+
+    def echo_listing(self, files):
+        # Форматируем вывод для команды ls
+        if files:
+            self.terminal.append_output("  ".join(f["name"] + ("/" if f.get("is_dir", False) else "")
+                                                  for f in files))
+        else:
+            self.terminal.append_prompt()
+
+    def fetch_listing(self, path, on_done, background=False):
+        # Полный листинг в фоне, без показа в панели; on_done(files) или on_done(None) при ошибке
+        files = []
+
+        def on_frame(response):
+            status = response.get("status")
+            if status == "replay":
+                files.clear()
+            elif status == "files_page":
+                files.extend(response.get("files", []))
+            elif status == "files_end":
+                on_done(files)
+            elif status == "error":
+                on_done(None)
+        return self.send_command({"cmd": "SftpList", "path": path}, callback=on_frame, background=background)
+
+    def revalidate(self, path):
+        if path in self.revalidating:
+            return
+        self.revalidating.add(path)
+
+        def on_done(files):
+            self.revalidating.discard(path)
+            if files is None:
+                return
+            changed = self.listing_cache.peek(path) != files
+            self.listing_cache.put(path, files)
+            if changed and self.current_path == path and self.listing_request is None:
                 self.remote_file_view.update_files(files)
-                
-            elif response.get("status") == "output":
-                self.terminal.append_output(response.get("output", ""))
+        if self.fetch_listing(path, on_done, background=True) is None:
+            self.revalidating.discard(path)
+
+    def send_mutation(self, command_data, remote_path, callback=None):
+        # Свои изменения на сервере точно инвалидируют кэш: родительский каталог,
+        # а для удалённого каталога — и всё поддерево
+        remote_path = self.resolve_remote_path(remote_path)
+        parent = posixpath.dirname(remote_path) or "/"
+
+        def on_reply(response):
+            if callback is not None:
+                # Ход выполнения и сообщения — забота вызывающего, здесь только кэш
+                callback(response)
+                if response.get("status") in PARTIAL_STATUSES:
+                    return
             elif response.get("status") == "error":
                 self.terminal.append_output("Error: " + response.get("message", "Unknown error"))
-            elif response.get("status") == "download_complete":
-                self.terminal.append_output(f"Download complete: {response.get('local')}")
-            elif response.get("status") == "upload_complete":
-                self.terminal.append_output(f"Upload complete: {response.get('remote')}")
-                # Refresh remote file list
-                self.send_command({"cmd": "SftpList", "path": self.current_path})
-            elif response.get("status") == "delete_complete":
-                self.terminal.append_output(f"Delete complete: {response.get('path')}")
-                # Refresh remote file list
-                self.send_command({"cmd": "SftpList", "path": self.current_path})
             else:
-                self.terminal.append_output(data)
-        except json.JSONDecodeError:
-            self.terminal.append_output(data)
-    
-    def handle_error(self):
-        error = self.process.readAllStandardError().data().decode()
-        if error:
-            self.terminal.append_output("Error output:\n" + error)
-    
-    def send_command(self, command_data):
-        if self.process.state() == QProcess.Running:
-            json_str = json.dumps(command_data) + "\n"
-            self.process.write(json_str.encode())
+                self.terminal.append_output(f"{command_data['cmd']} {remote_path}: done")
+            self.listing_cache.invalidate(parent)
+            if command_data["cmd"] in ("SftpRmdir", "SftpUploadDir", "SftpSync"):
+                self.listing_cache.invalidate(remote_path, recursive=True)
+            if self.current_path == parent and not self.refresh_timer.isActive():
+                # Пачка загрузок в текущий каталог даёт одно обновление панели, а не по одному на файл
+                self.refresh_timer.start()
+        return self.send_command(command_data, callback=on_reply)
+
+    def on_listing_frame(self, listing, response):
+        if listing["id"] != self.listing_request:
+            return
+        status = response.get("status")
+        if status == "replay":
+            # Листинг начнётся заново: первая страница снова заменит содержимое панели
+            listing["files"] = []
+            listing["started"] = False
+        elif status == "files_page":
+            files = response.get("files", [])
+            listing["files"].extend(files)
+            if not listing["started"]:
+                # Первая страница показывается сразу, остальные дописываются
+                listing["started"] = True
+                self.current_path = listing["path"]
+                self.remote_file_view.update_files(files)
+            else:
+                self.remote_file_view.append_remote_files(files)
+        elif status == "files_end":
+            self.listing_request = None
+            self.remote_file_view.flush_pending_pages()
+            if not listing["started"]:
+                self.current_path = listing["path"]
+                self.remote_file_view.update_files([])
+            self.listing_cache.put(listing["path"], listing["files"])
+            if listing["echo"]:
+                self.echo_listing(listing["files"])
+        elif status == "error":
+            self.listing_request = None
+            if response.get("message") != "Cancelled":
+                self.terminal.append_output("Error: " + response.get("message", "Unknown error"))
+
+    def cancel_request(self, request_id):
+        self.send_command({"cmd": "Cancel", "target": request_id}, callback=self.on_cancel_reply)
+
+    def on_cancel_reply(self, response):
+        if response.get("status") == "error":
+            self.terminal.append_output("Error: " + response.get("message", "Unknown error"))
+
+    def has_user_requests(self):
+        return len(self.pending) > len(self.background_requests)
+
+    def send_command(self, command_data, callback=None, background=False):
+        if not self.backend.is_running():
+            return None
+        envelope = dict(command_data)
+        if background:
+            # Бэкенд выполняет фоновые команды в отдельном узком слоте
+            envelope["priority"] = "low"
+        request_id = self.backend.send(self, envelope)
+        self.pending[request_id] = (command_data, callback)
+        if background:
+            self.background_requests.add(request_id)
+        return request_id
+
+    def shutdown(self):
+        self.terminal.stop_shell(cancel=True)
+        self.disconnect()
+        self.backend.release(self)
+        self.terminal.release_scrollback()
+        self.local_file_view.stop_local_listing()
     
     def closeEvent(self, event):
-        self.disconnect()
-        if self.process.state() == QProcess.Running:
-            self.process.waitForFinished(1000)
+        self.shutdown()
         super().closeEvent(event)
 
 
+BROADCAST_COLUMNS = ["Result", "Hosts", "Time"]
+BROADCAST_TICK_MS = 1000
+# Хост, который отвечает во столько раз дольше медианы (и не меньше секунды), считается медленным
+SLOW_HOST_FACTOR = 3
+SLOW_HOST_COLOR = QColor(208, 128, 0)
+BROADCAST_STATES = {"ok": "OK", "failed": "Failed", "timeout": "Timed out"}
+
+
+def parse_hosts(text, default_user):
+    # "user@host:port" через запятую или пробел; без user — пользователь по умолчанию
+    targets = []
+    for entry in re.split(r"[\s,]+", text.strip()):
+        if not entry:
+            continue
+        user, _, address = entry.rpartition("@")
+        host, port = address, 22
+        if address.count(":") == 1:
+            host, _, port = address.partition(":")
+            port = int(port)
+        targets.append({"host": host, "port": port, "username": user or default_user})
+    return targets
+
+
+class BroadcastTab(QWidget):
+    # Одна команда сразу на группе хостов. Одинаковые результаты сворачиваются в одну строку
+    # со списком хостов под ней; ещё не ответившие хосты видны вместе со временем ожидания
+    def __init__(self, host_groups, defaults, parent=None):
+        super().__init__(parent)
+        self.backend = BackendClient.instance()
+        self.session_id = self.backend.register(self)
+        self.host_groups = host_groups
+        self.request = None
+        self.started = None
+        self.total = 0
+        self.groups = {}  # (state, code, output, error) -> строка группы
+        self.running = {}  # хост -> (строка, время старта)
+        self.results = {}  # хост -> host_result
+        
+        self.group = QComboBox()
+        self.group.addItem("Custom")
+        self.group.addItems(sorted(host_groups))
+        self.group.currentTextChanged.connect(self.on_group_changed)
+        self.hosts = QLineEdit()
+        self.hosts.setPlaceholderText("user@host[:port], ...")
+        self.username = QLineEdit(defaults.get("username", ""))
+        self.password = QLineEdit()
+        self.password.setEchoMode(QLineEdit.Password)
+        self.key_path = QLineEdit()
+        self.key_path.setPlaceholderText("Path to SSH key")
+        self.command = QLineEdit()
+        self.command.setPlaceholderText("Command to run on every host")
+        self.command.returnPressed.connect(self.run)
+        
+        self.concurrency = QSpinBox()
+        self.concurrency.setRange(1, 1000)
+        self.concurrency.setValue(defaults.get("concurrency", 32))
+        self.timeout = QSpinBox()
+        self.timeout.setRange(1, 3600)
+        self.timeout.setSuffix(" s")
+        self.timeout.setValue(defaults.get("timeout", 30))
+        self.run_button = QPushButton("Run")
+        self.run_button.clicked.connect(self.run)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel)
+        self.cancel_button.setEnabled(False)
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Parallel:"))
+        controls.addWidget(self.concurrency)
+        controls.addWidget(QLabel("Timeout per host:"))
+        controls.addWidget(self.timeout)
+        controls.addStretch()
+        controls.addWidget(self.run_button)
+        controls.addWidget(self.cancel_button)
+        
+        form = QFormLayout()
+        form.addRow("Group:", self.group)
+        form.addRow("Hosts:", self.hosts)
+        form.addRow("Username:", self.username)
+        form.addRow("Password:", self.password)
+        form.addRow("SSH Key:", self.key_path)
+        form.addRow("Command:", self.command)
+        form.addRow(controls)
+        
+        self.summary = QLabel()
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(BROADCAST_COLUMNS)
+        self.tree.setUniformRowHeights(True)
+        self.tree.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        for column in range(1, len(BROADCAST_COLUMNS)):
+            self.tree.header().setSectionResizeMode(column, QHeaderView.ResizeToContents)
+        self.tree.currentItemChanged.connect(self.show_output)
+        self.output = QPlainTextEdit()
+        self.output.setReadOnly(True)
+        font = QFont("Monospace")
+        font.setStyleHint(QFont.TypeWriter)
+        self.output.setFont(font)
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(self.tree)
+        splitter.addWidget(self.output)
+        splitter.setSizes([400, 200])
+        
+        layout = QVBoxLayout(self)
+        layout.addLayout(form)
+        layout.addWidget(self.summary)
+        layout.addWidget(splitter)
+        
+        self.tick = QTimer(self)
+        self.tick.setInterval(BROADCAST_TICK_MS)
+        self.tick.timeout.connect(self.update_running)
+
+    def on_group_changed(self, name):
+        if name in self.host_groups:
+            self.hosts.setText(self.host_groups[name])
+
+    def run(self):
+        if self.request is not None:
+            return
+        command = self.command.text().strip()
+        try:
+            targets = parse_hosts(self.hosts.text(), self.username.text().strip())
+        except ValueError:
+            QMessageBox.warning(self, "Error", "Port must be a number")
+            return
+        if not command or not targets:
+            QMessageBox.warning(self, "Error", "Hosts and Command are required")
+            return
+        if any(not target["username"] for target in targets):
+            QMessageBox.warning(self, "Error", "Username is required")
+            return
+        error = self.backend.start()
+        if error:
+            self.summary.setText(f"Error: {error}")
+            return
+        
+        envelope = {"cmd": "Broadcast", "targets": targets, "command": command,
+                    "concurrency": self.concurrency.value(), "timeout": self.timeout.value()}
+        if self.password.text():
+            envelope["password"] = self.password.text()
+        if self.key_path.text():
+            try:
+                with open(os.path.expanduser(self.key_path.text())) as f:
+                    envelope["private_key"] = f.read()
+            except OSError as e:
+                QMessageBox.warning(self, "Error", f"Cannot read SSH key: {e}")
+                return
+        
+        self.tree.clear()
+        self.output.clear()
+        self.groups.clear()
+        self.running.clear()
+        self.results.clear()
+        self.running_item = QTreeWidgetItem(["Running", "0", ""])
+        self.tree.addTopLevelItem(self.running_item)
+        self.running_item.setExpanded(True)
+        self.total = len(targets)
+        self.started = time.monotonic()
+        self.request = self.backend.send(self, envelope)
+        self.run_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.tick.start()
+        self.update_summary()
+
+    def cancel(self):
+        if self.request is not None:
+            self.backend.send(self, {"cmd": "Cancel", "target": self.request})
+
+    def on_backend_response(self, response):
+        if response.get("id") != self.request:
+            return
+        status = response.get("status")
+        if status == "host_started":
+            host = response["host"]
+            item = QTreeWidgetItem([host, "", "0 s"])
+            self.running_item.addChild(item)
+            self.running[host] = (item, time.monotonic())
+        elif status == "host_result":
+            self.add_result(response)
+        elif status in ("broadcast_end", "error"):
+            self.finish(response.get("message") if status == "error" else None)
+            return
+        else:
+            return
+        self.update_summary()
+
+    def add_result(self, result):
+        host = result["host"]
+        self.results[host] = result
+        item, _ = self.running.pop(host, (None, None))
+        if item is not None:
+            self.running_item.removeChild(item)
+        # Одинаковый вывод с одинаковым исходом — одна строка на все такие хосты
+        key = (result["state"], result.get("code"), result.get("output", ""), result.get("error"))
+        group = self.groups.get(key)
+        if group is None:
+            text = (result.get("output") or result.get("error") or "").strip()
+            first = text.splitlines()[0] if text else "(no output)"
+            label = BROADCAST_STATES.get(result["state"], result["state"])
+            if result.get("code"):
+                label += f" (exit {result['code']})"
+            group = self.groups[key] = QTreeWidgetItem([f"{label}: {first}", "0", ""])
+            group.setData(0, Qt.UserRole, host)
+            group.setToolTip(0, text)
+            if result["state"] != "ok":
+                group.setForeground(0, QColor(Qt.red))
+            self.tree.addTopLevelItem(group)
+        child = QTreeWidgetItem([host, "", f"{result['elapsed_ms'] / 1000:.1f} s"])
+        child.setData(0, Qt.UserRole, host)
+        group.addChild(child)
+        group.setText(1, str(group.childCount()))
+        self.mark_slow()
+
+    def slow_threshold(self):
+        times = sorted(result["elapsed_ms"] / 1000 for result in self.results.values())
+        if not times:
+            return None
+        return max(1.0, times[len(times) // 2] * SLOW_HOST_FACTOR)
+
+    def mark_slow(self):
+        threshold = self.slow_threshold()
+        if threshold is None:
+            return
+        for group in self.groups.values():
+            for index in range(group.childCount()):
+                child = group.child(index)
+                if self.results[child.text(0)]["elapsed_ms"] / 1000 > threshold:
+                    child.setForeground(2, SLOW_HOST_COLOR)
+
+    def update_running(self):
+        now = time.monotonic()
+        threshold = self.slow_threshold()
+        for item, started in self.running.values():
+            waited = now - started
+            item.setText(2, f"{waited:.0f} s")
+            if threshold is not None and waited > threshold:
+                item.setForeground(2, SLOW_HOST_COLOR)
+        self.update_summary()
+
+    def update_summary(self, error=None):
+        counts = {state: 0 for state in BROADCAST_STATES}
+        for result in self.results.values():
+            counts[result["state"]] = counts.get(result["state"], 0) + 1
+        self.running_item.setText(1, str(len(self.running)))
+        parts = [f"{len(self.results)}/{self.total} hosts", f"{counts['ok']} ok", f"{counts['failed']} failed",
+                 f"{counts['timeout']} timed out"]
+        if self.running:
+            parts.append(f"{len(self.running)} running")
+        if self.results:
+            slowest = max(self.results.values(), key=lambda result: result["elapsed_ms"])
+            parts.append(f"slowest {slowest['host']} {slowest['elapsed_ms'] / 1000:.1f} s")
+        if self.started is not None:
+            parts.append(f"elapsed {time.monotonic() - self.started:.1f} s")
+        if error:
+            parts.append(f"Error: {error}")
+        self.summary.setText(", ".join(parts))
+
+    def finish(self, error=None):
+        self.update_summary(error)
+        self.request = None
+        self.started = None
+        self.tick.stop()
+        self.run_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+    def show_output(self, item, previous=None):
+        host = item.data(0, Qt.UserRole) if item is not None else None
+        result = self.results.get(host)
+        if result is None:
+            self.output.clear()
+            return
+        text = result.get("output", "")
+        if result.get("truncated"):
+            text += "\n[output truncated]"
+        if result.get("error"):
+            text += ("\n" if text else "") + "Error: " + result["error"]
+        self.output.setPlainText(text)
+
+    def on_link_event(self, response):
+        pass
+
+    def on_backend_text(self, line):
+        self.output.appendPlainText(line)
+
+    def on_process_finished(self, exit_code, exit_status):
+        if self.request is not None:
+            self.finish(f"Backend exited (code: {exit_code})")
+
+    def shutdown(self):
+        self.cancel()
+        self.backend.release(self)
+
+
+TRACE_COLUMNS = ["Command", "Count", "Errors", "p50 ms", "p95 ms", "Max ms"] + \
+    [f"{stage} ms" for stage, _, _ in TRACE_STAGES] + ["Throughput"]
+TRACE_REFRESH_MS = 1000
+
+
+class TracePanel(QWidget):
+    # Отладочная панель трассировки: задержки по типам команд, средние по этапам и гистограмма
+    # выбранной команды; собранное выгружается в JSON или в формат chrome://tracing
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tracer = BackendClient.instance().tracer
+        
+        self.enabled = QCheckBox("Trace requests")
+        self.enabled.setChecked(self.tracer.enabled)
+        self.enabled.toggled.connect(self.set_enabled)
+        reset_button = QPushButton("Reset")
+        reset_button.clicked.connect(self.reset)
+        json_button = QPushButton("Export JSON...")
+        json_button.clicked.connect(lambda: self.export("JSON (*.json)", self.tracer.export))
+        chrome_button = QPushButton("Export Chrome Trace...")
+        chrome_button.clicked.connect(lambda: self.export("Chrome trace (*.json)", self.tracer.chrome_trace))
+        controls = QHBoxLayout()
+        controls.addWidget(self.enabled)
+        controls.addStretch()
+        controls.addWidget(reset_button)
+        controls.addWidget(json_button)
+        controls.addWidget(chrome_button)
+        
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(TRACE_COLUMNS)
+        self.tree.setRootIsDecorated(False)
+        self.tree.setUniformRowHeights(True)
+        self.tree.header().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.tree.currentItemChanged.connect(self.show_histogram)
+        self.histogram = QPlainTextEdit()
+        self.histogram.setReadOnly(True)
+        font = QFont("Monospace")
+        font.setStyleHint(QFont.TypeWriter)
+        self.histogram.setFont(font)
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(self.tree)
+        splitter.addWidget(self.histogram)
+        splitter.setSizes([300, 200])
+        
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(splitter)
+        
+        self.items = {}  # команда -> строка таблицы
+        self.tick = QTimer(self)
+        self.tick.setInterval(TRACE_REFRESH_MS)
+        self.tick.timeout.connect(self.refresh)
+        self.tick.start()
+        self.refresh()
+
+    def set_enabled(self, enabled):
+        self.tracer.enabled = enabled
+        if not enabled:
+            self.tracer.active.clear()
+
+    def reset(self):
+        self.tracer.reset()
+        self.tree.clear()
+        self.items.clear()
+        self.histogram.clear()
+
+    def refresh(self):
+        for cmd, stats in sorted(self.tracer.stats.items()):
+            item = self.items.get(cmd)
+            if item is None:
+                item = self.items[cmd] = QTreeWidgetItem([cmd])
+                self.tree.addTopLevelItem(item)
+            values = [stats["count"], stats["errors"], self.tracer.percentile(cmd, 0.5),
+                      self.tracer.percentile(cmd, 0.95), stats["max_ms"]]
+            values += [self.tracer.stage_mean(cmd, stage) for stage, _, _ in TRACE_STAGES]
+            for column, value in enumerate(values, 1):
+                item.setText(column, "" if value is None else f"{value:.1f}" if isinstance(value, float) else str(value))
+            item.setText(len(TRACE_COLUMNS) - 1, self.throughput(stats))
+        self.show_histogram(self.tree.currentItem())
+
+    def throughput(self, stats):
+        if not stats["busy_s"]:
+            return ""
+        if stats["bytes"]:
+            return f"{format_size(int(stats['bytes'] / stats['busy_s']))}/s"
+        if stats["items"]:
+            return f"{stats['items'] / stats['busy_s']:.0f} entries/s"
+        return f"{stats['count'] / stats['busy_s']:.1f} req/s"
+
+    def show_histogram(self, item, previous=None):
+        stats = self.tracer.stats.get(item.text(0)) if item is not None else None
+        if stats is None:
+            self.histogram.clear()
+            return
+        peak = max(stats["buckets"]) or 1
+        labels = [f"<= {bound} ms" for bound in TRACE_BUCKETS_MS] + [f"> {TRACE_BUCKETS_MS[-1]} ms"]
+        self.histogram.setPlainText("\n".join(f"{label:>12} {count:>7} {'#' * round(count * 50 / peak)}"
+                                              for label, count in zip(labels, stats["buckets"])))
+
+    def export(self, file_filter, build):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Trace", "trace.json", file_filter)
+        if not path:
+            return
+        try:
+            with open(path, "w") as f:
+                json.dump(build(), f)
+        except OSError as e:
+            QMessageBox.warning(self, "Error", f"Cannot write {path}: {e}")
+
+    def shutdown(self):
+        self.tick.stop()
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -625,13 +2703,49 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(self.tab_widget)
         
         self.apply_theme()
-        
+
+    def open_first_tab(self):
+        # Вызывается, когда окно уже показано: диалог подключения не задерживает первую отрисовку
         if not self.add_new_tab():
             self.close()
     
     def load_settings(self):
         self.font_size = self.settings.value("font-size", 12, int)
         self.theme = self.settings.value("theme", "light", str)
+        self.max_inflight = self.settings.value("max-inflight", 8, int)
+        self.scrollback_lines = self.settings.value("scrollback-lines", 10000, int)
+        self.scrollback_chars = self.settings.value("scrollback-chars", 0, int)
+        self.scrollback_spill = self.settings.value("scrollback-spill", False, bool)
+        # Терминал — интерактивный shell с PTY; false — старый режим, команда за командой через Exec
+        self.terminal_shell = self.settings.value("terminal-shell", True, bool)
+        # Группы для рассылки команды: [host-groups] web=deploy@web1, deploy@web2:2222
+        self.host_groups = {}
+        self.settings.beginGroup("host-groups")
+        for name in self.settings.childKeys():
+            hosts = self.settings.value(name, "")
+            self.host_groups[name] = ", ".join(hosts) if isinstance(hosts, list) else str(hosts)
+        self.settings.endGroup()
+        self.broadcast_concurrency = self.settings.value("broadcast-concurrency", 32, int)
+        self.broadcast_timeout = self.settings.value("broadcast-timeout", 30, int)
+        self.listing_cache_entries = self.settings.value("listing-cache-entries", 200000, int)
+        self.listing_cache_ttl = self.settings.value("listing-cache-ttl", 30.0, float)
+        self.prefetch_count = self.settings.value("prefetch-count", 5, int)
+        self.prefetch_per_minute = self.settings.value("prefetch-per-minute", 30, int)
+        self.max_transfers = self.settings.value("max-transfers", 4, int)
+        self.verify_transfers = self.settings.value("transfer-verify", False, bool)
+        # Передача файлов: размер запроса SFTP (байт) и окно запросов в полёте; 0 — значение бэкенда
+        self.chunk_size = self.settings.value("transfer-chunk-size", 0, int)
+        self.window = self.settings.value("transfer-window", 0, int)
+        self.max_window = self.settings.value("transfer-max-window", 0, int)
+        # Большие файлы идут полосами по нескольким SFTP-каналам; 0 — значение бэкенда
+        self.stripes = self.settings.value("transfer-stripes", 0, int)
+        self.stripe_threshold = self.settings.value("transfer-stripe-threshold-mb", 0, int) * 1024 * 1024
+        # Keepalive (секунды, число пропусков до разрыва) и попытки переподключения; 0 — значение бэкенда
+        self.keepalive_interval = self.settings.value("keepalive-interval", 0, int)
+        self.keepalive_max = self.settings.value("keepalive-max", 0, int)
+        self.reconnect_attempts = self.settings.value("reconnect-attempts", 0, int)
+        # Трассировка запросов с самого старта; иначе её включают в панели Request Tracing
+        BackendClient.instance().tracer.enabled = self.settings.value("trace-requests", False, bool)
     
     def save_settings(self):
         self.settings.setValue("font-size", self.font_size)
@@ -649,7 +2763,7 @@ class MainWindow(QMainWindow):
                     background-color: #333;
                     color: #eee;
                 }
-                QTextEdit, QTreeView, QLineEdit, QSpinBox, QComboBox {
+                QTextEdit, QPlainTextEdit, QTreeView, QLineEdit, QSpinBox, QComboBox {
                     background-color: #444;
                     color: #eee;
                     border: 1px solid #555;
@@ -718,6 +2832,13 @@ class MainWindow(QMainWindow):
         
         menu.addMenu(font_menu)
         menu.addMenu(theme_menu)
+        menu.addSeparator()
+        broadcast_action = QAction("Broadcast Command...", self)
+        broadcast_action.triggered.connect(self.add_broadcast_tab)
+        menu.addAction(broadcast_action)
+        trace_action = QAction("Request Tracing...", self)
+        trace_action.triggered.connect(self.add_trace_tab)
+        menu.addAction(trace_action)
         
         menu.exec_(self.sender().mapToGlobal(self.sender().rect().bottomLeft()))
     
@@ -738,6 +2859,25 @@ class MainWindow(QMainWindow):
                 'host': dialog.host.text(),
                 'port': dialog.port.text(),
                 'username': dialog.username.text(),
+                'max_inflight': self.max_inflight,
+                'scrollback_lines': self.scrollback_lines,
+                'scrollback_chars': self.scrollback_chars,
+                'scrollback_spill': self.scrollback_spill,
+                'shell': self.terminal_shell,
+                'listing_cache_entries': self.listing_cache_entries,
+                'listing_cache_ttl': self.listing_cache_ttl,
+                'prefetch_count': self.prefetch_count,
+                'prefetch_per_minute': self.prefetch_per_minute,
+                'max_transfers': self.max_transfers,
+                'verify_transfers': self.verify_transfers,
+                'chunk_size': self.chunk_size,
+                'window': self.window,
+                'max_window': self.max_window,
+                'stripes': self.stripes,
+                'stripe_threshold': self.stripe_threshold,
+                'keepalive_interval': self.keepalive_interval,
+                'keepalive_max': self.keepalive_max,
+                'reconnect_attempts': self.reconnect_attempts,
             }
             
             if dialog.password.text():
@@ -758,19 +2898,38 @@ class MainWindow(QMainWindow):
                 return self.add_new_tab()
             
             tab = BrowserTab(connection_data)
-            tab_index = self.tab_widget.addTab(
-                tab, 
-                f"{connection_data['username']}@{connection_data['host']}"
-            )
+            title = f"{connection_data['username']}@{connection_data['host']}"
+            tab.state_changed.connect(lambda state, tab=tab: self.on_tab_state(tab, title, state))
+            tab_index = self.tab_widget.addTab(tab, f"{title} (connecting)")
             self.tab_widget.setCurrentIndex(tab_index)
             return True
         return False
     
+    def on_tab_state(self, tab, title, state):
+        index = self.tab_widget.indexOf(tab)
+        if index != -1:
+            self.tab_widget.setTabText(index, title if state == "connected" else f"{title} ({state})")
+
+    def add_broadcast_tab(self):
+        current = self.tab_widget.currentWidget()
+        defaults = {"concurrency": self.broadcast_concurrency, "timeout": self.broadcast_timeout}
+        if isinstance(current, BrowserTab):
+            defaults["username"] = current.connection_data.get("username", "")
+        tab = BroadcastTab(self.host_groups, defaults)
+        self.tab_widget.setCurrentIndex(self.tab_widget.addTab(tab, "Broadcast"))
+
+    def add_trace_tab(self):
+        for index in range(self.tab_widget.count()):
+            if isinstance(self.tab_widget.widget(index), TracePanel):
+                self.tab_widget.setCurrentIndex(index)
+                return
+        self.tab_widget.setCurrentIndex(self.tab_widget.addTab(TracePanel(), "Tracing"))
+
     def close_tab(self, index):
         widget = self.tab_widget.widget(index)
-        if hasattr(widget, 'process') and widget.process.state() == QProcess.Running:
-            widget.process.write(json.dumps({"cmd":"Disconnect"}).encode() + b'\n')
-            widget.process.waitForFinished(1000)
+        if isinstance(widget, (BrowserTab, BroadcastTab, TracePanel)):
+            # Соединение и процесс бэкенда остаются другим вкладкам
+            widget.shutdown()
         
         self.tab_widget.removeTab(index)
         
@@ -782,9 +2941,9 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     app.setStyle("Fusion")
     window = MainWindow()
-    
-    if window.tab_widget.count() > 0:
-        window.show()
-        sys.exit(app.exec_())
-    else:
-        sys.exit(0)
\ No newline at end of file
+    window.show()
+    QTimer.singleShot(0, window.open_first_tab)
+    code = app.exec_()
+    if BackendClient._instance is not None:
+        BackendClient._instance.wait_closing(1000)
+    sys.exit(code)
\ No newline at end of file
@@ -0,0 +1,75 @@
+# Разбор ответов бэкенда на стороне интерфейса: кадры в том виде, в каком их пишет
+# src/framing.rs, и строки JSON вперемешку с ними.
+#
+#   cd ui && python -m unittest test_framing
+import json
+import struct
+import unittest
+
+from main import ResponseReader, decode_files
+
+
+def frame(header, payload=b""):
+    header = json.dumps(header).encode()
+    return b"\0" + struct.pack("<II", len(header), len(payload)) + header + payload
+
+
+def files_payload(files):
+    payload = bytes((1 if is_dir else 0) | (2 if mtime is not None else 0) for _, is_dir, _, mtime in files)
+    payload += b"".join(struct.pack("<Q", size) for _, _, size, _ in files)
+    payload += b"".join(struct.pack("<I", mtime or 0) for _, _, _, mtime in files)
+    return payload + "\0".join(name for name, _, _, _ in files).encode()
+
+
+class ResponseReaderTest(unittest.TestCase):
+    def test_frames_and_lines_mixed(self):
+        data = (frame({"id": 1, "status": "chunk", "stream": "stdout"}, b"\0\n\xff")
+                + b'{"id": 1, "status": "end"}\n'
+                + frame({"id": 2, "status": "files_page", "count": 0}))
+        messages = [response for _, response in ResponseReader().feed(data)]
+        self.assertEqual(messages[0]["raw"], b"\0\n\xff")
+        self.assertEqual(messages[0]["data"], "\0\n�")
+        self.assertEqual(messages[1], {"id": 1, "status": "end"})
+        self.assertEqual(messages[2]["files"], [])
+
+    def test_byte_by_byte(self):
+        data = frame({"id": 3, "status": "chunk", "stream": "stdout"}, b"hello") + b'{"id": 3, "status": "ok"}\n'
+        reader = ResponseReader()
+        messages = []
+        for index in range(len(data)):
+            messages += reader.feed(data[index:index + 1])
+        self.assertEqual([response["status"] for _, response in messages], ["chunk", "ok"])
+        self.assertEqual(messages[0][1]["raw"], b"hello")
+        self.assertEqual(reader.buffer, bytearray())
+
+    def test_utf8_split_between_frames(self):
+        encoded = "привет".encode()
+        reader = ResponseReader()
+        first = reader.feed(frame({"id": 4, "status": "chunk", "stream": "stdout"}, encoded[:3]))
+        second = reader.feed(frame({"id": 4, "status": "chunk", "stream": "stdout"}, encoded[3:]))
+        self.assertEqual(first[0][1]["data"] + second[0][1]["data"], "привет")
+
+    def test_bad_line(self):
+        messages = ResponseReader().feed(b"not json\n[1]\n")
+        self.assertEqual([response for _, response in messages], [None, None])
+
+
+class DecodeFilesTest(unittest.TestCase):
+    def test_columns(self):
+        files = [("dir", True, 4096, 1700000000), ("файл", False, 1 << 40, None), ("", False, 0, 0)]
+        decoded = decode_files(files_payload(files), len(files))
+        self.assertEqual(decoded, [
+            {"name": "dir", "is_dir": True, "size": 4096, "mtime": 1700000000},
+            {"name": "файл", "is_dir": False, "size": 1 << 40, "mtime": None},
+            {"name": "", "is_dir": False, "size": 0, "mtime": 0},
+        ])
+
+    def test_through_reader(self):
+        files = [("a", False, 1, 2), ("b", True, 3, None)]
+        data = frame({"id": 5, "status": "files_page", "count": 2}, files_payload(files))
+        (_, response), = ResponseReader().feed(data)
+        self.assertEqual([entry["name"] for entry in response["files"]], ["a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
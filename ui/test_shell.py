@@ -0,0 +1,61 @@
+# Удалённый shell в TerminalWidget: разбор правок строки ввода от readline и отмена
+# shell на бэкенде, когда вкладка закрывается.
+#
+#   cd ui && python -m unittest test_shell
+import sys
+import unittest
+from types import SimpleNamespace
+
+from PyQt5.QtWidgets import QApplication
+
+from main import ShellLine, TerminalWidget
+
+
+class ShellLineTest(unittest.TestCase):
+    def test_readline_edits(self):
+        shell = ShellLine()
+        self.assertEqual(shell.feed("$ lss\b\x1b[K\n"), ["$ ls"])
+        self.assertEqual(shell.feed("$ echo x\r$ \x1b[Kpwd\n"), ["$ pwd"])
+        self.assertEqual(shell.feed("abc\x1b[2D\x1b[P\n"), ["ac"])
+        self.assertEqual(shell.feed("ab\x1b[1G\x1b[@X\n"), ["Xab"])
+
+    def test_colors_dropped(self):
+        self.assertEqual(ShellLine().feed("\x1b[01;32mok\x1b[0m\n"), ["ok"])
+
+    def test_escape_split_between_frames(self):
+        shell = ShellLine()
+        self.assertEqual(shell.feed("abc\x1b["), [])
+        self.assertEqual(shell.feed("1D\x1b[K\n"), ["ab"])
+        self.assertEqual(shell.feed("partial"), [])
+        self.assertEqual(shell.line, "partial")
+
+
+class StopShellTest(unittest.TestCase):
+    def setUp(self):
+        self.app = QApplication.instance() or QApplication(sys.argv)
+        self.sent = []
+        self.tab = SimpleNamespace(connection_data={"username": "u", "host": "h"}, current_path="/", home_dir="/",
+                                   send_command=self.send_command)
+        self.terminal = TerminalWidget(browser_tab=self.tab)
+
+    def send_command(self, command, callback=None):
+        self.sent.append(command)
+        return len(self.sent)
+
+    def test_cancel_running_shell(self):
+        self.terminal.start_shell()
+        self.terminal.stop_shell(cancel=True)
+        self.assertEqual(self.sent[-1], {"cmd": "Cancel", "target": 1})
+        self.assertIsNone(self.terminal.shell_request)
+        # Второй раз отменять уже нечего
+        self.terminal.stop_shell(cancel=True)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_shell_closed_by_server(self):
+        self.terminal.start_shell()
+        self.terminal.on_shell_frame({"status": "end"})
+        self.assertEqual([command["cmd"] for command in self.sent], ["Shell"])
+
+
+if __name__ == "__main__":
+    unittest.main()